@@ -1,16 +1,37 @@
-from email.message import EmailMessage
-import smtplib
-from pydantic import BaseModel
 import streamlit as st
-import openai
-from openai import beta
-import json
+import functools
 import os
+import threading
 import traceback as tb
+import uuid
+from email_validator import EmailNotValidError, validate_email
+
+import gpt
+import http_pool
+import metrics
+import predication as document
+import retrieval
+import routing
+import translation
+import variants
+from completion_cache import CompletionCache
+from key_messages_store import KeyMessagesStore
+from liturgical_calendar import liturgical_day
+from mailer import MailQueue
+from prefetch import PREFETCH_INSPIRATIONS, Prefetcher
+from prompt_budget import assemble_predication_prompt, assemble_section_prompt, fit_prompt
+from scheduler import get_scheduler
+from semantic_cache import SemanticCache
+from session_store import DRAFT_KEYS, OFFLOADED_KEYS, SessionStore
+from subscriptions import SubscriberStore, confirmation_email
+from prompts import (KeyMessagesSchema, LANGUAGES, PROFILES, THEMES, combined_inspirations_prompt, inspiration_prompts,
+                     inspirations_schema, predication_schema, split_inspirations, topic_prompt)
 
 DEBUG = False
+METHODS = ["No Input", "Select a Theme", "Custom Input"]
 
-OPENAI_MODEL="gpt-4o-mini"
+# Maximum number of OpenAI requests sent at the same time by "Generate all inspirations"
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", 6))
 ### Streamlit config ###
 st.set_page_config(
     page_title="Predication Generator",
@@ -22,59 +43,125 @@ st.set_page_config(
 ######################
 if not os.getenv("OPENAI_API_KEY"):
     st.error("Error: OPENAI_API_KEY is not set in the environment variables.")
-client = openai.OpenAI()
 
-# Schemas for GPT JSON structure output
-class KeyMessagesSchema(BaseModel):
-    """Use this class for JSON structured output as {"key_messages": [msg1, msg2...]}"""
-    key_messages: list[str]
+@st.cache_resource
+def get_openai_client():
+    """One OpenAI client per server process, on the shared pool of connections (see http_pool.py)."""
+    return http_pool.get_client()  # retries are done by the request scheduler
+
+client = get_openai_client()
+
+@st.cache_resource
+def get_completion_cache():
+    """One completion cache per server process, shared by every session."""
+    return CompletionCache()
+
+completion_cache = get_completion_cache()
+
+@st.cache_resource
+def get_semantic_cache():
+    """Answers to free-text requests, matched on meaning, shared by every session."""
+    return SemanticCache()
+
+semantic_cache = get_semantic_cache()
+
+@st.cache_resource
+def get_key_messages_store():
+    """Key messages of the day and of the built-in themes, shared by every session and warmed up
+    in the background when the server starts (unless WARM_UP_KEY_MESSAGES=0)."""
+    store = KeyMessagesStore(client, completion_cache)
+    if os.getenv("WARM_UP_KEY_MESSAGES", "1") != "0":
+        threading.Thread(target=store.warm_up, daemon=True).start()
+    return store
+
+key_messages_store = get_key_messages_store()
+
+@st.cache_resource
+def get_prefetcher():
+    """Inspirations of the displayed key messages generated ahead of the choice (PREFETCH_INSPIRATIONS=1)."""
+    return Prefetcher(client, completion_cache)
 
-def generate_chatgpt_responses(prompt=None, response_format=None):
+prefetcher = get_prefetcher()
+
+@st.cache_resource
+def get_retriever():
+    """Local index of doctrinal texts and scripture quoted by the grounded inspirations (see retrieval.py)."""
+    return retrieval.get_retriever()
+
+retriever = get_retriever()
+
+@st.cache_resource
+def start_metrics_server():
+    """Prometheus `/metrics` endpoint on METRICS_HOST:METRICS_PORT, unless METRICS_PORT=0."""
+    if metrics.METRICS_PORT:
+        try:
+            return metrics.start_http_server()
+        except OSError as e:
+            print(f"Metrics endpoint not started: {e}")
+
+start_metrics_server()
+
+def queue_status(placeholder):
+    """`on_wait` callback showing the position in the OpenAI request queue instead of an error."""
+    def on_wait(position, eta):
+        if position is None:
+            placeholder.info(f"OpenAI is busy, retrying in {eta:.0f}s...")
+        else:
+            placeholder.info(f"Waiting for OpenAI: {position} request(s) ahead of yours, about {eta:.0f}s.")
+    return on_wait
+
+def generate_chatgpt_responses(prompt=None, response_format=None, regenerate=None, cache_ttl=None, stream=False, step=None,
+                               max_tokens=None, timings=None, semantic_key=None, n=1):
     """Return the result of asking a simple completion with the system prompt and the passed 
-    `prompt`. Can stick to a JSON schema when supplied with a response_format Pydantic class."""
-    system_prompts = {
-    "English": "You are an assistant that helps preachers find inspiration. Please ALWAYS reply in ENGLISH. Only produce the requested text and avoid openers like 'Certainly! Here’s what you asked {sermon}'. Instead, just output what the sermon is.",
-    "French": "Vous aidez les prédicateurs à trouver l'inspiration. Répondez TOUJOURS en FRANÇAIS. Donnez uniquement le sermon demandé et évitez les introductions comme 'Voici ce que vous avez demandé {sermon}'. Juste le sermon demandé.",
-    "Spanish": "Ayudas a los predicadores a encontrar inspiración. Responde SIEMPRE en ESPAÑOL. Solo da el texto solicitado y evita introducciones como 'Aquí tienes lo que pediste {sermón}'. Solo el sermón pedido."
-}
-
-
-    system_prompt = system_prompts[st.session_state["LANGUAGE"]]
-
-    messages=[
-        {
-            "role" : "system",
-            "content" : system_prompt
-        },
-        {
-            "role": "user",
-            "content": prompt,
-        }
-    ]
+    `prompt`. Can stick to a JSON schema when supplied with a response_format Pydantic class.
+    Identical requests are served from the completion cache for `cache_ttl` seconds unless
+    `regenerate` is set (defaults to the sidebar "Regenerate" switch).
+    With `stream=True` the answer is written to the page token by token while it is generated
+    (the text of its fields with a `response_format`) and its time-to-first-token is appended to
+    `st.session_state["TTFT"]`.
+    `step` names the call in the metrics and `max_tokens` caps the answer. `timings` receives the
+    measures of the call (see `gpt.complete`).
+    With a `semantic_key` (the free text typed by the user) the answer of a near-identical text
+    is taken from the semantic cache.
+    With `n` > 1 the list of `n` answers of a single request is returned (not streamed)."""
+    if regenerate is None:
+        regenerate = st.session_state.get("REGENERATE", False)
+    if semantic_key and not regenerate:
+        completion, similarity, cached_text = semantic_cache.lookup(semantic_key, st.session_state["LANGUAGE"], step)
+        if completion is not None:
+            if DEBUG:
+                st.text(f"DEBUG: answer of {cached_text!r} reused, similarity {similarity:.2f}")
+            return completion
+
+    timings = {} if timings is None else timings
+    on_token = None
+    status = st.empty()
+    if stream:
+        placeholder = st.empty()
+        on_token = placeholder.markdown
+        if response_format is not None:
+            on_token = lambda text: placeholder.markdown("\n\n".join(gpt.partial_strings(text)))
 
     try:
-        if response_format is None:
-            response = client.chat.completions.create(
-                messages=messages,
-                model=OPENAI_MODEL
-            )
-        else: 
-            response = client.beta.chat.completions.parse(
-                messages=messages,
-                model=OPENAI_MODEL,
-                response_format=response_format
-            )
+        completion = gpt.complete(
+            client, prompt, st.session_state["LANGUAGE"], response_format,
+            cache=completion_cache, regenerate=regenerate, cache_ttl=cache_ttl,
+            on_token=on_token, timings=timings,
+            session=st.session_state["SESSION_ID"], on_wait=queue_status(status), step=step, max_tokens=max_tokens,
+            n=n,
+        )
+        status.empty()
+        if stream:
+            placeholder.empty()
+        if semantic_key and completion:
+            semantic_cache.set(semantic_key, st.session_state["LANGUAGE"], completion, step)
+        if "ttft" in timings:
+            st.session_state["TTFT"].append(timings["ttft"])
         if DEBUG:
             st.text(f"DEBUG: prompting with prompt: {prompt}")
-            st.text(f"DEBUG: JSON RETURNED {response.model_dump_json(indent=4)}")
-        completion = response.choices[0].message.content.strip()
-        
-        # Try convertin to JSON if GPT returned a JSON-like object
-        try: 
-            completion = json.loads(completion)
-        except: 
-            pass
-
+            if "response" in timings:
+                st.text(f"DEBUG: JSON RETURNED {timings['response'].model_dump_json(indent=4)}")
+            st.text(f"DEBUG: time to first token {timings.get('ttft')}")
         return completion
     except Exception as e:
         st.error(tb.format_exc())
@@ -95,136 +182,520 @@ def get_openai_completion(user_prompt, system_prompt):
         return f"Error: {e}"
 ### GPT Connection ###
 
+### E-mail ###
+##############
+@st.cache_resource
+def get_mail_queue():
+    """One background mail queue, and its open SMTP connection, shared by every session."""
+    return MailQueue()
+
+mail_queue = get_mail_queue()
+
+@st.cache_resource
+def get_subscriber_store():
+    """Subscribers of the daily predication, e-mailed by `python subscriptions.py send`."""
+    return SubscriberStore()
+
+subscriber_store = get_subscriber_store()
+
+def unsubscribe_link():
+    """Remove the subscriber of the link at the bottom of the daily e-mails (`?unsubscribe=...`)."""
+    token = st.query_params.get("unsubscribe")
+    if token:
+        if subscriber_store.unsubscribe_token(token):
+            st.success("You will not receive the daily predication anymore.")
+        else:
+            st.info("This address is not subscribed to the daily predication.")
+        del st.query_params["unsubscribe"]
+
+def confirm_link():
+    """Subscribe the address of the link e-mailed by "Subscribe to the daily predication" (`?confirm=...`)."""
+    token = st.query_params.get("confirm")
+    if token:
+        if subscriber_store.confirm(token):
+            st.success("Your subscription is confirmed: you will receive a predication every day.")
+        else:
+            st.info("This confirmation link is invalid or has expired, please subscribe again.")
+        del st.query_params["confirm"]
+### E-mail ###
+
+### Drafts ###
+##############
+@st.cache_resource
+def get_session_store():
+    """Drafts of every session, saved to disk and resumed from the `?session=` URL parameter."""
+    return SessionStore()
+
+session_store = get_session_store()
+
+def resume_draft():
+    """On the first run of a session, restore the draft of the token in the URL, or start a new
+    one, and put the session token in the URL so that reloading the page resumes the work."""
+    token = st.query_params.get("session")
+    draft = session_store.load(token) if token else None
+    if draft is None:
+        token = uuid.uuid4().hex
+    else:
+        if draft.get("METHOD") not in METHODS:
+            draft.pop("METHOD", None)
+        st.session_state.update({key: value for key, value in draft.items() if value is not None})
+        if draft.get("THEME") in THEMES:
+            st.session_state["THEME_CHOICE"] = draft["THEME"]
+        elif draft.get("THEME"):
+            st.session_state["THEME_CHOICE"] = "Others"
+            st.session_state["CUSTOM_THEME"] = draft["THEME"]
+    st.session_state["SESSION_ID"] = token  # also the fair queue of the OpenAI scheduler
+    st.query_params["session"] = token
+
+if "SESSION_ID" not in st.session_state:
+    resume_draft()
+### Drafts ###
+
 ### Streamlit app ###
 #####################
 # Initialize session state variables so that when the button restarts the page it doesn't lose track of the selections
 if "RESPONSES" not in st.session_state: st.session_state["RESPONSES"] = []
 if "SELECTED_RESPONSE" not in st.session_state: st.session_state["SELECTED_RESPONSE"] = None
 if "THEME" not in st.session_state: st.session_state["THEME"] = None
-if "INSPIRATIONS" not in st.session_state: st.session_state["INSPIRATIONS"] = {}
+# INSPIRATIONS ({source: text}), VARIANTS ({source: [text]}, see variants.py), PREDICATION_SECTIONS
+# ({section: text}, in order), PREDICATION_HISTORY (see predication.py) and TRANSLATIONS ({language: see
+# translation.translate}) are only in the session state while a step runs, see `draft_step`
+if "EMAILS" not in st.session_state: st.session_state["EMAILS"] = []  # ids of the e-mails handed to the mail queue
+if "TTFT" not in st.session_state: st.session_state["TTFT"] = []  # time-to-first-token of each streamed answer, in seconds
 
 # Streamlit UI
 st.title("Mon homélie")
 st.markdown("Cet assistant vous guide pour identifier un thème, trouver des références et rédiger une homélie personnalisée.")
+unsubscribe_link()
+confirm_link()
 
 
 ### Streamlit app setup
 # Hamburger menu
 with st.sidebar:
     st.header("Menu")
-    language = st.selectbox("Select Language", ["French", "English", "Spanish"], key="LANGUAGE")
+    language = st.selectbox("Select Language", LANGUAGES, key="LANGUAGE")
+    st.multiselect("Also translate the predication into", LANGUAGES, key="TRANSLATE_TO")
+    st.checkbox("Regenerate (ignore cached answers)", key="REGENERATE")
+    cache_stats = completion_cache.stats()
+    st.caption(f"Cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses, {cache_stats['entries']} entries")
+    if st.session_state["TTFT"]:
+        ttfts = sorted(st.session_state["TTFT"])
+        st.caption(f"Time to first token: last {st.session_state['TTFT'][-1]:.2f}s, median {ttfts[len(ttfts) // 2]:.2f}s")
+    if os.getenv("ADMIN_TOKEN") and st.query_params.get("admin") == os.getenv("ADMIN_TOKEN"):
+        with st.expander("Admin"):
+            store_stats = key_messages_store.stats()
+            st.caption(f"Shared key messages: {store_stats['entries']} entries, {store_stats['served']} served from memory, "
+                       f"{store_stats['computed']} computed, last warm-up {store_stats['warmed_at']}")
+            scheduler_stats = get_scheduler().stats()
+            st.caption(f"OpenAI queue: {scheduler_stats['waiting']} waiting, {scheduler_stats['in_flight']} in flight, "
+                       f"{scheduler_stats['calls']} calls, {scheduler_stats['retries']} retries, "
+                       f"{scheduler_stats['rate_limited']} rate limited")
+            session_stats = session_store.stats()
+            st.caption(f"Drafts: {session_stats['hot']} in memory ({session_stats['hot_bytes'] / 1024:.0f} KiB), "
+                       f"{session_stats['loads']} resumed from disk, {session_stats['saves']} saves")
+            semantic_stats = semantic_cache.stats()
+            st.caption(f"Semantic cache: {semantic_stats['hit_rate']:.0%} hit rate ({semantic_stats['hits']} hits), "
+                       f"{semantic_stats['entries']} entries, lookup p50 {semantic_stats['lookup_p50_ms']:.1f} ms / "
+                       f"p95 {semantic_stats['lookup_p95_ms']:.1f} ms, threshold {semantic_stats['threshold']}")
+            routing_stats = routing.stats()
+            st.caption(f"Routing: {routing_stats['fallbacks']} fallbacks after a timeout, {routing_stats['hedges']} hedged "
+                       f"requests ({routing_stats['hedge_wins']} won by the duplicate, "
+                       f"{routing_stats['hedge_wasted_tokens']} tokens wasted)")
+            pool_stats = http_pool.stats()
+            st.caption(f"HTTP pool: {pool_stats['requests']} requests, {pool_stats['connections_opened']} connections opened "
+                       f"({pool_stats['reuse_rate']:.0%} reused), {pool_stats['in_flight']} in flight (peak "
+                       f"{pool_stats['peak_in_flight']} / {pool_stats['max_connections']}), {pool_stats['saturated']} "
+                       f"found the pool full, {pool_stats['pool_timeouts']} pool timeouts")
+            retrieval_stats = retriever.stats()
+            st.caption(f"Retrieval: index of {', '.join(retrieval_stats['languages']) or 'no language'} loaded, "
+                       f"{retrieval_stats['queries']} queries, {retrieval_stats['average_ms']:.1f} ms on average")
+            if PREFETCH_INSPIRATIONS:
+                prefetch_stats = prefetcher.stats()
+                st.caption(f"Prefetch: {prefetch_stats['hit_rate']:.0%} hit rate ({prefetch_stats['hits']} hits, "
+                           f"{prefetch_stats['misses']} misses), {prefetch_stats['started']} requests, "
+                           f"{prefetch_stats['cancelled']} cancelled, {prefetch_stats['used_tokens']} tokens used / "
+                           f"{prefetch_stats['wasted_tokens']} wasted")
+            if metrics.summary():
+                st.dataframe(metrics.summary(), use_container_width=True)
+            if st.button("Refresh shared key messages"):
+                threading.Thread(target=key_messages_store.refresh, daemon=True).start()
+                st.success("Refresh started in the background.")
     st.markdown("**About Us**: bexaga Lab à Genève\n**Contact Us**: gaillardbx@gmail.com")
 
+def save_draft():
+    """Save the draft, only written to disk when something changed since the last save."""
+    session_store.save(st.session_state["SESSION_ID"], {key: st.session_state.get(key) for key in DRAFT_KEYS})
+
+def load_offloaded():
+    """Put the bulky items of the draft back in the session state, from the session store."""
+    missing = [key for key in OFFLOADED_KEYS if key not in st.session_state]
+    if missing:
+        draft = session_store.load(st.session_state["SESSION_ID"]) or {}
+        for key in missing:
+            st.session_state[key] = draft.get(key) or OFFLOADED_KEYS[key]()
+
+def draft_step(step):
+    """Run the page step `step` with the whole draft in the session state, then save the draft and
+    leave its bulky items to the session store until the next run, so that a connected but idle
+    session only keeps its small widget values in memory."""
+    @functools.wraps(step)
+    def run(*args, **kwargs):
+        load_offloaded()
+        try:
+            return step(*args, **kwargs)
+        finally:
+            save_draft()
+            for key in OFFLOADED_KEYS:
+                st.session_state.pop(key, None)
+    return run
+
+# Each step is a fragment: its widgets only rerun the step itself, not the whole page.
 # Step 1: Identify Key Message
-st.header("Step 1: Identify Key Message")
-method = st.radio("Choose a method to identify the key message:", ["No Input", "Select a Theme", "Custom Input"], key="METHOD")
-
-theme = ""
-topic_prompt = ""
-if method == "No Input":
-    topic_prompt = "Identifier l'évangile du jour, les lectures de l'ancien testament et du nouveau testament, du psaume. Proposer 5 messages clés qui pourraient être le message central de l'homélie du jour."
-elif method == "Select a Theme":
-    theme = st.selectbox("Select Theme", ["Mariage", "Enterrement", "Première Communion", "Confirmation", "Pâques", "Toussaint", "Noël", "Others"], key="THEME")
-    if theme == "Others":
-        theme = st.text_input("Enter custom theme:", key="THEME")
-    topic_prompt = f"Proposer 5 messages clés qui pourraient être le message central d'une homélie sur le thème {theme}."
-elif method == "Custom Input":
-    topic_prompt = st.text_area("Enter your custom topic prompt:")
-
-if st.button("Generate Key Messages"):
-    # Call GPT function
-    responses = generate_chatgpt_responses(topic_prompt, KeyMessagesSchema)["key_messages"]
-
-    # Check if GPT returned valid responses
-    if responses:
-        st.session_state["RESPONSES"] = responses  # Persist responses in session_state
-    else:
-        st.error("Something went wrong and GPT sent back an empty response.")
+@st.fragment
+@draft_step
+def key_message_step():
+    st.header("Step 1: Identify Key Message")
+    method = st.radio("Choose a method to identify the key message:", METHODS, key="METHOD")
+
+    theme = ""
+    topic = ""
+    if method == "No Input":
+        topic = topic_prompt()
+        today = liturgical_day()
+        st.caption(f"Today: {today['name']} (année {today['cycle']})")
+    elif method == "Select a Theme":
+        theme = st.selectbox("Select Theme", THEMES + ["Others"], key="THEME_CHOICE")
+        if theme == "Others":
+            theme = st.text_input("Enter custom theme:", key="CUSTOM_THEME")
+        topic = topic_prompt(theme)
+    elif method == "Custom Input":
+        topic = st.text_area("Enter your custom topic prompt:")
+    st.session_state["THEME"] = theme or None  # the chosen or typed theme, None without one
+
+    if st.button("Generate Key Messages"):
+        if method == "No Input" or theme in THEMES:
+            # Same request for everybody, answered once by the shared store
+            status = st.empty()
+            try:
+                responses = key_messages_store.get(theme or None, st.session_state["LANGUAGE"], st.session_state["REGENERATE"],
+                                                   on_wait=queue_status(status))
+                status.empty()
+            except Exception:
+                responses = None
+                st.error(tb.format_exc())
+        else:
+            # Call GPT function
+            # Free text: near variants of a text already asked reuse its answer
+            responses = generate_chatgpt_responses(fit_prompt(topic, "key_messages"), KeyMessagesSchema, step="key_messages",
+                                                   semantic_key=theme if method == "Select a Theme" else topic)["key_messages"]
+
+        # Check if GPT returned valid responses
+        if responses:
+            st.session_state["RESPONSES"] = responses  # Persist responses in session_state
+            if PREFETCH_INSPIRATIONS:
+                # Start Step 2 while the user reads the key messages
+                prefetcher.start(st.session_state["SESSION_ID"], st.session_state["THEME"], responses,
+                                 st.session_state["LANGUAGE"], st.session_state["REGENERATE"])
+            st.rerun()  # the key messages are listed outside of the fragment
+        else:
+            st.error("Something went wrong and GPT sent back an empty response.")
+
+def select_key_message(response):
+    st.session_state["SELECTED_RESPONSE"] = response  # Persist selection
+    if PREFETCH_INSPIRATIONS:
+        st.session_state["PREFETCHED"] = prefetcher.claim(st.session_state["SESSION_ID"], response)
 
-# Display generated key messages
-if st.session_state["RESPONSES"]:
-    st.write("### Choose a Key Message:")
-    for i, response in enumerate(st.session_state["RESPONSES"]):
-        if st.button(response, key=f"option_{i}"):
-            st.session_state["SELECTED_RESPONSE"] = response  # Persist selection
-            st.success(f"Selected: {response}")
+def key_message_choice():
+    """The generated key messages. Choosing one changes Step 2, so these buttons rerun the whole page."""
+    if st.session_state["RESPONSES"]:
+        st.write("### Choose a Key Message:")
+        for i, response in enumerate(st.session_state["RESPONSES"]):
+            st.button(response, key=f"option_{i}", on_click=select_key_message, args=(response,))
+        if st.session_state["SELECTED_RESPONSE"] in st.session_state["RESPONSES"]:
+            st.success(f"Selected: {st.session_state['SELECTED_RESPONSE']}")
 
 # Step 2: Generate Inspirations
-st.header("Step 2: Generate Inspirations")
-if st.session_state["SELECTED_RESPONSE"]:
+def add_variants(source, texts):
+    """Add the generated `texts` of `source` to its pool of variants and show the first new one.
+    Returns the number of duplicates dropped."""
+    pool = st.session_state["VARIANTS"].get(source)
+    if pool is None:  # the inspiration generated before the pool existed, e.g. in a resumed draft
+        pool = [st.session_state["INSPIRATIONS"][source]] if source in st.session_state["INSPIRATIONS"] else []
+    pool, added = variants.merge(pool, texts)
+    st.session_state["VARIANTS"][source] = pool
+    if added:
+        st.session_state["INSPIRATIONS"][source] = added[0]
+    return len([text for text in texts if text]) - len(added)
+
+def show_variant(source, step):
+    load_offloaded()  # callbacks run before the step
+    st.session_state["INSPIRATIONS"][source] = variants.page(
+        st.session_state["VARIANTS"][source], st.session_state["INSPIRATIONS"].get(source), step)
+
+@st.fragment
+@draft_step
+def inspirations_step():
+    st.header("Step 2: Generate Inspirations")
+    if not st.session_state["SELECTED_RESPONSE"]:
+        st.info("Please select a key message in Step 1 to continue.")
+        return
+
     # Display Step 2 only if a key message was selected
     st.write(f"Key message selected: **{st.session_state['SELECTED_RESPONSE']}**")
-    inspiration_sources = {
-        "Joke": "Tu es un pasteur évangélique médiatique, propose 3 mots d'esprit ou blagues sur le thème {theme} en {language}. Tu devrais prendre en compte le message clé suivant pour la prédication : {key_message}.",
-        "Semantic Explanation": "Une explication sémantique pour un mot complexe utilisé dans les textes du jour en {language}. Tu devrais prendre en compte le message clé suivant pour la prédication : {key_message}.",
-        "Dogma Reference": "Une ouverture sur une référence des textes officiels de la doctrine, catéchisme, pères de l'église en {language}. Tu devrais prendre en compte le message clé suivant pour la prédication : {key_message}.",
-        "Current Event": "Un évènement actuel pertinent pour les chrétiens auquel on pourrait faire référence en lien avec {topic} en {language}. Tu devrais prendre en compte le message clé suivant pour la prédication : {key_message}.",
-        "Metaphor": "Une métaphore créative pour expliquer {topic} en {language}. Tu devrais prendre en compte le message clé suivant pour la prédication : {key_message}.",
-        "Everyday Life Situation": "Une situation de la vie quotidienne où ce message clé sera particulièrement pertinent en {language}. Tu devrais prendre en compte le message clé suivant pour la prédication : {key_message}."
-    }
-    
-    for source, prompt_template in inspiration_sources.items():
-        prompt = prompt_template.format(
-            theme=st.session_state["THEME"],
-            topic=st.session_state["SELECTED_RESPONSE"],
-            language=st.session_state["LANGUAGE"],
-            key_message=st.session_state["SELECTED_RESPONSE"],
+    prefetched = st.session_state.pop("PREFETCHED", None)
+    if prefetched is not None:
+        with st.spinner("Finishing the inspirations prepared while you were choosing..."):
+            inspirations = prefetched.result()
+        for source, text in (inspirations or {}).items():
+            add_variants(source, [text])
+    references = retriever.ground(
+        st.session_state["THEME"], st.session_state["SELECTED_RESPONSE"], st.session_state["LANGUAGE"]
+    )
+    source_prompts = inspiration_prompts(
+        st.session_state["THEME"], st.session_state["SELECTED_RESPONSE"], st.session_state["LANGUAGE"],
+        references=references,
+    )
+
+    # Once a source has variants, generating it again asks for new ones rather than the cached answer
+    with_variants = [source for source in source_prompts if source in st.session_state["VARIANTS"]]
+    variant_count = st.number_input("Variants per request", min_value=1, max_value=variants.VARIANTS_MAX, value=1,
+                                    key="VARIANT_COUNT",
+                                    help="Options to browse for each source, generated by one request: the prompt is "
+                                         "only paid once")
+    all_column, combined_column = st.columns(2)
+    if combined_column.button("Generate all in one request", key="generate_combined",
+                              help="Cheaper: the theme and key message are sent once for all the sources"):
+        prompt = combined_inspirations_prompt(
+            st.session_state["THEME"], st.session_state["SELECTED_RESPONSE"], st.session_state["LANGUAGE"],
+            references=references,
         )
-        if st.button(f"Generate {source}", key=f"generate_{source}"):
-            # Generate responses for the source
-            response = generate_chatgpt_responses(prompt)
+        with st.spinner("Generating inspirations..."):
+            response = generate_chatgpt_responses(prompt, inspirations_schema(), step="inspiration:combined",
+                                                  regenerate=st.session_state["REGENERATE"] or bool(with_variants),
+                                                  n=variant_count)
+        if response:
+            answers = [split_inspirations(answer) for answer in (response if variant_count > 1 else [response])]
+            duplicates = sum(add_variants(source, [answer[source] for answer in answers]) for source in answers[0])
+            if duplicates:
+                st.caption(f"{duplicates} variant(s) already in the lists were left out.")
 
-            def toggle_inspiration():
-                if source in st.session_state["INSPIRATIONS"]:
-                    st.session_state["INSPIRATIONS"].pop(source)
-                else:
-                    st.session_state["INSPIRATIONS"][source] = response
+    if all_column.button("Generate all inspirations", key="generate_all"):
+        # Fan out every source at once and store each result as soon as it arrives
+        progress = st.progress(0.0, text="Generating inspirations...")
+        results = gpt.complete_all(
+            client, source_prompts, st.session_state["LANGUAGE"], max_workers=MAX_CONCURRENT_REQUESTS,
+            cache=completion_cache, regenerate=st.session_state["REGENERATE"] or with_variants,
+            session=st.session_state["SESSION_ID"], step="inspiration", n=variant_count,
+        )
+        duplicates = 0
+        for done, (source, response, error) in enumerate(results, start=1):
+            if error is not None:
+                st.warning(f"{source} failed: {error}")
+            elif response:
+                duplicates += add_variants(source, response if variant_count > 1 else [response])
+            progress.progress(done / len(source_prompts), text=f"{source} done ({done}/{len(source_prompts)})")
+        progress.empty()
+        if duplicates:
+            st.caption(f"{duplicates} variant(s) already in the lists were left out.")
 
+    for source, prompt in source_prompts.items():
+        if st.button(f"Generate {source}", key=f"generate_{source}"):
+            regenerate = st.session_state["REGENERATE"] or source in with_variants
+            if variant_count > 1:
+                with st.spinner(f"Generating {variant_count} variants..."):
+                    response = generate_chatgpt_responses(prompt, regenerate=regenerate, step=f"inspiration:{source}",
+                                                          n=variant_count)
+            else:
+                # Show the tokens while they arrive
+                response = generate_chatgpt_responses(prompt, regenerate=regenerate, stream=True,
+                                                      step=f"inspiration:{source}")
             if response:
-                st.session_state["INSPIRATIONS"][source] = response
+                duplicates = add_variants(source, response if variant_count > 1 else [response])
+                if duplicates:
+                    st.caption(f"{duplicates} variant(s) already in the list were left out.")
 
         if source in st.session_state["INSPIRATIONS"]:
-            st.checkbox(f"Include generated {source}: {st.session_state['INSPIRATIONS'][source]}", key=f"INSPIRATION_{source}")
-else:
-    st.info("Please select a key message in Step 1 to continue.")
-    
+            pool = st.session_state["VARIANTS"].get(source, [])
+            if len(pool) > 1:
+                current = st.session_state["INSPIRATIONS"][source]
+                previous_column, position_column, next_column = st.columns([1, 6, 1])
+                previous_column.button("◀", key=f"previous_{source}", on_click=show_variant, args=(source, -1))
+                position_column.caption(f"{source}: variant {pool.index(current) + 1 if current in pool else '-'} "
+                                        f"of {len(pool)}")
+                next_column.button("▶", key=f"next_{source}", on_click=show_variant, args=(source, 1))
+            st.checkbox(f"Include generated {source}: {st.session_state['INSPIRATIONS'][source]}", value=True,
+                        key=f"INSPIRATION_{source}")
+
 # Step 3: Compose the Predication
-st.header("Step 3: Compose the Predication")
-profile = st.selectbox("Who are we writing this for?", ["Prêtre catholique", "Pasteur protestant", "Pasteur évangélique", "Père ou mère de famille"])
+def included_inspirations():
+    """The generated inspirations whose "Include" box is checked."""
+    return {source: text for source, text in st.session_state["INSPIRATIONS"].items()
+            if st.session_state.get(f"INSPIRATION_{source}", True)}
 
-if st.button("Generate Predication"):
-    predication_prompt = (
-        f"Rédige une homélie de 8 minutes pour {profile} en {st.session_state['LANGUAGE']} qui communique sur {st.session_state.get('THEME', '')} et qui inclut comme inspiration:" + json.dumps(st.session_state["INSPIRATIONS"], indent=4)
-    )
-    # f"en utilisant ces sources: {', '.join(source_variables.values())}."
-    st.text_area(generate_chatgpt_responses(predication_prompt), key="PREDICATION")
+def update_predication(changes, order=None):
+    """Apply the `{section: text}` changes to the predication, keeping the previous texts in its history."""
+    st.session_state["PREDICATION_SECTIONS"] = document.revise(
+        st.session_state["PREDICATION_SECTIONS"], st.session_state["PREDICATION_HISTORY"], changes, order)
+    st.session_state["PREDICATION"] = document.text(st.session_state["PREDICATION_SECTIONS"])
+
+def undo_predication():
+    load_offloaded()  # callbacks run before the step
+    st.session_state["PREDICATION_SECTIONS"] = document.undo(st.session_state["PREDICATION_SECTIONS"],
+                                                             st.session_state["PREDICATION_HISTORY"])
+    st.session_state["PREDICATION"] = document.text(st.session_state["PREDICATION_SECTIONS"])
+
+def rewrite_section(section, profile, minutes):
+    """Generate `section` again, streamed in place, from the sections around it only."""
+    prompt, budget = assemble_section_prompt(profile, st.session_state["LANGUAGE"], st.session_state.get("THEME", ""),
+                                             section, st.session_state["PREDICATION_SECTIONS"], included_inspirations(),
+                                             minutes)
+    # A rewrite must give another text than the cached one
+    text = generate_chatgpt_responses(prompt, regenerate=True, stream=True, step="predication:section",
+                                      max_tokens=budget["max_tokens"])
+    if text:
+        update_predication({section: text})
+
+def translation_targets():
+    return [language for language in st.session_state.get("TRANSLATE_TO", []) if language != st.session_state["LANGUAGE"]]
+
+def translate_predication(targets):
+    """Bring the translations of the predication up to date, sending only the sections changed
+    since the last translation, every language at the same time."""
+    document = st.session_state["PREDICATION_SECTIONS"] or {"text": st.session_state["PREDICATION"]}
+    translations = st.session_state["TRANSLATIONS"]
+    for language, translated in translations.items():  # sections removed from the predication
+        translations[language] = {section: entry for section, entry in translated.items() if section in document}
+    todo = [language for language in targets
+            if language not in translations or translation.stale(document, translations[language])]
+    if not todo:
+        return
+    with st.spinner(f"Translating into {', '.join(todo)}..."):
+        for language, translated, error in translation.translate_all(
+            client, document, st.session_state["LANGUAGE"], todo, translations, cache=completion_cache,
+            session=st.session_state["SESSION_ID"],
+        ):
+            if error is not None:
+                st.error(f"Translation into {language} failed: {error}")
+            else:
+                translations[language] = translated
+
+@st.fragment
+@draft_step
+def predication_step():
+    st.header("Step 3: Compose the Predication")
+    profile = st.selectbox("Who are we writing this for?", PROFILES, key="PROFILE")
+    minutes = st.slider("Length of the homily (minutes)", 3, 20, 8)
+
+    if st.button("Generate Predication"):
+        # Compact prompt within the token budget, answer capped to the requested length and split in sections
+        prompt, budget = assemble_predication_prompt(profile, st.session_state['LANGUAGE'], st.session_state.get('THEME', ''),
+                                                     included_inspirations(), minutes, structured=True)
+        completion = generate_chatgpt_responses(prompt, predication_schema(budget["sections"]), stream=True,
+                                                step="predication", max_tokens=budget["max_tokens"],
+                                                timings={"prompt_tokens_saved": budget["saved"]})
+        if completion:
+            if document.truncated(completion):
+                st.warning("The predication was cut at its length limit: the last sections are incomplete or "
+                           "empty. Rewrite them below, or generate it again with a longer length.")
+            update_predication(document.from_completion(completion, budget["sections"]), budget["sections"])
+            st.session_state["PROMPT_BUDGET"] = budget
+
+    if st.session_state.get("PROMPT_BUDGET"):
+        budget = st.session_state["PROMPT_BUDGET"]
+        shortened = ", ".join(budget["truncated"] + [f"{source} (left out)" for source in budget["dropped"]])
+        st.caption(f"Prompt: {budget['tokens']} tokens, {budget['saved']} saved"
+                   + (f", shortened to fit the budget: {shortened}" if shortened else ""))
+
+    if st.session_state["PREDICATION_SECTIONS"]:
+        with st.expander("Sections", expanded=True):
+            for section in list(st.session_state["PREDICATION_SECTIONS"]):
+                st.markdown(f"**{document.title(section)}**")
+                if st.button("Rewrite this section", key=f"rewrite_{section}"):
+                    rewrite_section(section, profile, minutes)
+                st.markdown(st.session_state["PREDICATION_SECTIONS"][section])
+            history = st.session_state["PREDICATION_HISTORY"]
+            if history:
+                st.button(f"Undo: {document.describe(history[-1])}", on_click=undo_predication)
+                st.caption(f"{len(history)} revision(s) kept")
+
+    if st.session_state.get("PREDICATION"):
+        st.text_area("Your predication", st.session_state["PREDICATION"], height=400)
+        targets = translation_targets()
+        if targets:
+            translate_predication(targets)
+            for tab, language in zip(st.tabs(targets), targets):
+                with tab:
+                    st.text_area(f"Your predication ({language})",
+                                 translation.text(st.session_state["TRANSLATIONS"].get(language, {})), height=400)
 
 # Step 4: Share
-st.header("Step 4: Share")
-email = st.text_input("Enter your email address:")
-city = st.text_input("City:")
-country = st.text_input("Country:")
-
-def send_mail(to_email, subject, message, server='smtp.gmail.com', port=587):
-    
-    msg = EmailMessage()
-    msg['Subject'] = subject
-    msg['From'] = os.environ.get("EMAIL_USER")
-    msg['To'] = ', '.join(to_email)
-    msg.set_content(message)
-    print(msg)
-    server = smtplib.SMTP(server, port)
-    server.set_debuglevel(1)
-    server.starttls()
-    server.login(os.environ.get("EMAIL_USER"), os.environ.get("EMAIL_PASSWORD"))  # user & password
-    server.send_message(msg)
-    server.quit()
-    st.text_area('Your predication has been successfully e-mailed.')
-
-if st.button("Send Email"):
-    if "PREDICATION" not in st.session_state:
-        st.error("Please generate the predication first")
-    else:
-        send_mail(email, "Your predication for the day", st.session_state["PREDICATION"])
-        # TODO Send email.
+def send_mail(to_email, subject, message):
+    """Hand the message to the background mail queue and remember its id to show its status."""
+    st.session_state["EMAILS"].append(mail_queue.submit(to_email, subject, message))
+    st.success('Your predication is being e-mailed.')
+
+def checked_email(email):
+    """`email` normalised, or None after showing why it is not a valid address."""
+    if not email:
+        st.error("Please enter your email address first")
+        return None
+    try:
+        return validate_email(email, check_deliverability=False).normalized
+    except EmailNotValidError as e:
+        st.error(f"Invalid email address: {e}")
+        return None
+
+@st.fragment
+@draft_step
+def share_step():
+    st.header("Step 4: Share")
+    email = st.text_input("Enter your email address:")
+    city = st.text_input("City:")
+    country = st.text_input("Country:")
+
+    if st.button("Send Email"):
+        if "PREDICATION" not in st.session_state:
+            st.error("Please generate the predication first")
+        else:
+            message = st.session_state["PREDICATION"] + "".join(
+                f"\n\n---\n{language}\n\n{translation.text(st.session_state['TRANSLATIONS'][language])}"
+                for language in translation_targets() if language in st.session_state["TRANSLATIONS"]
+            )
+            email = checked_email(email)
+            if email:
+                send_mail(email, "Your predication for the day", message)
+
+    if st.button("Subscribe to the daily predication"):
+        email = checked_email(email)
+        if email:
+            # A theme chosen in Step 1 is kept, otherwise the predication follows the readings of the day
+            theme = st.session_state["THEME"] if st.session_state.get("METHOD") == "Select a Theme" else None
+            # Only the owner of the address can confirm the subscription, with the link e-mailed to it
+            token = subscriber_store.request_subscription(email, st.session_state["LANGUAGE"],
+                                                          st.session_state.get("PROFILE", PROFILES[0]),
+                                                          theme, city, country)
+            if token:
+                subject, body = confirmation_email(st.session_state["LANGUAGE"], token)
+                mail_queue.submit(email, subject, body)
+            st.success(f"To receive a predication every day ({theme or 'readings of the day'}), "
+                       f"open the confirmation link e-mailed to {email}.")
+
+    # The mail queue forgets the messages finished long ago
+    st.session_state["EMAILS"] = [message_id for message_id in st.session_state["EMAILS"]
+                                  if mail_queue.status(message_id) is not None]
+    if st.session_state["EMAILS"]:
+        st.button("Refresh delivery status")
+        for message_id in st.session_state["EMAILS"]:
+            delivery = mail_queue.status(message_id)
+            if delivery is None:
+                continue
+            error = f" ({delivery['error']})" if delivery["error"] else ""
+            st.caption(f"E-mail to {delivery['to']}: {delivery['status']} after {delivery['attempts']} attempt(s){error}")
+
+key_message_step()
+key_message_choice()
+inspirations_step()
+predication_step()
+share_step()
 ### Streamlit app ###
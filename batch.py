@@ -0,0 +1,267 @@
+"""Generate predications ahead of time, without the Streamlit UI.
+
+The manifest is a JSON file listing what to generate; every combination of its entries is one
+item that goes through Step 1 (key messages), Step 2 (inspirations) and Step 3 (predication):
+
+    {
+        "dates": ["2026-12-24", "2026-12-25"],
+        "themes": [null, "Noël"],
+        "languages": ["French", "English"],
+        "profiles": ["Prêtre catholique"],
+        "sources": ["Joke", "Metaphor"],
+        "key_message_index": 0
+    }
+
+A `null` theme takes the key messages from the readings of the date. `sources` (all inspiration
+sources by default) and `key_message_index` (which proposed key message to develop, 0 by
+default) are optional.
+
+Run the whole pipeline, appending one JSON line per finished item. Items already in the output
+file are skipped, so an interrupted run is resumed by running the same command again:
+
+    python batch.py run manifest.json -o predications.jsonl --concurrency 8
+
+Or write OpenAI Batch API request files, one step at a time, each step reading the Batch API
+output file of the previous one:
+
+    python batch.py emit-batch manifest.json --step key_messages -o step1_requests.jsonl
+    python batch.py emit-batch manifest.json --step inspirations --results step1_output.jsonl -o step2_requests.jsonl
+    python batch.py emit-batch manifest.json --step predication --results step2_output.jsonl -o step3_requests.jsonl
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date
+
+import gpt
+import http_pool
+import retrieval
+import routing
+from completion_cache import CompletionCache
+from prompt_budget import assemble_predication_prompt
+from prompts import INSPIRATION_SOURCES, KeyMessagesSchema, inspiration_prompts, topic_prompt
+
+STEPS = ["key_messages", "inspirations", "predication"]
+
+
+def short_key(*parts):
+    """Stable identifier of a combination of manifest values, used in output lines and custom ids."""
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+def load_manifest(path):
+    """Return the list of items described by the manifest at `path`."""
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    sources = manifest.get("sources") or list(INSPIRATION_SOURCES)
+    unknown = set(sources) - set(INSPIRATION_SOURCES)
+    if unknown:
+        raise ValueError(f"Unknown inspiration sources in manifest: {', '.join(sorted(unknown))}")
+
+    items = []
+    for day, theme, language, profile in itertools.product(
+        manifest["dates"], manifest.get("themes") or [None], manifest["languages"], manifest["profiles"]
+    ):
+        items.append({
+            "id": short_key(day, theme, language, profile),
+            # Steps 1 and 2 do not depend on the profile and are shared between items
+            "topic_id": short_key(day, theme, language),
+            "date": day,
+            "theme": theme,
+            "language": language,
+            "profile": profile,
+            "sources": sources,
+            "key_message_index": manifest.get("key_message_index", 0),
+        })
+    return items
+
+
+def item_topic_prompt(item):
+    return topic_prompt(item["theme"], date.fromisoformat(item["date"]))
+
+
+def item_inspiration_prompts(item, key_message):
+    references = retrieval.get_retriever().ground(item["theme"], key_message, item["language"])
+    return inspiration_prompts(item["theme"], key_message, item["language"], item["sources"], references)
+
+
+def item_predication_prompt(item, inspirations):
+    """Step 3 prompt of `item` and its budget report (see `assemble_predication_prompt`)."""
+    return assemble_predication_prompt(item["profile"], item["language"], item["theme"], inspirations)
+
+
+def pick_key_message(item, key_messages):
+    return key_messages[min(item["key_message_index"], len(key_messages) - 1)]
+
+
+### Synchronous pipeline ###
+def done_ids(output_path):
+    """Ids of the items already written to `output_path`, the checkpoint of a previous run."""
+    if not os.path.exists(output_path):
+        return set()
+    ids = set()
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                ids.add(json.loads(line)["id"])
+            except (ValueError, KeyError):
+                pass  # a line cut short by a crash, the item is generated again
+    return ids
+
+
+def run_item(client, item, cache=None, model=None):
+    """Run Step 1 -> 2 -> 3 for one item and return its output record. Each step goes to the model
+    of its route (see `routing`) unless `model` is given."""
+    language = item["language"]
+    key_messages = gpt.complete(client, item_topic_prompt(item), language, KeyMessagesSchema,
+                                model=model, cache=cache, step="key_messages")["key_messages"]
+    key_message = pick_key_message(item, key_messages)
+
+    inspirations = {}
+    for source, prompt in item_inspiration_prompts(item, key_message).items():
+        inspirations[source] = gpt.complete(client, prompt, language, model=model, cache=cache,
+                                            step=f"inspiration:{source}")
+
+    prompt, budget = item_predication_prompt(item, inspirations)
+    predication = gpt.complete(client, prompt, language, model=model, cache=cache, step="predication",
+                               max_tokens=budget["max_tokens"], timings={"prompt_tokens_saved": budget["saved"]})
+    record = {key: item[key] for key in ("id", "date", "theme", "language", "profile")}
+    record.update(key_messages=key_messages, key_message=key_message, inspirations=inspirations,
+                  predication=predication)
+    return record
+
+
+def run(items, output_path, concurrency=4, cache=None, model=None, client=None):
+    """Generate every item not yet in `output_path` with at most `concurrency` items in flight,
+    appending each record as soon as it is finished. Return the number of failed items."""
+    client = client or http_pool.get_client()
+    finished = done_ids(output_path)
+    todo = [item for item in items if item["id"] not in finished]
+    print(f"{len(items) - len(todo)} items already done, {len(todo)} to generate", file=sys.stderr)
+
+    failures = 0
+    lock = threading.Lock()
+    with open(output_path, "a", encoding="utf-8") as output, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(run_item, client, item, cache, model): item for item in todo}
+        for done, future in enumerate(as_completed(futures), start=1):
+            item = futures[future]
+            try:
+                record = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"[{done}/{len(todo)}] {item['id']} failed: {e}", file=sys.stderr)
+                continue
+            with lock:
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                output.flush()
+                os.fsync(output.fileno())
+            print(f"[{done}/{len(todo)}] {item['id']} {item['date']} {item['theme']} {item['language']} {item['profile']}",
+                  file=sys.stderr)
+    return failures
+
+
+### OpenAI Batch API files ###
+def batch_request(custom_id, prompt, language, model=gpt.OPENAI_MODEL, response_format=None, max_tokens=None):
+    """One line of a Batch API input file for `/v1/chat/completions`."""
+    body = {"model": model, "messages": gpt.build_messages(prompt, language), **gpt.limits(max_tokens)}
+    if response_format is not None:
+        body["response_format"] = gpt.response_format_param(response_format)
+    return {"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body}
+
+
+def load_batch_results(paths):
+    """Map the custom ids of Batch API output files to their decoded completion, skipping errors."""
+    results = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = json.loads(line)
+                response = line.get("response") or {}
+                if line.get("error") or response.get("status_code") != 200:
+                    print(f"{line['custom_id']} failed in the batch, skipping it", file=sys.stderr)
+                    continue
+                results[line["custom_id"]] = gpt.parse_completion(response["body"]["choices"][0]["message"]["content"])
+    return results
+
+
+def batch_requests(items, step, results=None, model=None):
+    """Yield the Batch API requests of `step` for `items`. Steps after the first need the `results`
+    of the previous step, items whose previous results are missing are skipped. The model and
+    answer cap are the ones of the route of the step unless `model` is given."""
+    results = results or {}
+    route = routing.route("inspiration" if step == "inspirations" else step)
+    model = model or route.model
+    seen = set()
+    for item in items:
+        if step == "key_messages":
+            custom_id = f"{item['topic_id']}/key_messages"
+            if custom_id not in seen:
+                seen.add(custom_id)
+                yield batch_request(custom_id, item_topic_prompt(item), item["language"], model, KeyMessagesSchema,
+                                    route.max_tokens)
+        elif step == "inspirations":
+            key_messages = results.get(f"{item['topic_id']}/key_messages")
+            if not key_messages:
+                continue
+            key_message = pick_key_message(item, key_messages["key_messages"])
+            for source, prompt in item_inspiration_prompts(item, key_message).items():
+                custom_id = f"{item['topic_id']}/inspirations/{source}"
+                if custom_id not in seen:
+                    seen.add(custom_id)
+                    yield batch_request(custom_id, prompt, item["language"], model, max_tokens=route.max_tokens)
+        elif step == "predication":
+            inspirations = {
+                source: results.get(f"{item['topic_id']}/inspirations/{source}") for source in item["sources"]
+            }
+            if None in inspirations.values():
+                continue
+            prompt, budget = item_predication_prompt(item, inspirations)
+            yield batch_request(f"{item['id']}/predication", prompt, item["language"], model,
+                                max_tokens=budget["max_tokens"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate predications in bulk from a manifest.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the whole pipeline and write one JSON line per item")
+    run_parser.add_argument("manifest")
+    run_parser.add_argument("-o", "--output", required=True, help="JSONL output, also used to resume")
+    run_parser.add_argument("--concurrency", type=int, default=4, help="items generated at the same time")
+    run_parser.add_argument("--no-cache", action="store_true", help="do not use the completion cache")
+
+    emit_parser = subparsers.add_parser("emit-batch", help="write an OpenAI Batch API request file for one step")
+    emit_parser.add_argument("manifest")
+    emit_parser.add_argument("--step", choices=STEPS, required=True)
+    emit_parser.add_argument("--results", nargs="*", default=[], help="Batch API output of the previous step")
+    emit_parser.add_argument("-o", "--output", required=True)
+
+    for subparser in (run_parser, emit_parser):
+        subparser.add_argument("--model", help="model of every step, instead of the routes of routing.py")
+
+    args = parser.parse_args(argv)
+    items = load_manifest(args.manifest)
+
+    if args.command == "run":
+        cache = None if args.no_cache else CompletionCache()
+        return 1 if run(items, args.output, args.concurrency, cache, args.model) else 0
+
+    if args.step != "key_messages" and not args.results:
+        parser.error(f"--results is required for the {args.step} step")
+    results = load_batch_results(args.results)
+    count = 0
+    with open(args.output, "w", encoding="utf-8") as output:
+        for request in batch_requests(items, args.step, results, args.model):
+            output.write(json.dumps(request, ensure_ascii=False) + "\n")
+            count += 1
+    print(f"Wrote {count} {args.step} requests to {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""Compare Step 2 sent as one request per source with all the sources in one structured request.
+
+Each round generates the six inspirations of a key message both ways, without the completion
+cache, and reports the wall time (the separate requests are sent concurrently, as "Generate all
+inspirations" does), the number of requests and the tokens billed. Against the OpenAI API this
+costs a few cents:
+
+    python benchmarks/combined_inspirations.py --rounds 5
+
+With `--mock` the requests go to `mock_openai.py` instead. Its answers do not depend on the
+prompt, so only the latency overhead and the input tokens are meaningful there:
+
+    python benchmarks/combined_inspirations.py --mock --latency 0.8
+"""
+import argparse
+import os
+import sys
+import time
+
+import openai
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import gpt  # noqa: E402
+import metrics  # noqa: E402
+from prompts import (INSPIRATION_SOURCES, combined_inspirations_prompt, inspiration_prompts,  # noqa: E402
+                     inspirations_schema, split_inspirations)
+
+# gpt-4o-mini, US$ per million tokens
+INPUT_PRICE = 0.15
+OUTPUT_PRICE = 0.60
+
+KEY_MESSAGES = [
+    "Dieu se fait proche des plus petits.",
+    "La lumière brille dans les ténèbres.",
+    "Aimer son prochain comme soi-même.",
+    "Le pardon libère celui qui le donne.",
+    "L'espérance ne déçoit pas.",
+]
+
+
+def separate(client, theme, key_message, language):
+    prompts = inspiration_prompts(theme, key_message, language)
+    results = gpt.complete_all(client, prompts, language, max_workers=len(prompts), step="separate")
+    return {name: completion for name, completion, error in results}
+
+
+def combined(client, theme, key_message, language):
+    prompt = combined_inspirations_prompt(theme, key_message, language)
+    return split_inspirations(gpt.complete(client, prompt, language, inspirations_schema(), step="combined"))
+
+
+def measure(mode, client, theme, language, rounds):
+    metrics.reset()
+    latencies = []
+    for i in range(rounds):
+        started = time.perf_counter()
+        mode(client, theme, KEY_MESSAGES[i % len(KEY_MESSAGES)], language)
+        latencies.append(time.perf_counter() - started)
+    records = metrics.records()
+    return {
+        "latency": sorted(latencies)[len(latencies) // 2],
+        "requests": len(records) / rounds,
+        "errors": sum(bool(record["error"]) for record in records),
+        "prompt_tokens": sum(record["prompt_tokens"] for record in records) / rounds,
+        "completion_tokens": sum(record["completion_tokens"] for record in records) / rounds,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--theme", default="Noël")
+    parser.add_argument("--language", default="French")
+    parser.add_argument("--mock", action="store_true", help="use a local mock server instead of the OpenAI API")
+    parser.add_argument("--latency", type=float, default=0.8, help="mock seconds before the first token")
+    args = parser.parse_args(argv)
+
+    if args.mock:
+        from mock_openai import MockConfig, base_url, start_mock_server
+        server = start_mock_server(MockConfig(latency=args.latency, jitter=0.2))
+        client = openai.OpenAI(base_url=base_url(server), api_key="mock", max_retries=0)
+    else:
+        client = openai.OpenAI(max_retries=0)
+    metrics.METRICS_LOG = os.devnull  # the calls are counted from the records, keep them out of the app's log
+
+    print(f"{len(INSPIRATION_SOURCES)} sources, {args.rounds} round(s), medians and means per round")
+    print(f"{'mode':<12}{'latency':>9}{'requests':>10}{'input':>8}{'output':>8}{'cost $':>10}{'errors':>8}")
+    for name, mode in (("separate", separate), ("combined", combined)):
+        row = measure(mode, client, args.theme, args.language, args.rounds)
+        cost = (row["prompt_tokens"] * INPUT_PRICE + row["completion_tokens"] * OUTPUT_PRICE) / 1e6
+        print(f"{name:<12}{row['latency']:8.2f}s{row['requests']:10.0f}{row['prompt_tokens']:8.0f}"
+              f"{row['completion_tokens']:8.0f}{cost:10.5f}{row['errors']:8d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Compare the cost of the daily subscription job with one predication per subscriber.
+
+Creates `--subscribers` subscribers spread over the languages, profiles and themes (at most
+`--groups` distinct combinations) in a temporary store and runs the day twice against
+`mock_openai.py`: once generating a predication for every subscriber, once with
+`subscriptions.send_daily`, which generates one per group. Reports the model calls, tokens and
+time of each, then runs `send_daily` again to show that a second run of the same day costs
+nothing. E-mails are counted by a local sink instead of being sent:
+
+    python benchmarks/daily_digest.py --subscribers 100 --groups 12
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import openai
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import batch  # noqa: E402
+import metrics  # noqa: E402
+import subscriptions  # noqa: E402
+from mailer import SENT  # noqa: E402
+from mock_openai import MockConfig, base_url, start_mock_server  # noqa: E402
+from prompts import LANGUAGES, PROFILES, THEMES  # noqa: E402
+
+CITIES = [("Genève", "Suisse"), ("Lyon", "France"), ("Montréal", "Canada"), ("", "Belgique"), ("", "")]
+
+
+class SinkMailer:
+    """Accepts the messages of `send_daily` like `MailQueue`, without any SMTP server."""
+
+    def __init__(self):
+        self.messages = 0
+
+    def submit(self, to_email, subject, message, on_done=None):
+        self.messages += 1
+        if on_done is not None:
+            on_done(self.messages, {"status": SENT, "attempts": 1, "error": None, "to": to_email})
+        return self.messages
+
+    def join(self, timeout=None):
+        return True
+
+
+def fill(store, count, groups, seed=0):
+    rng = random.Random(seed)
+    combinations = list(itertools.product(LANGUAGES, PROFILES, [None] + THEMES))
+    rng.shuffle(combinations)
+    for index in range(count):
+        language, profile, theme = combinations[index % groups]
+        city, country = rng.choice(CITIES)
+        store.subscribe(f"user{index}@example.com", language, profile, theme, city, country)
+
+
+def model_cost():
+    records = [entry for entry in metrics.records() if not entry["cache_hit"]]
+    return len(records), sum(entry["prompt_tokens"] + entry["completion_tokens"] for entry in records)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--subscribers", type=int, default=100)
+    parser.add_argument("--groups", type=int, default=12, help="distinct (language, profile, theme)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.2, help="mock seconds before the answer")
+    args = parser.parse_args(argv)
+
+    server = start_mock_server(MockConfig(latency=args.latency, jitter=args.latency / 4))
+    client = openai.OpenAI(base_url=base_url(server), api_key="mock", max_retries=0)
+    metrics.METRICS_LOG = os.devnull
+    workdir = tempfile.mkdtemp()
+    store = subscriptions.SubscriberStore(os.path.join(workdir, "subscriptions.sqlite3"))
+    fill(store, args.subscribers, args.groups)
+    day = date.today()
+
+    print(f"{args.subscribers} subscribers in {args.groups} groups")
+    print(f"{'mode':<22}{'calls':>8}{'tokens':>10}{'seconds':>9}{'e-mails':>9}")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(lambda subscriber: batch.run_item(
+            client, subscriptions.group_item(day, (subscriber["language"], subscriber["profile"], subscriber["theme"])),
+        ), store.subscribers()))
+    calls, tokens = model_cost()
+    print(f"{'one per subscriber':<22}{calls:8d}{tokens:10d}{time.perf_counter() - started:9.1f}{args.subscribers:9d}")
+
+    for mode in ("grouped", "grouped, second run"):
+        metrics.reset()
+        mailer = SinkMailer()
+        started = time.perf_counter()
+        subscriptions.send_daily(store, client, mailer, day, concurrency=args.concurrency)
+        calls, tokens = model_cost()
+        print(f"{mode:<22}{calls:8d}{tokens:10d}{time.perf_counter() - started:9.1f}{mailer.messages:9d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Compare the tail latency and the cost of the routes with and without timeout fallback and hedging.
+
+Sends Step 1 requests (structured, not streamed) to `mock_openai.py` configured with a slow tail:
+`--tail-rate` of the answers take `--tail-latency` more seconds. Each mode runs the same number
+of requests, after `--warm-up` unmeasured ones that give the routes their p95, and reports the
+latency percentiles, the requests sent per call and the tokens
+billed, the ones of the hedges that lost included:
+
+    python benchmarks/hedging.py --calls 400 --tail-rate 0.03
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import gpt  # noqa: E402
+import metrics  # noqa: E402
+import routing  # noqa: E402
+from mock_openai import MockConfig, base_url, start_mock_server  # noqa: E402
+from prompts import KeyMessagesSchema, topic_prompt  # noqa: E402
+
+MODES = {
+    "plain": dict(timeout=600, hedge=False),
+    "timeout": dict(timeout=None, hedge=False),  # --timeout, then the fallback model
+    "hedge": dict(timeout=600, hedge=True),
+    "both": dict(timeout=None, hedge=True),
+}
+
+
+def percentile(values, q):
+    return sorted(values)[min(len(values) - 1, int(q * len(values)))]
+
+
+def measure(client, config, mode, args):
+    settings = MODES[mode]
+    routing.reset()
+    metrics.reset()
+    routing.ROUTES["key_messages"] = routing.Route("key_messages", "gpt-4o-mini", "gpt-4.1-mini", 500,
+                                                   settings["timeout"] or args.timeout, settings["hedge"])
+
+    def call(i):
+        started = time.perf_counter()
+        gpt.complete(client, topic_prompt("Noël"), "French", KeyMessagesSchema, session=f"user-{i % args.concurrency}",
+                     step="key_messages")
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(call, range(args.warm_up)))
+        metrics.reset()
+        requests, wasted = config.requests, routing.stats()["hedge_wasted_tokens"]
+        latencies = list(executor.map(call, range(args.calls)))
+    time.sleep(args.tail_latency + 1)  # let the hedges that lost finish to count their tokens
+    records = metrics.records()
+    tokens = sum(record["prompt_tokens"] + record["completion_tokens"] for record in records)
+    return {
+        "p50": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "requests": (config.requests - requests) / args.calls,
+        "tokens": (tokens + routing.stats()["hedge_wasted_tokens"] - wasted) / args.calls,
+        "fallbacks": sum(record["fallback"] for record in records),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--warm-up", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.5, help="mock seconds before the answer")
+    parser.add_argument("--jitter", type=float, default=0.3)
+    parser.add_argument("--tail-rate", type=float, default=0.03, help="probability of a slow answer")
+    parser.add_argument("--tail-latency", type=float, default=8.0, help="seconds added to a slow answer")
+    parser.add_argument("--timeout", type=float, default=3.0, help="route timeout of the timeout modes")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    args = parser.parse_args(argv)
+
+    config = MockConfig(latency=args.latency, jitter=args.jitter, tail_rate=args.tail_rate,
+                        tail_latency=args.tail_latency)
+    server = start_mock_server(config)
+    client = openai.OpenAI(base_url=base_url(server), api_key="mock", max_retries=0)
+    metrics.METRICS_LOG = os.devnull
+
+    print(f"{args.calls} calls, {args.concurrency} at a time, {args.tail_rate:.0%} of the answers "
+          f"{args.tail_latency:.0f}s slower")
+    print(f"{'mode':<10}{'p50':>8}{'p95':>8}{'p99':>8}{'requests':>10}{'tokens':>8}{'fallbacks':>11}")
+    for mode in args.modes:
+        row = measure(client, config, mode, args)
+        print(f"{mode:<10}{row['p50']:7.2f}s{row['p95']:7.2f}s{row['p99']:7.2f}s{row['requests']:10.3f}"
+              f"{row['tokens']:8.0f}{row['fallbacks']:11d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Compare the shared connection pool of `http_pool.py` with one OpenAI client per request.
+
+`--threads` threads send `--requests` requests in total to `mock_openai.py`, each one either with
+a new `openai.OpenAI` client (so a new connection, and a TLS handshake against the real API) or
+with a client of the shared pool. Reports the throughput, the latency percentiles and the TCP
+connections the mock server accepted:
+
+    python benchmarks/http_pool.py --threads 16 --requests 400
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import http_pool  # noqa: E402
+from mock_openai import MockConfig, base_url, start_mock_server  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "Propose 5 messages clés."}]
+
+
+def count_connections(server):
+    """Return a function giving the number of connections `server` accepted so far."""
+    accepted = [0]
+    lock = threading.Lock()
+    get_request = server.get_request
+
+    def counted():
+        with lock:
+            accepted[0] += 1
+        return get_request()
+
+    server.get_request = counted
+    return lambda: accepted[0]
+
+
+def run(send, args):
+    def timed(_):
+        started = time.perf_counter()
+        send()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        latencies = sorted(executor.map(timed, range(args.requests)))
+    return time.perf_counter() - started, latencies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--latency", type=float, default=0.05, help="mock seconds before the answer")
+    args = parser.parse_args(argv)
+
+    server = start_mock_server(MockConfig(latency=args.latency, tokens_per_second=0))
+    connections = count_connections(server)
+    url = base_url(server)
+
+    def new_client():
+        with openai.OpenAI(base_url=url, api_key="mock", max_retries=0) as client:
+            client.chat.completions.create(model="gpt-4o-mini", messages=MESSAGES)
+
+    pooled = http_pool.make_client(base_url=url, api_key="mock")
+
+    def shared_pool():
+        pooled.chat.completions.create(model="gpt-4o-mini", messages=MESSAGES)
+
+    print(f"{args.requests} requests from {args.threads} threads")
+    print(f"{'client':<20}{'req/s':>8}{'p50':>9}{'p95':>9}{'connections':>13}")
+    for name, send in (("one per request", new_client), ("shared pool", shared_pool)):
+        before = connections()
+        seconds, latencies = run(send, args)
+        p50, p95 = latencies[len(latencies) // 2], latencies[int(0.95 * len(latencies))]
+        print(f"{name:<20}{args.requests / seconds:8.0f}{p50 * 1000:7.1f}ms{p95 * 1000:7.1f}ms"
+              f"{connections() - before:13d}")
+    stats = http_pool.stats()
+    print(f"pool: {stats['reuse_rate']:.0%} of the requests reused a connection, peak {stats['peak_in_flight']} "
+          f"in flight, {stats['saturated']} found it full")
+
+
+if __name__ == "__main__":
+    main()
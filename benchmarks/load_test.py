@@ -0,0 +1,224 @@
+"""Load and latency benchmark of app.py against the local mock OpenAI server.
+
+Every simulated user drives its own session of the app through Streamlit's `AppTest`, clicking
+through Step 1 -> Step 2 -> Step 3 -> Share, all users at the same time. For each number of users
+the runner reports the latency percentiles of every step as seen by the user, the script rerun
+time of an interaction without model call ("select"), the memory per session and the throughput:
+
+    python benchmarks/load_test.py --users 1 10 100 --latency 0.5
+
+`AppTest` cannot run several scripts concurrently in one process, so every user is a process
+forked from this one (Linux/macOS). The completion cache file is shared by all of them, but
+process-wide objects such as the request scheduler and the shared key messages are per user.
+
+Nothing leaves the machine: the app is pointed at `mock_openai.py` started on a free port, the
+metrics endpoint and the key messages warm-up are disabled and e-mails go to a local aiosmtpd
+server when it is installed.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+STEPS = ["load", "key_messages", "select", "inspirations", "predication", "share"]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float("nan")
+
+
+def rss_bytes():
+    """Resident memory of the process (Linux), None elsewhere."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"nothing listening on port {port}")
+
+
+def run_session(user, cached, timings):
+    """One user clicking through the four steps, appending `(step, seconds)` to `timings`.
+    Return the `AppTest`, whose session is still alive."""
+    from streamlit.testing.v1 import AppTest
+
+    from prompts import THEMES
+
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=600)
+
+    def timed(step, action):
+        started = time.perf_counter()
+        action()
+        timings.append((step, time.perf_counter() - started))
+        if at.exception:
+            raise RuntimeError(f"{step}: {at.exception[0].value}")
+
+    def button(label):
+        return next(b for b in at.button if b.label == label)
+
+    timed("load", at.run)
+    if not cached:
+        at.checkbox(key="REGENERATE").check().run()
+    at.radio(key="METHOD").set_value("Select a Theme").run()
+    at.selectbox(key="THEME_CHOICE").set_value(THEMES[user % len(THEMES)]).run()
+    timed("key_messages", lambda: button("Generate Key Messages").click().run())
+    timed("select", lambda: at.button(key="option_0").click().run())
+    timed("inspirations", lambda: at.button(key="generate_all").click().run())
+    timed("predication", lambda: button("Generate Predication").click().run())
+    at.text_input[-3].input(f"user{user}@example.com").run()
+    timed("share", lambda: button("Send Email").click().run())
+    if at.error:
+        raise RuntimeError(f"errors on the page: {[e.value for e in at.error]}")
+    return at
+
+
+def user_process(user, cached, start_at, results):
+    import metrics
+
+    metrics.reset()  # drop the records inherited from the parent
+    rss_before = rss_bytes()
+    time.sleep(max(0.0, start_at - time.time()))
+    timings, error, memory = [], None, None
+    try:
+        at = run_session(user, cached, timings)
+        if rss_before is not None:
+            memory = rss_bytes() - rss_before
+        del at
+    except Exception:
+        error = traceback.format_exc(limit=4)
+    results.put({"timings": timings, "records": metrics.records(), "memory": memory, "error": error,
+                 "finished": time.time()})
+
+
+def run_level(users, ramp, cached):
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    start_at = time.time() + 1.0 + 0.02 * users  # everybody forked before the first user starts
+    processes = [
+        context.Process(target=user_process, args=(user, cached, start_at + ramp * user / users, results))
+        for user in range(users)
+    ]
+    for process in processes:
+        process.start()
+    reports = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    elapsed = max(report["finished"] for report in reports) - start_at
+
+    failures = [report["error"] for report in reports if report["error"]]
+    timings = [timing for report in reports for timing in report["timings"]]
+    records = [record for report in reports for record in report["records"]]
+    memory = [report["memory"] for report in reports if report["memory"] is not None]
+    model_calls = sum(not record["cache_hit"] for record in records)
+
+    print(f"\n=== {users} user(s): {users - len(failures)} sessions ok, {len(failures)} failed, {elapsed:.1f}s ===")
+    print(f"throughput: {(users - len(failures)) / elapsed * 60:.1f} sessions/min, {model_calls / elapsed:.1f} model calls/s")
+    if memory:
+        print(f"memory: {sum(memory) / len(memory) / 2 ** 20:.1f} MiB per session (RSS growth of its process)")
+    print(f"{'step':<24}{'p50':>8}{'p95':>8}{'p99':>8}   seconds as seen by the user")
+    for step in STEPS:
+        values = [seconds for name, seconds in timings if name == step]
+        print(f"{step:<24}" + "".join(f"{percentile(values, q):8.2f}" for q in (0.5, 0.95, 0.99)))
+    print(f"{'model call':<24}{'p50':>8}{'p95':>8}{'p99':>8}   seconds per request")
+    for step in sorted({record["step"] for record in records}):
+        values = [record["latency"] for record in records if record["step"] == step and not record["cache_hit"]]
+        print(f"{step:<24.24}" + "".join(f"{percentile(values, q):8.2f}" for q in (0.5, 0.95, 0.99)))
+    for failure in failures[:3]:
+        print(failure, file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--ramp", type=float, default=0.0, help="seconds over which the users arrive")
+    parser.add_argument("--latency", type=float, default=0.5, help="mock seconds before the first token")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--mock-rpm", type=int, default=0, help="mock answers 429 above this rate")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of a random mock 429")
+    parser.add_argument("--cached", action="store_true", help="let the completion cache answer repeated requests")
+    args = parser.parse_args(argv)
+
+    mock_port = free_port()
+    servers = [subprocess.Popen([
+        sys.executable, os.path.join(HERE, "mock_openai.py"), "--port", str(mock_port),
+        "--latency", str(args.latency), "--jitter", str(args.jitter),
+        "--tokens-per-second", str(args.tokens_per_second), "--rpm", str(args.mock_rpm),
+        "--error-rate", str(args.error_rate), "--retry-after", "0.5",
+    ], stdout=subprocess.DEVNULL)]
+    wait_for_port(mock_port)
+
+    workdir = tempfile.mkdtemp(prefix="predication-bench-")
+    os.environ.update({
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{mock_port}/v1",
+        "OPENAI_API_KEY": "mock",
+        "COMPLETION_CACHE_PATH": os.path.join(workdir, "completions.sqlite3"),
+        "SESSION_STORE_PATH": os.path.join(workdir, "sessions.sqlite3"),
+        "METRICS_LOG": os.path.join(workdir, "metrics.jsonl"),
+        "METRICS_PORT": "0",
+        "WARM_UP_KEY_MESSAGES": "0",
+    })
+    try:
+        import aiosmtpd  # noqa: F401
+
+        smtp_port = free_port()
+        servers.append(subprocess.Popen([
+            sys.executable, "-m", "aiosmtpd", "-n", "-l", f"127.0.0.1:{smtp_port}", "-c", "aiosmtpd.handlers.Sink",
+        ]))
+        wait_for_port(smtp_port)
+        os.environ.update({"SMTP_SERVER": "127.0.0.1", "SMTP_PORT": str(smtp_port), "SMTP_STARTTLS": "0"})
+    except ImportError:
+        print("aiosmtpd not installed, e-mails will fail in the background", file=sys.stderr)
+
+    # Loaded once here so the forked users share these pages instead of loading their own copy:
+    # Streamlit and the lazily imported parts of the OpenAI SDK, through one structured request.
+    import openai
+    import streamlit.testing.v1  # noqa: F401
+
+    import gpt
+    from prompts import KeyMessagesSchema
+    gpt.complete(openai.OpenAI(max_retries=0), "warm-up", "French", KeyMessagesSchema)
+
+    print(f"mock latency {args.latency}s (+{args.jitter}s jitter), {args.tokens_per_second} tokens/s, "
+          f"{'cache on' if args.cached else 'cache bypassed'}, work dir {workdir}")
+    try:
+        for users in args.users:
+            run_level(users, args.ramp, args.cached)
+        with urllib.request.urlopen(f"http://127.0.0.1:{mock_port}/stats") as response:
+            stats = json.load(response)
+        print(f"\nmock server: {stats['requests']} requests, {stats['rate_limited']} answered 429")
+    finally:
+        for server in servers:
+            server.terminate()
+
+
+if __name__ == "__main__":
+    main()
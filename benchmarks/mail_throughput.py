@@ -0,0 +1,68 @@
+"""Measure the e-mail throughput of `MailQueue` against a local SMTP server.
+
+Needs aiosmtpd (`pip install aiosmtpd`), no e-mail leaves the machine:
+
+    python benchmarks/mail_throughput.py --messages 500 --workers 1 2 4
+"""
+import argparse
+import os
+import smtplib
+import sys
+import time
+
+from aiosmtpd.controller import Controller
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mailer import SENT, MailQueue, build_message  # noqa: E402
+
+
+class CountingHandler:
+    def __init__(self):
+        self.received = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        self.received += 1
+        return "250 OK"
+
+
+def one_connection_per_message(host, port, messages):
+    """The former `send_mail`: connect, send and quit for every message."""
+    for i in range(messages):
+        smtp = smtplib.SMTP(host, port)
+        smtp.send_message(build_message("bench@example.com", f"Message {i}", "Predication", "app@example.com"))
+        smtp.quit()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    args = parser.parse_args(argv)
+
+    handler = CountingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=8025)
+    controller.start()
+    try:
+        started = time.perf_counter()
+        one_connection_per_message(controller.hostname, controller.port, args.messages)
+        elapsed = time.perf_counter() - started
+        print(f"one connection per message: {args.messages / elapsed:8.1f} msg/s")
+
+        for workers in args.workers:
+            mail_queue = MailQueue(controller.hostname, controller.port, user="app@example.com", password="",
+                                   starttls=False, workers=workers)
+            started = time.perf_counter()
+            ids = [mail_queue.submit("bench@example.com", f"Message {i}", "Predication") for i in range(args.messages)]
+            submitted = time.perf_counter() - started
+            mail_queue.join()
+            elapsed = time.perf_counter() - started
+            sent = sum(mail_queue.status(message_id)["status"] == SENT for message_id in ids)
+            print(f"MailQueue, {workers} worker(s):    {args.messages / elapsed:8.1f} msg/s "
+                  f"({sent}/{args.messages} sent, {mail_queue.connections_opened} connection(s), "
+                  f"submit {submitted / args.messages * 1e6:.0f} µs/msg)")
+    finally:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    main()
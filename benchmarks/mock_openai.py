@@ -0,0 +1,196 @@
+"""Local OpenAI-compatible server for benchmarks, no token is spent.
+
+Serves `POST /v1/chat/completions` with plain, structured (`json_schema`) and streamed answers.
+Latency (with an optional slow tail), streaming speed and rate limiting are configurable, `GET /stats` returns the number of
+requests received and answered with a 429:
+
+    python benchmarks/mock_openai.py --port 8765 --latency 0.8 --jitter 0.3 --rpm 600
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=mock streamlit run app.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LOREM = ("Dieu est amour et celui qui demeure dans l'amour demeure en Dieu et Dieu demeure en lui "
+         "la lumière brille dans les ténèbres et les ténèbres ne l'ont point arrêtée ").split()
+
+
+class MockConfig:
+    def __init__(self, latency=0.5, jitter=0.0, tokens_per_second=200.0, answer_tokens=120, rpm=0,
+                 error_rate=0.0, retry_after=1.0, tail_rate=0.0, tail_latency=10.0, field_words=12):
+        self.latency = latency  # seconds before the first token
+        self.jitter = jitter  # random extra latency, uniform in [0, jitter]
+        self.tokens_per_second = tokens_per_second  # generation speed once started, 0 for instant
+        self.answer_tokens = answer_tokens  # words in a free-text answer
+        self.rpm = rpm  # requests per minute before answering 429, 0 for no limit
+        self.error_rate = error_rate  # probability of a random 429
+        self.retry_after = retry_after  # seconds, sent in the Retry-After header of a 429
+        self.tail_rate = tail_rate  # probability of a slow answer
+        self.tail_latency = tail_latency  # seconds added to a slow answer
+        self.field_words = field_words  # words in each string of a structured answer
+        self.requests = 0
+        self.rate_limited = 0
+        self._window = []
+        self._lock = threading.Lock()
+
+    def admit(self):
+        """False when the request must be answered with a 429."""
+        with self._lock:
+            self.requests += 1
+            now = time.monotonic()
+            self._window = [t for t in self._window if now - t < 60]
+            limited = (self.rpm and len(self._window) >= self.rpm) or random.random() < self.error_rate
+            if limited:
+                self.rate_limited += 1
+            else:
+                self._window.append(now)
+            return not limited
+
+
+def fake_value(schema, defs, words=12):
+    """A value matching a (strict) JSON schema, good enough for the app's Pydantic schemas."""
+    if "$ref" in schema:
+        return fake_value(defs[schema["$ref"].split("/")[-1]], defs, words)
+    kind = schema.get("type")
+    if kind == "object":
+        return {name: fake_value(prop, defs, words) for name, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [fake_value(schema.get("items", {"type": "string"}), defs, words) for _ in range(5)]
+    if kind == "integer":
+        return random.randint(1, 10)
+    if kind == "number":
+        return random.random()
+    if kind == "boolean":
+        return True
+    return " ".join(random.choices(LOREM, k=words))
+
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # the client gave up waiting, e.g. after its timeout
+
+        def do_GET(self):
+            if self.path != "/stats":
+                self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+                return
+            self._send_json(200, {"requests": config.requests, "rate_limited": config.rate_limited})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if not self.path.endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+                return
+            if not config.admit():
+                self._send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}},
+                                {"retry-after": str(config.retry_after)})
+                return
+            slow = random.random() < config.tail_rate
+            time.sleep(config.latency + random.uniform(0, config.jitter) + (config.tail_latency if slow else 0))
+
+            response_format = body.get("response_format") or {}
+            if response_format.get("type") == "json_schema":
+                schema = response_format["json_schema"]["schema"]
+                contents = [json.dumps(fake_value(schema, schema.get("$defs", {}), config.field_words)) for _ in range(body.get("n") or 1)]
+            else:
+                words = min(config.answer_tokens, body.get("max_tokens") or body.get("max_completion_tokens") or 10 ** 6)
+                contents = [" ".join(random.choices(LOREM, k=words)) for _ in range(body.get("n") or 1)]
+            prompt_tokens = sum(len(message["content"]) for message in body["messages"]) // 4
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": sum(len(c.split()) for c in contents),
+                     "total_tokens": prompt_tokens + sum(len(c.split()) for c in contents)}
+
+            if body.get("stream"):
+                self._stream(body, contents[0], usage)
+                return
+            if config.tokens_per_second:
+                time.sleep(max(len(content.split()) for content in contents) / config.tokens_per_second)
+            self._send_json(200, {
+                "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()), "model": body["model"],
+                "choices": [{"index": i, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+                            for i, content in enumerate(contents)],
+                "usage": usage,
+            })
+
+        def _stream(self, body, content, usage):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+
+            def event(choices, usage=None):
+                chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": body["model"], "choices": choices, "usage": usage}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            for word in content.split():
+                event([{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}])
+                if config.tokens_per_second:
+                    time.sleep(1 / config.tokens_per_second)
+            event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            if (body.get("stream_options") or {}).get("include_usage"):
+                event([], usage)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+    return Handler
+
+
+def start_mock_server(config=None, host="127.0.0.1", port=0):
+    """Start the server in a daemon thread and return it; its URL is `base_url(server)`."""
+    server = ThreadingHTTPServer((host, port), make_handler(config or MockConfig()))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def base_url(server):
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/v1"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible mock server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds before the first token")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency, in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--answer-tokens", type=int, default=120)
+    parser.add_argument("--rpm", type=int, default=0, help="answer 429 above this many requests per minute")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of a random 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After of the 429 answers")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="probability of a slow answer")
+    parser.add_argument("--tail-latency", type=float, default=10.0, help="seconds added to a slow answer")
+    parser.add_argument("--field-words", type=int, default=12, help="words in each string of a structured answer")
+    args = parser.parse_args(argv)
+
+    config = MockConfig(args.latency, args.jitter, args.tokens_per_second, args.answer_tokens, args.rpm,
+                        args.error_rate, args.retry_after, args.tail_rate, args.tail_latency, args.field_words)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(config))
+    server.daemon_threads = True
+    print(f"Mock OpenAI server on http://{args.host}:{args.port}/v1", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Measure what speculative prefetch of Step 2 saves in waiting time and costs in tokens.
+
+Simulated users read the key messages for a random time, choose one (mostly among the first
+ones with `--choice zipf`, any with `--choice uniform`) and wait for their inspirations. Each
+user is run twice against `mock_openai.py`: without prefetch, where the combined Step 2 request
+only starts after the choice, and with `Prefetcher`. Reports the wait after the choice, the
+hit rate and the tokens used and wasted:
+
+    python benchmarks/prefetch.py --users 20 --candidates 2 --latency 2
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import gpt  # noqa: E402
+import metrics  # noqa: E402
+from mock_openai import MockConfig, base_url, start_mock_server  # noqa: E402
+from prefetch import Prefetcher  # noqa: E402
+from prompts import combined_inspirations_prompt, inspirations_schema  # noqa: E402
+
+KEY_MESSAGES = 5  # displayed by Step 1
+
+
+def choose(rng, choice):
+    if choice == "uniform":
+        return rng.randrange(KEY_MESSAGES)
+    return rng.choices(range(KEY_MESSAGES), weights=[1 / (rank + 1) for rank in range(KEY_MESSAGES)])[0]
+
+
+def user(client, prefetcher, index, args):
+    """Seconds waited for the inspirations after choosing, and the tokens of the requests sent for it."""
+    rng = random.Random(index)
+    key_messages = [f"Message clé {index}.{rank}" for rank in range(KEY_MESSAGES)]
+    chosen = key_messages[choose(rng, args.choice)]
+    session = f"user-{index}"
+    if prefetcher is not None:
+        prefetcher.start(session, "Noël", key_messages, args.language)
+    time.sleep(rng.uniform(*args.read))
+    started = time.perf_counter()
+    future = prefetcher.claim(session, chosen) if prefetcher is not None else None
+    if future is None or future.result() is None:
+        timings = {}
+        gpt.complete(client, combined_inspirations_prompt("Noël", chosen, args.language), args.language,
+                     inspirations_schema(), timings=timings, session=session, step="inspiration:combined")
+        tokens = timings["usage"].total_tokens
+    else:
+        tokens = 0  # counted by the prefetcher
+    return time.perf_counter() - started, tokens
+
+
+def run(client, prefetcher, args):
+    with ThreadPoolExecutor(max_workers=args.users) as executor:
+        results = list(executor.map(lambda index: user(client, prefetcher, index, args), range(args.users)))
+    waits = sorted(wait for wait, _ in results)
+    return waits, sum(tokens for _, tokens in results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--candidates", type=int, default=2, help="key messages prefetched, from the top")
+    parser.add_argument("--sources", type=int, default=6, help="sources prefetched per key message")
+    parser.add_argument("--choice", choices=["zipf", "uniform"], default="zipf")
+    parser.add_argument("--read", type=float, nargs=2, default=(5.0, 15.0), metavar=("MIN", "MAX"),
+                        help="seconds spent reading the key messages")
+    parser.add_argument("--latency", type=float, default=2.0, help="mock seconds before the answer")
+    parser.add_argument("--language", default="French")
+    args = parser.parse_args(argv)
+
+    server = start_mock_server(MockConfig(latency=args.latency, jitter=args.latency / 4))
+    client = openai.OpenAI(base_url=base_url(server), api_key="mock", max_retries=0)
+    metrics.METRICS_LOG = os.devnull
+
+    print(f"{args.users} users, {args.candidates} of {KEY_MESSAGES} key messages prefetched, {args.choice} choice")
+    print(f"{'mode':<12}{'wait p50':>10}{'wait p95':>10}{'hit rate':>10}{'tokens':>8}{'wasted':>8}")
+    waits, tokens = run(client, None, args)
+    print(f"{'no prefetch':<12}{waits[len(waits) // 2]:9.2f}s{waits[int(0.95 * len(waits))]:9.2f}s{'':>10}{tokens:8d}{0:8d}")
+
+    prefetcher = Prefetcher(client, candidates=args.candidates, sources=args.sources, workers=args.users)
+    waits, tokens = run(client, prefetcher, args)
+    prefetcher.shutdown()  # let the unused prefetches finish to count their tokens
+    stats = prefetcher.stats()
+    print(f"{'prefetch':<12}{waits[len(waits) // 2]:9.2f}s{waits[int(0.95 * len(waits))]:9.2f}s"
+          f"{stats['hit_rate']:10.0%}{tokens + stats['used_tokens'] + stats['wasted_tokens']:8d}{stats['wasted_tokens']:8d}")
+
+
+if __name__ == "__main__":
+    main()
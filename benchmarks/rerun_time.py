@@ -0,0 +1,176 @@
+"""Measure how long the Streamlit server spends on the interactions that do not call the model.
+
+Starts `streamlit run` on the app against `mock_openai.py`, connects to it like a browser (over
+the websocket of the page) and, once key messages and inspirations were generated, repeats the
+cheap interactions: choosing a key message, unticking an inspiration, moving the length slider.
+For each one it reports the median time until the server reports the run finished and the CPU
+time the server process used for it:
+
+    python benchmarks/rerun_time.py --repeat 20
+
+`--app` measures another version of the script, e.g. one saved from an earlier commit, to compare.
+Needs the `websockets` package.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import websockets
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+from mock_openai import MockConfig, base_url, start_mock_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def cpu_seconds(pid):
+    """User and system CPU time used so far by the process `pid`."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / TICKS
+
+
+def start_app(app, port, env):
+    process = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", app, "--server.headless", "true", "--server.port", str(port),
+         "--browser.gatherUsageStats", "false"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1)
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("the Streamlit server did not start")
+
+
+class Page:
+    """The state a browser keeps for one session: the widgets last drawn and their values."""
+
+    def __init__(self, websocket, server_pid):
+        self.websocket = websocket
+        self.server_pid = server_pid
+        self.widgets = {}  # user key or label -> (widget id, fragment id)
+        self.values = {}  # widget id -> WidgetState sent back on every run
+
+    async def run(self, widget=None, fragment_id="", **value):
+        """Send a rerun like the browser does after an interaction and wait for the end of the run.
+        Returns `(seconds, server CPU seconds)`."""
+        message = BackMsg()
+        state = message.rerun_script
+        state.page_script_hash = ""
+        state.fragment_id = fragment_id
+        for widget_state in self.values.values():
+            state.widget_states.widgets.add().CopyFrom(widget_state)
+        if widget is not None:
+            trigger = state.widget_states.widgets.add()
+            trigger.id = widget
+            for field, content in value.items():
+                if field == "double_array_value":
+                    trigger.double_array_value.data.extend(content)
+                else:
+                    setattr(trigger, field, content)
+            if "trigger_value" not in value:
+                self.values[widget] = trigger
+        cpu = cpu_seconds(self.server_pid)
+        started = time.perf_counter()
+        await self.websocket.send(message.SerializeToString())
+        while True:
+            forward = ForwardMsg()
+            forward.ParseFromString(await self.websocket.recv())
+            kind = forward.WhichOneof("type")
+            if kind == "delta" and forward.delta.WhichOneof("type") == "new_element":
+                self.remember(forward.delta.new_element, forward.delta.fragment_id)
+            elif kind == "script_finished" and forward.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                return time.perf_counter() - started, cpu_seconds(self.server_pid) - cpu
+
+    def remember(self, element, fragment_id):
+        widget = getattr(element, element.WhichOneof("type") or "", None)
+        widget_id = getattr(widget, "id", "")
+        if not widget_id.startswith("$$ID"):
+            return
+        key = widget_id.split("-", 2)[2] if widget_id.count("-") >= 2 else ""
+        for name in (key, getattr(widget, "label", "")):
+            if name and name != "None":
+                self.widgets[name] = (widget_id, fragment_id)
+
+    async def click(self, name):
+        widget_id, fragment_id = self.widgets[name]
+        return await self.run(widget_id, fragment_id, trigger_value=True)
+
+    async def set(self, name, **value):
+        widget_id, fragment_id = self.widgets[name]
+        return await self.run(widget_id, fragment_id, **value)
+
+
+async def measure(port, server_pid, repeat):
+    url = f"ws://127.0.0.1:{port}/_stcore/stream"
+    async with websockets.connect(url, subprotocols=["streamlit"], max_size=None) as websocket:
+        page = Page(websocket, server_pid)
+        await page.run()
+        await page.click("Generate Key Messages")
+        await page.click("option_0")
+        await page.click("generate_combined")
+
+        checkbox = next(name for name in page.widgets if name.startswith("INSPIRATION_"))
+        interactions = {
+            "choose key message": lambda i: page.click(f"option_{i % 2}"),
+            "untick inspiration": lambda i: page.set(checkbox, bool_value=bool(i % 2)),
+            "move length slider": lambda i: page.set("Length of the homily (minutes)",
+                                                     double_array_value=[8 + i % 2]),
+        }
+        results = {}
+        for name, interaction in interactions.items():
+            timings = [await interaction(i) for i in range(repeat)]
+            results[name] = (sorted(t for t, _ in timings)[repeat // 2], sum(c for _, c in timings) / repeat)
+        return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", default=os.path.join(ROOT, "app.py"))
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    mock = start_mock_server(MockConfig(latency=0.0, jitter=0.0))
+    workdir = tempfile.mkdtemp()
+    port = free_port()
+    env = dict(
+        os.environ, OPENAI_API_KEY="mock", OPENAI_BASE_URL=base_url(mock), WARM_UP_KEY_MESSAGES="0",
+        METRICS_PORT="0", METRICS_LOG=os.path.join(workdir, "metrics.jsonl"),
+        SESSION_STORE_PATH=os.path.join(workdir, "sessions.sqlite3"),
+        COMPLETION_CACHE_PATH=os.path.join(workdir, "completions.sqlite3"),
+    )
+    process = start_app(os.path.abspath(args.app), port, env)
+    try:
+        results = asyncio.run(measure(port, process.pid, args.repeat))
+    finally:
+        process.terminate()
+        process.wait()
+        mock.shutdown()
+
+    print(f"{os.path.relpath(args.app)}, {args.repeat} run(s) per interaction")
+    print(f"{'interaction':<22}{'median':>10}{'cpu/run':>10}")
+    for name, (seconds, cpu) in results.items():
+        print(f"{name:<22}{seconds * 1000:8.1f}ms{cpu * 1000:8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
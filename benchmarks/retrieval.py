@@ -0,0 +1,89 @@
+"""Measure the build, cold start and query latency of the local retrieval index.
+
+Writes a synthetic corpus of `--passages` passages per language (words drawn from the sample
+corpus with a Zipf distribution, so common words are common), builds the index with
+`retrieval.build`, then reports its size, the time to open it in a new process state (the arrays
+are memory-mapped, nothing is parsed) and the latency percentiles of `--queries` queries the size
+of a key message:
+
+    python benchmarks/retrieval.py --passages 50000
+"""
+import argparse
+import itertools
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import retrieval  # noqa: E402
+
+
+def vocabulary(language):
+    """The distinct words of the sample passages of `language`, padded with made-up ones, and
+    their cumulative Zipf weights."""
+    words = sorted({word for passage in retrieval.read_corpus().get(language, [])
+                    for word in passage["text"].lower().split()})
+    words += [f"mot{number}" for number in range(5000)]
+    return words, list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+
+
+def write_corpus(path, languages, passages, words_per_passage, seed=0):
+    rng = random.Random(seed)
+    os.makedirs(path)
+    with open(os.path.join(path, "synthetic.tsv"), "w", encoding="utf-8") as f:
+        for language in languages:
+            words, weights = vocabulary(language)
+            for number in range(passages):
+                text = " ".join(rng.choices(words, cum_weights=weights, k=words_per_passage))
+                f.write(f"{language} {number}\t{language}\tSynthetic\t{text}\n")
+
+
+def percentile(values, fraction):
+    return sorted(values)[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--passages", type=int, default=50000, help="per language")
+    parser.add_argument("--words", type=int, default=40, help="words per passage")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("-k", type=int, default=retrieval.RETRIEVAL_TOP_K or 3)
+    args = parser.parse_args(argv)
+
+    languages = ["French", "English", "Spanish"]
+    directory = tempfile.mkdtemp()
+    try:
+        corpus, index = os.path.join(directory, "corpus"), os.path.join(directory, "index")
+        write_corpus(corpus, languages, args.passages, args.words)
+
+        started = time.perf_counter()
+        retrieval.build(corpus, index)
+        build_seconds = time.perf_counter() - started
+        size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(index) for name in names)
+        print(f"{args.passages} passages x {len(languages)} languages of {args.words} words")
+        print(f"build {build_seconds:.1f}s, index {size / 2 ** 20:.1f} MiB")
+
+        rng = random.Random(1)
+        words, weights = vocabulary("French")
+        queries = [" ".join(rng.choices(words, cum_weights=weights, k=12)) for _ in range(args.queries)]
+        started = time.perf_counter()
+        retriever = retrieval.Retriever(index, args.k)
+        retriever.search(queries[0], "French")
+        print(f"cold start (open the index and answer a first query) {(time.perf_counter() - started) * 1000:.1f}ms")
+
+        latencies = []
+        for query in queries:
+            started = time.perf_counter()
+            retriever.search(query, "French")
+            latencies.append(time.perf_counter() - started)
+        print(f"query p50 {percentile(latencies, 0.5) * 1000:.2f}ms, p95 {percentile(latencies, 0.95) * 1000:.2f}ms, "
+              f"max {max(latencies) * 1000:.2f}ms")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Compare rewriting one section of the predication with generating the whole homily again.
+
+Generates a structured predication of `--minutes` minutes from six inspirations against
+`mock_openai.py`, then rewrites each of its sections on its own. The mock writes as many words per
+section as the homily length gives them and streams them at `--tokens-per-second`, so the
+numbers reflect the answer lengths the app asks for. Reports the prompt and completion tokens
+and the time of each kind of revision:
+
+    python benchmarks/section_rewrite.py --minutes 8 --tokens-per-second 60
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import openai
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import gpt  # noqa: E402
+import metrics  # noqa: E402
+import predication  # noqa: E402
+from mock_openai import LOREM, MockConfig, base_url, start_mock_server  # noqa: E402
+from prompt_budget import WORDS_PER_MINUTE, assemble_predication_prompt, assemble_section_prompt  # noqa: E402
+from prompts import INSPIRATION_SOURCES, PROFILES, predication_schema  # noqa: E402
+
+
+def timed(client, prompt, response_format, max_tokens, step):
+    """`(completion, seconds, prompt tokens, completion tokens)` of one streamed call."""
+    timings = {}
+    started = time.perf_counter()
+    completion = gpt.complete(client, prompt, "French", response_format, on_token=lambda text: None,
+                              timings=timings, step=step, max_tokens=max_tokens)
+    usage = timings["usage"]
+    return completion, time.perf_counter() - started, usage.prompt_tokens, usage.completion_tokens
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--minutes", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=1, help="whole generations, each followed by every rewrite")
+    parser.add_argument("--latency", type=float, default=0.5, help="mock seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=60.0)
+    args = parser.parse_args(argv)
+
+    inspirations = {source: " ".join(LOREM[:40]) for source in INSPIRATION_SOURCES}
+    sections = len(INSPIRATION_SOURCES) + 4
+    words = args.minutes * WORDS_PER_MINUTE // sections
+    server = start_mock_server(MockConfig(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                                          answer_tokens=words, field_words=words))
+    client = openai.OpenAI(base_url=base_url(server), api_key="mock", max_retries=0)
+    metrics.METRICS_LOG = os.devnull
+
+    results = {"whole predication": [], "one section": []}
+    for _ in range(args.repeat):
+        prompt, budget = assemble_predication_prompt(PROFILES[0], "French", "Noël", inspirations, args.minutes,
+                                                     structured=True)
+        completion, *measures = timed(client, prompt, predication_schema(budget["sections"]), budget["max_tokens"],
+                                      "predication")
+        results["whole predication"].append(measures)
+        document = predication.from_completion(completion, budget["sections"])
+        for section in document:
+            prompt, budget = assemble_section_prompt(PROFILES[0], "French", "Noël", section, document, inspirations,
+                                                     args.minutes)
+            results["one section"].append(timed(client, prompt, None, budget["max_tokens"], "predication:section")[1:])
+
+    print(f"{args.minutes}-minute homily in {sections} sections of about {words} words")
+    print(f"{'revision':<20}{'seconds':>9}{'prompt':>8}{'answer':>8}")
+    for name, measures in results.items():
+        seconds, prompt_tokens, completion_tokens = (statistics.median(column) for column in zip(*measures))
+        print(f"{name:<20}{seconds:9.2f}{prompt_tokens:8.0f}{completion_tokens:8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Compare translating the predication with running the whole pipeline in every language.
+
+For `--languages` languages, runs Steps 1 to 3 (structured predication) against `mock_openai.py`
+once per language one after the other, as a user switching the sidebar language does, then runs
+them once in the first language and translates the predication into the others in parallel with
+`translation.translate_all`. Reports the model calls, the tokens and the time of each:
+
+    python benchmarks/translation.py --languages 3
+"""
+import argparse
+import os
+import sys
+import time
+
+import openai
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import gpt  # noqa: E402
+import metrics  # noqa: E402
+import predication  # noqa: E402
+import translation  # noqa: E402
+from mock_openai import MockConfig, base_url, start_mock_server  # noqa: E402
+from prompt_budget import assemble_predication_prompt  # noqa: E402
+from prompts import (LANGUAGES, PROFILES, KeyMessagesSchema, inspiration_prompts, predication_schema,  # noqa: E402
+                     topic_prompt)
+
+THEME = "Noël"
+
+
+def pipeline(client, language):
+    """Steps 1 to 3 in `language`, returning the predication document."""
+    key_message = gpt.complete(client, topic_prompt(THEME), language, KeyMessagesSchema,
+                               step="key_messages")["key_messages"][0]
+    inspirations = {name: completion for name, completion, _ in gpt.complete_all(
+        client, inspiration_prompts(THEME, key_message, language), language, step="inspiration")}
+    prompt, budget = assemble_predication_prompt(PROFILES[0], language, THEME, inspirations, structured=True)
+    completion = gpt.complete(client, prompt, language, predication_schema(budget["sections"]), step="predication",
+                              max_tokens=budget["max_tokens"])
+    return predication.from_completion(completion, budget["sections"])
+
+
+def cost():
+    records = metrics.records()
+    return len(records), sum(entry["prompt_tokens"] + entry["completion_tokens"] for entry in records)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--languages", type=int, default=3, choices=range(2, len(LANGUAGES) + 1))
+    parser.add_argument("--latency", type=float, default=0.5, help="mock seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--section-words", type=int, default=30, help="mock words per field of a structured answer")
+    args = parser.parse_args(argv)
+
+    server = start_mock_server(MockConfig(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                                          answer_tokens=60, field_words=args.section_words))
+    client = openai.OpenAI(base_url=base_url(server), api_key="mock", max_retries=0)
+    metrics.METRICS_LOG = os.devnull
+    languages = LANGUAGES[:args.languages]
+
+    print(f"Predication in {', '.join(languages)}")
+    print(f"{'mode':<24}{'calls':>7}{'tokens':>9}{'seconds':>9}")
+    metrics.reset()
+    started = time.perf_counter()
+    for language in languages:
+        pipeline(client, language)
+    calls, tokens = cost()
+    print(f"{'one pipeline each':<24}{calls:7d}{tokens:9d}{time.perf_counter() - started:9.1f}")
+
+    metrics.reset()
+    started = time.perf_counter()
+    document = pipeline(client, languages[0])
+    for language, _, error in translation.translate_all(client, document, languages[0], languages[1:]):
+        if error is not None:
+            print(f"{language} failed: {error}", file=sys.stderr)
+    calls, tokens = cost()
+    print(f"{'pipeline + translation':<24}{calls:7d}{tokens:9d}{time.perf_counter() - started:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
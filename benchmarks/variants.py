@@ -0,0 +1,75 @@
+"""Compare asking a source again for each variant with asking for `n` variants in one request.
+
+For every inspiration source of a key message, gets `--variants` options against
+`mock_openai.py` either by clicking "Generate" once per option (one request each, the full
+prompt every time) or with "Variants per request" set to `--variants` (the `n` parameter: one
+request, the prompt billed once). Reports the model calls, the prompt tokens per extra option,
+the answer tokens, the time and the variants left in the pools after duplicates are dropped:
+
+    python benchmarks/variants.py --variants 5
+"""
+import argparse
+import os
+import sys
+import time
+
+import openai
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import gpt  # noqa: E402
+import metrics  # noqa: E402
+import retrieval  # noqa: E402
+import variants  # noqa: E402
+from mock_openai import MockConfig, base_url, start_mock_server  # noqa: E402
+from prompts import inspiration_prompts  # noqa: E402
+
+THEME = "Noël"
+KEY_MESSAGE = "Dieu se fait proche des plus petits."
+
+
+def one_per_click(client, prompt, language, count):
+    return [gpt.complete(client, prompt, language, step="inspiration") for _ in range(count)]
+
+
+def one_request(client, prompt, language, count):
+    return gpt.complete(client, prompt, language, step="inspiration", n=count)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--variants", type=int, default=5)
+    parser.add_argument("--language", default="French")
+    parser.add_argument("--latency", type=float, default=0.5, help="mock seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    args = parser.parse_args(argv)
+
+    server = start_mock_server(MockConfig(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                                          answer_tokens=60))
+    client = openai.OpenAI(base_url=base_url(server), api_key="mock", max_retries=0)
+    metrics.METRICS_LOG = os.devnull
+    references = retrieval.get_retriever().ground(THEME, KEY_MESSAGE, args.language)
+    prompts = inspiration_prompts(THEME, KEY_MESSAGE, args.language, references=references)
+
+    def run(generate, count):
+        metrics.reset()
+        started = time.perf_counter()
+        kept = 0
+        for prompt in prompts.values():
+            pool, _ = variants.merge([], generate(client, prompt, args.language, count))
+            kept += len(pool)
+        records = metrics.records()
+        return (len(records), sum(record["prompt_tokens"] for record in records),
+                sum(record["completion_tokens"] for record in records), time.perf_counter() - started, kept)
+
+    _, single_prompt_tokens, _, _, _ = run(one_request, 1)
+    extra_options = len(prompts) * (args.variants - 1)
+    print(f"{args.variants} variants of {len(prompts)} sources")
+    print(f"{'mode':<20}{'calls':>7}{'prompt/extra':>14}{'answer':>8}{'seconds':>9}{'kept':>6}")
+    for name, generate in (("one per click", one_per_click), ("n per request", one_request)):
+        calls, prompt_tokens, answer_tokens, seconds, kept = run(generate, args.variants)
+        extra = (prompt_tokens - single_prompt_tokens) / extra_options if extra_options else 0.0
+        print(f"{name:<20}{calls:7d}{extra:14.0f}{answer_tokens:8d}{seconds:9.1f}{kept:6d}")
+
+
+if __name__ == "__main__":
+    main()
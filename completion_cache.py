@@ -0,0 +1,106 @@
+"""Persistent cache for GPT completions.
+
+Completions are stored in a local SQLite file keyed on a hash of everything that determines the
+answer (model, system prompt, user prompt and JSON schema), so identical requests coming from any
+session, or after a restart, are answered from disk without calling OpenAI.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_PATH = os.getenv("COMPLETION_CACHE_PATH", os.path.join(".cache", "completions.sqlite3"))
+DEFAULT_TTL = int(os.getenv("COMPLETION_CACHE_TTL", 7 * 24 * 3600))  # seconds
+DEFAULT_MAX_ENTRIES = int(os.getenv("COMPLETION_CACHE_MAX_ENTRIES", 5000))
+
+
+def make_key(model, system_prompt, prompt, response_format=None, n=1):
+    """Return the content address of a request. `response_format` is a Pydantic class whose JSON
+    schema is part of the key, so changing the schema never returns a stale structure. A request
+    for `n` > 1 answers has its own key."""
+    schema = response_format.model_json_schema() if response_format is not None else None
+    request = {"model": model, "system": system_prompt, "prompt": prompt, "schema": schema}
+    if n != 1:
+        request["n"] = n
+    payload = json.dumps(request, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """SQLite backed key/value store with per-entry TTL and LRU eviction above `max_entries`.
+    Safe to share between the threads of the Streamlit server and between processes."""
+
+    def __init__(self, path=DEFAULT_PATH, default_ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS completions_last_access ON completions (last_access)")
+
+    def get(self, key):
+        """Return the cached completion or None, counting the hit or miss."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, expires_at FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None or (row[1] is not None and row[1] <= now):
+                if row is not None:
+                    self._db.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE completions SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        """Store a JSON-serialisable completion for `ttl` seconds (default TTL when None, never
+        expires when 0) and evict the least recently used entries above the size cap."""
+        ttl = self.default_ttl if ttl is None else ttl
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO completions (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires_at, now),
+            )
+            self._db.execute(
+                "DELETE FROM completions WHERE key IN ("
+                " SELECT key FROM completions ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def delete(self, key):
+        with self._lock:
+            self._db.execute("DELETE FROM completions WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM completions")
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    def stats(self):
+        """Hit/miss counters of this process and the current number of stored entries."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self),
+        }
@@ -0,0 +1,228 @@
+"""Headless GPT calls used by the Streamlit app and the batch generator.
+
+Nothing in here touches Streamlit, so these functions can run in worker threads and scripts.
+Errors are raised to the caller.
+"""
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
+
+import http_pool
+import metrics
+import routing
+from completion_cache import make_key
+from prompts import SYSTEM_PROMPTS
+from scheduler import estimate_tokens, get_scheduler
+
+OPENAI_MODEL = routing.ROUTES["default"].model
+# A JSON string field and its value, possibly not closed yet
+PARTIAL_STRING = re.compile(r'"([^"\\]*)"\s*:\s*"((?:[^"\\]|\\.)*)')
+
+
+def build_messages(prompt, language):
+    return [
+        {
+            "role": "system",
+            "content": SYSTEM_PROMPTS[language]
+        },
+        {
+            "role": "user",
+            "content": prompt,
+        }
+    ]
+
+
+def response_format_param(response_format):
+    """The raw `response_format` request parameter for a Pydantic class, as needed when the
+    request is not sent through `client.beta.chat.completions.parse` (e.g. Batch API files)."""
+    schema = response_format.model_json_schema()
+    schema["additionalProperties"] = False
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": response_format.__name__, "strict": True, "schema": schema},
+    }
+
+
+def parse_completion(content):
+    """Strip the completion text and decode it if GPT returned a JSON-like object."""
+    completion = content.strip()
+    try:
+        completion = json.loads(completion)
+    except ValueError:
+        pass
+    return completion
+
+
+def limits(max_tokens, n=1):
+    """Request parameters capping the answer, and asking for `n` answers when more than one."""
+    params = {} if max_tokens is None else {"max_tokens": max_tokens}
+    if n != 1:
+        params["n"] = n
+    return params
+
+
+def partial_fields(text):
+    """The `(field, value)` string pairs of the JSON object `text`, cut anywhere: while it is
+    streamed, or when the answer stopped at `max_tokens`."""
+    fields = []
+    for match in PARTIAL_STRING.finditer(text):
+        try:
+            fields.append((match.group(1), json.loads(f'"{match.group(2)}"')))
+        except ValueError:
+            fields.append((match.group(1), match.group(2)))  # \u escape cut in the middle
+    return fields
+
+
+def partial_strings(text):
+    """The string values of the JSON object `text`, cut anywhere while it is streamed: a structured
+    answer rendered as it arrives."""
+    return [value for _, value in partial_fields(text)]
+
+
+def stream_tokens(client, messages, timings, model=OPENAI_MODEL, session="default", on_wait=None, max_tokens=None,
+                  timeout=None, response_format=None):
+    """Yield the completion tokens as they arrive and record the time-to-first-token (seconds) in
+    `timings["ttft"]`, including the time spent waiting in the scheduler queue. `timeout` is the
+    number of seconds without data after which `openai.APITimeoutError` is raised. With a
+    `response_format` Pydantic class the tokens are pieces of the JSON answer. The request holds its
+    scheduler slot until the stream is read or the generator closed."""
+    started = time.perf_counter()
+    structured = {} if response_format is None else {"response_format": response_format_param(response_format)}
+    stream, release = get_scheduler().open(
+        lambda: client.chat.completions.create(messages=messages, model=model, stream=True,
+                                               stream_options={"include_usage": True},
+                                               timeout=None if timeout is None else http_pool.timeout(read=timeout),
+                                               **limits(max_tokens), **structured),
+        session, estimate_tokens(messages, max_tokens), on_wait, timings,
+    )
+    try:
+        for chunk in stream:
+            if chunk.usage is not None:
+                timings["usage"] = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                if "ttft" not in timings:
+                    timings["ttft"] = time.perf_counter() - started
+                yield chunk.choices[0].delta.content
+    finally:
+        stream.close()
+        release()
+
+
+def complete(client, prompt, language, response_format=None, model=None, cache=None,
+             regenerate=False, cache_ttl=None, on_token=None, timings=None, session="default", on_wait=None,
+             step=None, max_tokens=None, n=1):
+    """Return the completion of `prompt` with the system prompt of `language`, decoded from JSON
+    when GPT returned an object (always the case with a `response_format` Pydantic class).
+    With `n` > 1, return the list of `n` completions generated by a single request: the prompt is
+    sent and billed once. They cannot be streamed.
+
+    Identical requests are answered from `cache` (a `CompletionCache`) for `cache_ttl` seconds
+    unless `regenerate` is set. When `on_token` is given the answer is streamed and
+    `on_token(text_so_far)` is called for every token, `text_so_far` being the JSON received so
+    far with a `response_format` (see `partial_strings`); the time-to-first-token is stored in
+    `timings["ttft"]`.
+
+    The request goes through the process-wide scheduler in the fair queue of `session`;
+    `on_wait(position, eta)` reports the wait (see `FairScheduler.call`). The `model`,
+    `max_tokens` cap of the answer, deadline and fallback default to the route of `step` (see
+    `routing`).
+
+    Every call is recorded by `metrics.record` under `step` (e.g. "key_messages")."""
+    timings = {} if timings is None else timings
+    route = routing.route(step)
+    model = model or route.model
+    max_tokens = route.max_tokens if max_tokens is None else max_tokens
+    started = time.perf_counter()
+    error = None
+    try:
+        return _complete(client, prompt, language, response_format, model, cache, regenerate, cache_ttl,
+                         on_token, timings, session, on_wait, max_tokens, route, n)
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        metrics.record(step, timings.get("model", model), language, time.perf_counter() - started, timings, error)
+
+
+def _complete(client, prompt, language, response_format, model, cache, regenerate, cache_ttl,
+              on_token, timings, session, on_wait, max_tokens, route, n):
+    if n != 1 and on_token is not None:
+        raise ValueError("several completions cannot be streamed")
+    messages = build_messages(prompt, language)
+    cache_key = make_key(model, messages[0]["content"], prompt, response_format, n)
+    if cache is not None and not regenerate:
+        completion = cache.get(cache_key)
+        if completion is not None:
+            timings["cache_hit"] = True
+            return completion
+
+    if on_token is not None:
+        def send(model):
+            # Restarted from scratch on the fallback model when the stream stalls
+            text = ""
+            with closing(stream_tokens(client, messages, timings, model, session, on_wait, max_tokens, route.timeout,
+                                       response_format)) as tokens:
+                for token in tokens:
+                    text += token
+                    on_token(text)
+            return text
+
+        completion = routing.call(send, route, model, timings)
+        completion = completion.strip() if response_format is None else parse_completion(completion)
+    else:
+        def send(model):
+            def create():
+                started = time.perf_counter()
+                if response_format is None:
+                    response = client.chat.completions.create(
+                        messages=messages,
+                        model=model,
+                        timeout=http_pool.timeout(read=route.timeout),
+                        **limits(max_tokens, n)
+                    )
+                else:
+                    response = client.beta.chat.completions.parse(
+                        messages=messages,
+                        model=model,
+                        response_format=response_format,
+                        timeout=http_pool.timeout(read=route.timeout),
+                        **limits(max_tokens, n)
+                    )
+                routing.observe(route, time.perf_counter() - started)
+                return response
+            # Wait for the slot on this thread, with `on_wait`; only the request itself may be duplicated
+            return get_scheduler().call(lambda: routing.hedged(create, route, timings), session,
+                                        estimate_tokens(messages, max_tokens, n), on_wait, timings)
+
+        response = routing.call(send, route, model, timings)
+        timings["response"] = response
+        timings["usage"] = response.usage
+        completion = [parse_completion(choice.message.content) for choice in response.choices]
+        completion = completion if n != 1 else completion[0]
+
+    if cache is not None:
+        cache.set(cache_key, completion, ttl=cache_ttl)
+    return completion
+
+
+def complete_all(client, prompts, language, max_workers=6, step=None, regenerate=False, **kwargs):
+    """Send all the `{name: prompt}` at the same time and yield `(name, completion, error)` as each
+    one finishes, so the wait is about the slowest call rather than the sum of all of them.
+    A failing prompt yields its exception and does not cancel the others. Each call is recorded
+    under the step "`step`:`name`". `regenerate` is a bool, or the names whose cached answer is not
+    wanted; `kwargs` are passed to `complete`."""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(complete, client, prompt, language, step=f"{step}:{name}" if step else name,
+                            regenerate=regenerate if isinstance(regenerate, bool) else name in regenerate,
+                            **kwargs): name
+            for name, prompt in prompts.items()
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                yield name, future.result(), None
+            except Exception as e:
+                yield name, None, e
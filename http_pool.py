@@ -0,0 +1,169 @@
+"""One pool of HTTP connections to OpenAI for the whole process.
+
+Every OpenAI client built by `get_client`, `make_client` and `get_async_client` sends its requests
+through the same keep-alive connection pool, sized with `OPENAI_POOL_CONNECTIONS` and kept open
+`OPENAI_KEEPALIVE_EXPIRY` seconds between requests, so the sessions, worker threads and batch
+jobs of a process reuse a few warm TLS connections instead of opening their own. When every
+connection is busy a request waits up to `OPENAI_POOL_TIMEOUT` seconds for one rather than opening
+more sockets.
+
+Requests give up after `OPENAI_CONNECT_TIMEOUT` seconds to connect and `OPENAI_READ_TIMEOUT`
+seconds without data (the deadline of a route, see `routing`, takes precedence, through
+`timeout(read=...)`).
+`OPENAI_HTTP2=1` multiplexes the requests over one connection, when the `h2` package is installed.
+
+`stats` counts the connections opened, the requests served on an already open one and the
+requests that found the pool saturated.
+"""
+import functools
+import importlib.util
+import os
+import threading
+
+import openai
+
+try:
+    import httpx2 as httpx  # the HTTP client of the recent openai releases
+except ImportError:
+    import httpx
+
+OPENAI_POOL_CONNECTIONS = int(os.getenv("OPENAI_POOL_CONNECTIONS", 50))
+OPENAI_POOL_KEEPALIVE = int(os.getenv("OPENAI_POOL_KEEPALIVE", OPENAI_POOL_CONNECTIONS))  # idle connections kept
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", 120))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", 5))
+OPENAI_READ_TIMEOUT = float(os.getenv("OPENAI_READ_TIMEOUT", 60))
+OPENAI_POOL_TIMEOUT = float(os.getenv("OPENAI_POOL_TIMEOUT", 30))
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "0") != "0" and importlib.util.find_spec("h2") is not None
+
+_lock = threading.Lock()
+_counters = {"requests": 0, "connections_opened": 0, "saturated": 0, "pool_timeouts": 0, "in_flight": 0,
+             "peak_in_flight": 0}
+_clients = {}  # "sync" / "async" -> shared httpx client
+
+
+def limits(connections=OPENAI_POOL_CONNECTIONS, keepalive=OPENAI_POOL_KEEPALIVE, expiry=OPENAI_KEEPALIVE_EXPIRY):
+    return httpx.Limits(max_connections=connections, max_keepalive_connections=min(keepalive, connections),
+                        keepalive_expiry=expiry)
+
+
+def timeout(read=OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT, write=OPENAI_READ_TIMEOUT,
+            pool=OPENAI_POOL_TIMEOUT):
+    """The timeouts of the pool, `read` being the seconds without data (e.g. `timeout(read=route.timeout)`:
+    a plain number given as a request `timeout` would replace the connect and pool ones as well)."""
+    return httpx.Timeout(connect=connect, read=read, write=write, pool=pool)
+
+
+def _count(**increments):
+    with _lock:
+        for name, value in increments.items():
+            _counters[name] += value
+        _counters["peak_in_flight"] = max(_counters["peak_in_flight"], _counters["in_flight"])
+
+
+def _watch(pool, max_connections):
+    """Count the connections `pool` opens, and whether a request arriving now has to wait for one."""
+    create_connection = pool.create_connection
+
+    def counted(origin):
+        _count(connections_opened=1)
+        return create_connection(origin)
+
+    pool.create_connection = counted
+    return lambda: (len(pool.connections) >= max_connections
+                    and not any(connection.is_available() for connection in pool.connections))
+
+
+class CountingTransport(httpx.HTTPTransport):
+    """`httpx.HTTPTransport` feeding the counters of `stats`."""
+
+    def __init__(self, limits, **kwargs):
+        super().__init__(limits=limits, **kwargs)
+        self._saturated = _watch(self._pool, limits.max_connections)
+
+    def handle_request(self, request):
+        _count(requests=1, saturated=self._saturated(), in_flight=1)
+        try:
+            return super().handle_request(request)
+        except httpx.PoolTimeout:
+            _count(pool_timeouts=1)
+            raise
+        finally:
+            _count(in_flight=-1)  # the body of a streamed answer may still be read after this
+
+
+class AsyncCountingTransport(httpx.AsyncHTTPTransport):
+    """`httpx.AsyncHTTPTransport` feeding the counters of `stats`."""
+
+    def __init__(self, limits, **kwargs):
+        super().__init__(limits=limits, **kwargs)
+        self._saturated = _watch(self._pool, limits.max_connections)
+
+    async def handle_async_request(self, request):
+        _count(requests=1, saturated=self._saturated(), in_flight=1)
+        try:
+            return await super().handle_async_request(request)
+        except httpx.PoolTimeout:
+            _count(pool_timeouts=1)
+            raise
+        finally:
+            _count(in_flight=-1)
+
+
+def get_http_client():
+    """The process-wide httpx client and its connection pool."""
+    with _lock:
+        if "sync" not in _clients:
+            _clients["sync"] = openai.DefaultHttpxClient(
+                transport=CountingTransport(limits(), http2=OPENAI_HTTP2), limits=limits(), timeout=timeout(),
+                http2=OPENAI_HTTP2)
+        return _clients["sync"]
+
+
+def get_async_http_client():
+    """The process-wide async httpx client, for code running in an event loop. An async pool is
+    bound to the event loop that uses it first."""
+    with _lock:
+        if "async" not in _clients:
+            _clients["async"] = openai.DefaultAsyncHttpxClient(
+                transport=AsyncCountingTransport(limits(), http2=OPENAI_HTTP2), limits=limits(), timeout=timeout(),
+                http2=OPENAI_HTTP2)
+        return _clients["async"]
+
+
+def make_client(**kwargs):
+    """A new `openai.OpenAI` on the shared pool. `kwargs` are passed to it (e.g. `base_url`); the
+    retries are left to the request scheduler unless `max_retries` is given."""
+    kwargs.setdefault("max_retries", 0)
+    return openai.OpenAI(http_client=get_http_client(), timeout=timeout(), **kwargs)
+
+
+@functools.lru_cache(maxsize=None)
+def get_client():
+    """The process-wide `openai.OpenAI`, configured from the environment."""
+    return make_client()
+
+
+def get_async_client(**kwargs):
+    """A new `openai.AsyncOpenAI` on the shared async pool."""
+    kwargs.setdefault("max_retries", 0)
+    return openai.AsyncOpenAI(http_client=get_async_http_client(), timeout=timeout(), **kwargs)
+
+
+def stats():
+    """The counters since the start (or `reset`): `requests`, `connections_opened`, `reused` (requests
+    sent on an open connection), `saturated` (requests that found every connection busy),
+    `pool_timeouts` and the requests `in_flight` now and at the `peak_in_flight`."""
+    with _lock:
+        counters = dict(_counters)
+    counters["reused"] = max(0, counters["requests"] - counters["connections_opened"])
+    counters["reuse_rate"] = counters["reused"] / counters["requests"] if counters["requests"] else 0.0
+    counters["max_connections"] = OPENAI_POOL_CONNECTIONS
+    counters["http2"] = OPENAI_HTTP2
+    return counters
+
+
+def reset():
+    """Zero the counters, e.g. between benchmark runs."""
+    with _lock:
+        for name in _counters:
+            _counters[name] = 0
@@ -0,0 +1,120 @@
+"""Key messages computed once and served to every session.
+
+The "No Input" method (readings of the day) and the built-in themes send exactly the same Step 1
+request from every session. `KeyMessagesStore` computes each (theme, language) answer once per
+day, lets concurrent sessions asking for the same key wait for that single call instead of
+sending their own, and forgets everything at local midnight.
+
+Run this module from cron shortly after midnight to warm the persistent completion cache shared
+by all the server processes:
+
+    python key_messages_store.py
+"""
+import argparse
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import gpt
+import http_pool
+from completion_cache import CompletionCache
+from prompts import LANGUAGES, THEMES, KeyMessagesSchema, topic_prompt
+
+
+def seconds_until_midnight():
+    """Cache TTL for answers that only hold for today, like the readings of the day."""
+    now = datetime.now()
+    return int((datetime.combine(now.date() + timedelta(days=1), datetime.min.time()) - now).total_seconds())
+
+
+class KeyMessagesStore:
+    """In-memory key messages per (theme, language) for the current day, `theme` None being the
+    readings of the day. Misses go through `gpt.complete` and the persistent `cache`."""
+
+    def __init__(self, client, cache=None, model=None, languages=LANGUAGES, themes=THEMES):
+        self.client = client
+        self.cache = cache
+        self.model = model
+        self.languages = languages
+        self.themes = themes
+        self.computed = 0  # requests that went to the completion cache or OpenAI
+        self.served = 0  # requests answered from memory
+        self.warmed_at = None
+        self._entries = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self._day = date.today()
+
+    def keys(self):
+        """Every (theme, language) precomputed by `warm_up`."""
+        return [(theme, language) for theme in [None] + list(self.themes) for language in self.languages]
+
+    def get(self, theme, language, regenerate=False, on_wait=None):
+        """Return the key messages of `theme` (readings of the day when None) in `language`.
+        `on_wait` reports the wait in the OpenAI scheduler queue (see `FairScheduler.call`)."""
+        key = (theme, language)
+        with self._lock:
+            if self._day != date.today():  # past midnight, the readings changed
+                self._entries.clear()
+                self._day = date.today()
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:  # a single request per key, the other sessions wait for its answer
+            if not regenerate and key in self._entries:
+                self.served += 1
+                return self._entries[key]
+            key_messages = gpt.complete(
+                self.client, topic_prompt(theme), language, KeyMessagesSchema, model=self.model,
+                cache=self.cache, regenerate=regenerate,
+                cache_ttl=seconds_until_midnight() if theme is None else None,
+                session="shared", on_wait=on_wait, step="key_messages",
+            )["key_messages"]
+            self._entries[key] = key_messages
+            self.computed += 1
+            return key_messages
+
+    def warm_up(self, regenerate=False, max_workers=6):
+        """Compute every key in parallel and return the `{key: exception}` of the ones that failed."""
+        errors = {}
+
+        def compute(key):
+            try:
+                self.get(*key, regenerate=regenerate)
+            except Exception as e:
+                errors[key] = e
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(compute, self.keys()))
+        self.warmed_at = datetime.now()
+        return errors
+
+    def refresh(self):
+        """Recompute every key from OpenAI, ignoring the caches (admin action)."""
+        return self.warm_up(regenerate=True)
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "computed": self.computed,
+            "served": self.served,
+            "warmed_at": self.warmed_at,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute the daily and theme key messages.")
+    parser.add_argument("--refresh", action="store_true", help="ignore the cached answers")
+    parser.add_argument("--concurrency", type=int, default=6)
+    args = parser.parse_args(argv)
+
+    store = KeyMessagesStore(http_pool.get_client(), CompletionCache())
+    errors = store.warm_up(regenerate=args.refresh, max_workers=args.concurrency)
+    for (theme, language), error in errors.items():
+        print(f"{theme or 'readings of the day'} ({language}) failed: {error}", file=sys.stderr)
+    print(f"Warmed {len(store.keys()) - len(errors)}/{len(store.keys())} key messages", file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""Liturgical calendar of the Roman rite and index of the readings of the lectionary.
+
+`liturgical_day` places a date in its season and week from the date of Easter (Gregorian
+computus), with the Sunday cycle (A/B/C) and the weekday cycle (I/II) of its liturgical year.
+`readings` looks its key up in `data/lectionary.tsv`, read once per process, so Step 1 can give
+GPT the exact references of the day instead of asking it to identify them.
+
+Epiphany, Ascension and Corpus Christi follow the calendar of France and Switzerland: Epiphany
+on the Sunday between January 2 and 8, Ascension on Thursday, Corpus Christi on Sunday.
+"""
+import os
+from datetime import date, timedelta
+from functools import lru_cache
+
+LECTIONARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "lectionary.tsv")
+READING_FIELDS = ["first_reading", "psalm", "second_reading", "gospel"]
+
+MONTHS = ["janvier", "février", "mars", "avril", "mai", "juin", "juillet", "août", "septembre", "octobre",
+          "novembre", "décembre"]
+WEEKDAYS = ["lundi", "mardi", "mercredi", "jeudi", "vendredi", "samedi", "dimanche"]
+SEASONS = {
+    "advent": "de l'Avent",
+    "christmas": "du temps de Noël",
+    "lent": "de Carême",
+    "easter": "de Pâques",
+    "ordinary": "du temps ordinaire",
+}
+CELEBRATIONS = {
+    "christmas": "Nativité du Seigneur",
+    "holy-family": "Sainte Famille",
+    "mary-mother-of-god": "Sainte Marie, Mère de Dieu",
+    "epiphany": "Épiphanie du Seigneur",
+    "baptism": "Baptême du Seigneur",
+    "ash-wednesday": "Mercredi des Cendres",
+    "palm-sunday": "Dimanche des Rameaux et de la Passion",
+    "holy-thursday": "Jeudi saint",
+    "good-friday": "Vendredi saint",
+    "holy-saturday": "Samedi saint",
+    "easter": "Dimanche de Pâques",
+    "ascension": "Ascension du Seigneur",
+    "pentecost": "Pentecôte",
+    "trinity": "Sainte Trinité",
+    "corpus-christi": "Saint-Sacrement du Corps et du Sang du Christ",
+    "sacred-heart": "Sacré-Cœur de Jésus",
+    "assumption": "Assomption de la Vierge Marie",
+    "all-saints": "Toussaint",
+    "christ-the-king": "Christ, Roi de l'univers",
+}
+
+
+def easter(year):
+    """Date of Easter Sunday in the Gregorian calendar (anonymous Gregorian algorithm)."""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7  # noqa: E741
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def sunday_before(day):
+    """The Sunday strictly before `day`."""
+    return day - timedelta(days=(day.weekday() + 1) % 7 or 7)
+
+
+def advent_start(year):
+    """First Sunday of Advent of the liturgical year starting at the end of `year`."""
+    return sunday_before(date(year, 12, 25)) - timedelta(weeks=3)
+
+
+def epiphany(year):
+    return date(year, 1, 2) + timedelta(days=(6 - date(year, 1, 2).weekday()) % 7)
+
+
+def baptism(year):
+    """The Sunday after Epiphany, or the Monday when Epiphany falls on January 7 or 8."""
+    return epiphany(year) + (timedelta(days=1) if epiphany(year).day >= 7 else timedelta(weeks=1))
+
+
+def holy_family(year):
+    """The Sunday within the octave of Christmas of `year`, December 30 when there is none."""
+    christmas = date(year, 12, 25)
+    return christmas + timedelta(days=(6 - christmas.weekday()) % 7 or 5)
+
+
+def _celebration(day):
+    """Key of the solemnity or feast with its own readings celebrated on `day`, if any."""
+    fixed = {(12, 25): "christmas", (1, 1): "mary-mother-of-god", (8, 15): "assumption", (11, 1): "all-saints"}
+    if (day.month, day.day) in fixed:
+        return fixed[(day.month, day.day)]
+    paschal = easter(day.year)
+    movable = {
+        epiphany(day.year): "epiphany",
+        baptism(day.year): "baptism",
+        holy_family(day.year): "holy-family",
+        paschal - timedelta(days=46): "ash-wednesday",
+        paschal - timedelta(days=7): "palm-sunday",
+        paschal - timedelta(days=3): "holy-thursday",
+        paschal - timedelta(days=2): "good-friday",
+        paschal - timedelta(days=1): "holy-saturday",
+        paschal: "easter",
+        paschal + timedelta(days=39): "ascension",
+        paschal + timedelta(days=49): "pentecost",
+        paschal + timedelta(days=56): "trinity",
+        paschal + timedelta(days=63): "corpus-christi",
+        paschal + timedelta(days=68): "sacred-heart",
+        advent_start(day.year) - timedelta(weeks=1): "christ-the-king",
+    }
+    return movable.get(day)
+
+
+def _season(day):
+    """`(season, week)` of `day`, the week being 0 for the days after Ash Wednesday."""
+    paschal = easter(day.year)
+    if day >= advent_start(day.year):
+        if day < date(day.year, 12, 25):
+            return "advent", (day - advent_start(day.year)).days // 7 + 1
+        return "christmas", 1
+    if day <= baptism(day.year):
+        return "christmas", 1
+    if day < paschal - timedelta(days=46):
+        start = sunday_before(baptism(day.year) + timedelta(days=1))  # the Sunday of the Baptism week
+        return "ordinary", (day - start).days // 7 + 1
+    if day < paschal:
+        return "lent", (day - (paschal - timedelta(days=42))).days // 7 + 1
+    if day <= paschal + timedelta(days=49):
+        return "easter", (day - paschal).days // 7 + 1
+    return "ordinary", 34 - (advent_start(day.year) - timedelta(days=1) - day).days // 7
+
+
+def _ordinal(number, feminine=False):
+    return f"{number}{'re' if feminine else 'er'}" if number == 1 else f"{number}e"
+
+
+def liturgical_day(day=None):
+    """Describe `day` (today when None) as a dict: `key` (of the lectionary index), `name` (in
+    French), `season`, `week`, `sunday_cycle` ("A", "B" or "C"), `weekday_cycle` ("I" or "II")
+    and `cycle`, the one of the two that applies to the readings of the day."""
+    day = day or date.today()
+    liturgical_year = day.year + 1 if day >= advent_start(day.year) else day.year
+    sunday_cycle = "CAB"[liturgical_year % 3]
+    weekday_cycle = "I" if liturgical_year % 2 else "II"  # of the year the liturgical year ends in
+    season, week = _season(day)
+    celebration = _celebration(day)
+    if celebration:
+        key, name = celebration, CELEBRATIONS[celebration]
+    elif day.weekday() == 6:
+        key = f"{season}-{week}"
+        name = f"{_ordinal(week)} dimanche {SEASONS[season]}"
+    elif season == "christmas":
+        key = f"christmas-{day:%m%d}"
+        name = f"{WEEKDAYS[day.weekday()].capitalize()} {day.day} {MONTHS[day.month - 1]}, temps de Noël"
+    elif week == 0:
+        key = f"lent-0-{day.weekday()}"
+        name = f"{WEEKDAYS[day.weekday()].capitalize()} après les Cendres"
+    else:
+        key = f"{season}-{week}-{day.weekday()}"
+        name = f"{WEEKDAYS[day.weekday()].capitalize()} de la {_ordinal(week, True)} semaine {SEASONS[season]}"
+    return {
+        "date": day,
+        "key": key,
+        "name": name,
+        "season": season,
+        "week": week,
+        "sunday_cycle": sunday_cycle,
+        "weekday_cycle": weekday_cycle,
+        "cycle": sunday_cycle if celebration or day.weekday() == 6 else weekday_cycle,
+    }
+
+
+@lru_cache(maxsize=None)
+def load_lectionary(path=LECTIONARY_PATH):
+    """`{(key, cycle): {field: reference}}` read from the tab separated lectionary file."""
+    index = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("#") or not line.strip():
+                continue
+            key, cycle, *references = line.rstrip("\n").split("\t")
+            index[(key, cycle)] = dict(zip(READING_FIELDS, references))
+    return index
+
+
+def readings(day=None, path=LECTIONARY_PATH):
+    """Readings of `day` (today when None) as `{field: reference}`, None when not in the index."""
+    liturgical = liturgical_day(day)
+    index = load_lectionary(path)
+    return index.get((liturgical["key"], liturgical["cycle"])) or index.get((liturgical["key"], "*"))
@@ -0,0 +1,174 @@
+"""Background e-mail dispatch.
+
+`MailQueue.submit` returns immediately with a message id; a worker thread sends the queued
+messages over one authenticated SMTP connection that is kept open between messages, retries
+transient failures with exponential backoff and records the delivery status of every message.
+The status of a finished message is kept `status_ttl` seconds, long enough for the page that
+sent it to show it, so the process-wide queue does not grow with every e-mail sent.
+"""
+import itertools
+import os
+import queue
+import smtplib
+import threading
+import time
+import traceback
+from collections import deque
+from email.message import EmailMessage
+
+SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") != "0"
+
+# Delivery statuses
+QUEUED = "queued"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+
+def build_message(to_email, subject, message, sender=None):
+    """`to_email` is one address or a list of addresses."""
+    if isinstance(to_email, str):
+        to_email = [to_email]
+    msg = EmailMessage()
+    msg['Subject'] = subject
+    msg['From'] = sender or os.environ.get("EMAIL_USER")
+    msg['To'] = ', '.join(to_email)
+    msg.set_content(message)
+    return msg
+
+
+class MailQueue:
+    """Queue of messages sent by `workers` background threads, each holding its own SMTP
+    connection. The connection is closed after `idle_timeout` seconds without messages."""
+
+    def __init__(self, server=SMTP_SERVER, port=SMTP_PORT, user=None, password=None, starttls=SMTP_STARTTLS,
+                 workers=1, max_attempts=5, backoff=1.0, idle_timeout=30.0, status_ttl=3600.0):
+        self.server = server
+        self.port = port
+        self.user = user if user is not None else os.environ.get("EMAIL_USER")
+        self.password = password if password is not None else os.environ.get("EMAIL_PASSWORD")
+        self.starttls = starttls
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+        self.status_ttl = status_ttl
+        self.connections_opened = 0
+        self._queue = queue.Queue()
+        self._statuses = {}
+        self._finished = deque()  # (time, message id) of the finished messages, oldest first
+        self._callbacks = {}  # message id -> on_done of `submit`
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        self._pending = 0
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, to_email, subject, message, on_done=None):
+        """Queue a message and return its id, to be passed to `status`. `on_done(message_id, status)`
+        is called from the worker thread once the message was sent or given up."""
+        msg = build_message(to_email, subject, message, self.user)
+        message_id = next(self._ids)
+        with self._lock:
+            self._prune()
+            self._statuses[message_id] = {"status": QUEUED, "attempts": 0, "error": None, "to": msg['To']}
+            if on_done is not None:
+                self._callbacks[message_id] = on_done
+            self._pending += 1
+        self._queue.put((message_id, msg))
+        return message_id
+
+    def status(self, message_id):
+        """Delivery status of a submitted message: its `status`, `attempts` and last `error`. None
+        once it was finished for more than `status_ttl` seconds."""
+        with self._lock:
+            status = self._statuses.get(message_id)
+            return None if status is None else dict(status)
+
+    def join(self, timeout=None):
+        """Block until every submitted message was sent or given up, return False on timeout."""
+        with self._done:
+            return self._done.wait_for(lambda: self._pending == 0, timeout)
+
+    def _update(self, message_id, **fields):
+        with self._lock:
+            self._statuses[message_id].update(fields)
+
+    def _finish(self, message_id, **fields):
+        """Record the final status of a message and call its `on_done`. The message counts as done
+        for `join` whatever the callback does."""
+        try:
+            with self._lock:
+                self._statuses[message_id].update(fields)
+                self._finished.append((time.monotonic(), message_id))
+                callback = self._callbacks.pop(message_id, None)
+                status = dict(self._statuses[message_id])
+            if callback is not None:
+                try:
+                    callback(message_id, status)  # before `join` returns
+                except Exception:
+                    traceback.print_exc()
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._done.notify_all()
+
+    def _prune(self):
+        """Forget the statuses finished more than `status_ttl` seconds ago. Called under `_lock`."""
+        deadline = time.monotonic() - self.status_ttl
+        while self._finished and self._finished[0][0] < deadline:
+            del self._statuses[self._finished.popleft()[1]]
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.server, self.port, timeout=30)
+        if self.starttls:
+            smtp.starttls()
+        if self.user and self.password:
+            smtp.login(self.user, self.password)
+        self.connections_opened += 1
+        return smtp
+
+    @staticmethod
+    def _close(smtp):
+        try:
+            smtp.quit()
+        except smtplib.SMTPException:
+            smtp.close()
+
+    def _work(self):
+        smtp = None
+        while True:
+            try:
+                message_id, msg = self._queue.get(timeout=self.idle_timeout if smtp else None)
+            except queue.Empty:
+                self._close(smtp)
+                smtp = None
+                continue
+
+            attempts = self._statuses[message_id]["attempts"]
+            self._update(message_id, status=SENDING, attempts=attempts + 1)
+            try:
+                if smtp is None:
+                    smtp = self._connect()
+                smtp.send_message(msg)
+            except Exception as e:
+                # The connection may be dead, open a new one for the next attempt
+                if smtp is not None:
+                    smtp.close()
+                    smtp = None
+                # Refused recipients, 5xx answers and errors that are not SMTP or network ones (e.g. a
+                # malformed message) fail the same way every time
+                permanent = (isinstance(e, smtplib.SMTPRecipientsRefused)
+                             or isinstance(e, smtplib.SMTPResponseException) and 500 <= e.smtp_code < 600
+                             or not isinstance(e, (smtplib.SMTPException, OSError)))
+                if permanent or attempts + 1 >= self.max_attempts:
+                    self._finish(message_id, status=FAILED, error=str(e) or repr(e))
+                else:
+                    self._update(message_id, status=QUEUED, error=str(e))
+                    delay = self.backoff * 2 ** attempts
+                    threading.Timer(delay, self._queue.put, ((message_id, msg),)).start()
+            else:
+                self._finish(message_id, status=SENT, error=None)
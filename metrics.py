@@ -0,0 +1,180 @@
+"""Instrumentation of the model calls.
+
+`record` is called by `gpt.complete` after every call, successful or not. Each record is appended
+to a rotating JSONL log and kept in a rolling window per step, from which `summary` computes the
+latency percentiles and `prometheus_text` renders the Prometheus text exposition format, served
+by `start_http_server` on `/metrics`.
+"""
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_LOG = os.getenv("METRICS_LOG", os.path.join("logs", "metrics.jsonl"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9464))  # 9100 is node_exporter's
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")  # "0.0.0.0" for a Prometheus on another machine
+WINDOW = int(os.getenv("METRICS_WINDOW", 1000))  # records per step used for the percentiles
+QUANTILES = (0.5, 0.95, 0.99)
+
+_lock = threading.Lock()
+_windows = defaultdict(lambda: deque(maxlen=WINDOW))  # step -> recent records
+_counters = defaultdict(float)  # (name, labels) -> value, monotonic since the start of the process
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def _get_logger():
+    global _logger
+    with _logger_lock:  # the first calls of the warm-up threads arrive together
+        if _logger is not None:
+            return _logger
+        logger = logging.getLogger("predication.metrics")
+        if not logger.handlers:  # not already set up by a previous import of this module
+            if os.path.dirname(METRICS_LOG):
+                os.makedirs(os.path.dirname(METRICS_LOG), exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(METRICS_LOG, maxBytes=10 * 1024 * 1024, backupCount=5,
+                                                           encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        _logger = logger
+        return _logger
+
+
+def _usage(usage, field):
+    if usage is None:
+        return 0
+    return usage.get(field, 0) if isinstance(usage, dict) else getattr(usage, field, 0) or 0
+
+
+def record(step, model, language, latency, timings, error=None):
+    """Record one model call. `timings` is the dict filled by `gpt.complete`: `ttft`, `usage`,
+    `cache_hit`, `retries`, `hedged` and `fallback`, plus the `prompt_tokens_saved` by the prompt budget when the
+    caller set it."""
+    usage = timings.get("usage")
+    entry = {
+        "time": time.time(),
+        "step": step or "other",
+        "model": model,
+        "language": language,
+        "prompt_tokens": _usage(usage, "prompt_tokens"),
+        "completion_tokens": _usage(usage, "completion_tokens"),
+        "prompt_tokens_saved": timings.get("prompt_tokens_saved", 0),
+        "latency": round(latency, 4),
+        "ttfb": round(timings.get("ttft", latency), 4),
+        "cache_hit": bool(timings.get("cache_hit")),
+        "retries": timings.get("retries", 0),
+        "hedged": bool(timings.get("hedged")),
+        "fallback": bool(timings.get("fallback")),
+        "error": type(error).__name__ if error is not None else None,
+    }
+    labels = (("step", entry["step"]), ("model", model))
+    with _lock:
+        _windows[entry["step"]].append(entry)
+        _counters[("calls_total", labels + (("status", "error" if error else "ok"),))] += 1
+        _counters[("cache_hits_total", labels)] += entry["cache_hit"]
+        _counters[("retries_total", labels)] += entry["retries"]
+        _counters[("hedged_total", labels)] += entry["hedged"]
+        _counters[("fallbacks_total", labels)] += entry["fallback"]
+        _counters[("prompt_tokens_total", labels)] += entry["prompt_tokens"]
+        _counters[("completion_tokens_total", labels)] += entry["completion_tokens"]
+        _counters[("prompt_tokens_saved_total", labels)] += entry["prompt_tokens_saved"]
+    try:
+        _get_logger().info(json.dumps(entry, ensure_ascii=False))
+    except OSError:
+        pass  # metrics must never break a generation
+    return entry
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def summary():
+    """Rolling statistics per step: number of calls, cache hits, tokens and latency percentiles of
+    the calls that reached the model."""
+    with _lock:
+        windows = {step: list(entries) for step, entries in _windows.items()}
+    rows = {}
+    for step, entries in sorted(windows.items()):
+        calls = [entry for entry in entries if not entry["cache_hit"] and not entry["error"]]
+        row = {
+            "calls": len(entries),
+            "cache_hits": sum(entry["cache_hit"] for entry in entries),
+            "errors": sum(bool(entry["error"]) for entry in entries),
+            "prompt_tokens": sum(entry["prompt_tokens"] for entry in entries),
+            "completion_tokens": sum(entry["completion_tokens"] for entry in entries),
+            "prompt_tokens_saved": sum(entry["prompt_tokens_saved"] for entry in entries),
+        }
+        for q in QUANTILES:
+            row[f"latency_p{int(q * 100)}"] = _percentile([entry["latency"] for entry in calls], q)
+            row[f"ttfb_p{int(q * 100)}"] = _percentile([entry["ttfb"] for entry in calls], q)
+        rows[step] = row
+    return rows
+
+
+def _labels(labels):
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in labels)
+    return ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped))
+
+
+def prometheus_text():
+    """All the metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+    for name in sorted({name for (name, _), _ in counters}):
+        lines.append(f"# TYPE predication_{name} counter")
+        for (counter, labels), value in counters:
+            if counter == name:
+                lines.append(f"predication_{name}{{{_labels(labels)}}} {value:g}")
+    for name in ("latency", "ttfb"):
+        lines.append(f"# TYPE predication_{name}_seconds summary")
+        for step, row in summary().items():
+            for q in QUANTILES:
+                labels = _labels((("step", step), ("quantile", q)))
+                lines.append(f'predication_{name}_seconds{{{labels}}} {row[f"{name}_p{int(q * 100)}"]:g}')
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port=METRICS_PORT, host=METRICS_HOST):
+    """Serve `/metrics` from a daemon thread and return the server, on the local interface only
+    unless `host` says otherwise."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def records():
+    """The records of the rolling windows, oldest first within each step."""
+    with _lock:
+        return [entry for entries in _windows.values() for entry in entries]
+
+
+def reset():
+    """Forget the rolling windows and counters, e.g. between benchmark runs."""
+    with _lock:
+        _windows.clear()
+        _counters.clear()
@@ -0,0 +1,86 @@
+"""The Step 3 predication as a document of sections, and its revisions.
+
+A structured predication is a `{section: text}` dict in the order of `prompts.predication_sections`:
+introduction, readings, one section per inspiration, application, conclusion. Any section can be
+rewritten on its own (see `prompt_budget.assemble_section_prompt`), so a revision costs one
+paragraph instead of the whole homily.
+
+The history is a list of revisions, oldest first. A revision does not copy the document: it only
+holds the previous text of the sections it changed (None for a section it added) and, when the
+sections themselves changed, their previous order. `undo` applies the last one backwards.
+"""
+import time
+
+import gpt
+from prompts import INSPIRATION_SOURCES, inspiration_field
+
+HISTORY_MAX = 30  # revisions kept per predication
+
+SECTION_TITLES = {
+    "introduction": "Introduction",
+    "readings": "Readings",
+    "application": "Application",
+    "conclusion": "Conclusion",
+    **{inspiration_field(source): source for source in INSPIRATION_SOURCES},
+}
+
+
+def truncated(completion):
+    """Whether the structured answer `completion` was cut before its end, e.g. at `max_tokens`: it
+    then stays the JSON text, not decoded."""
+    return isinstance(completion, str) and completion.lstrip().startswith("{")
+
+
+def from_completion(completion, sections):
+    """The document of the structured Step 3 answer `completion`, with the `sections` it was asked
+    for in their order. The sections of a `truncated` answer are recovered up to the cut, the
+    missing ones left empty. A free-text answer ends up in the first section."""
+    if truncated(completion):
+        completion = dict(gpt.partial_fields(completion))
+    elif not isinstance(completion, dict):
+        completion = {sections[0]: str(completion)}
+    return {section: (completion.get(section) or "").strip() for section in sections}
+
+
+def text(document):
+    """The homily as one text, a blank line between the sections."""
+    return "\n\n".join(section for section in document.values() if section)
+
+
+def title(section):
+    return SECTION_TITLES.get(section, section.replace("_", " ").capitalize())
+
+
+def revise(document, history, changes, order=None):
+    """Return the document with the `{section: text}` `changes` applied and append their revision
+    to `history`. `order` replaces the list of sections (e.g. a whole new predication), the sections
+    left out of it are removed."""
+    order = list(document) if order is None else list(order)
+    revised = {section: changes.get(section, document.get(section, "")) for section in order}
+    previous = {section: document.get(section) for section in set(document) | set(revised)
+                if document.get(section) != revised.get(section)}
+    if not previous and order == list(document):
+        return document
+    revision = {"time": time.time(), "changes": previous}
+    if order != list(document):
+        revision["order"] = list(document)
+    history.append(revision)
+    del history[:-HISTORY_MAX]
+    return revised
+
+
+def undo(document, history):
+    """Return the document before the last revision of `history`, which is removed from it."""
+    if not history:
+        return document
+    revision = history.pop()
+    order = revision.get("order", list(document))
+    restored = {**document, **revision["changes"]}
+    return {section: restored[section] for section in order if restored.get(section) is not None}
+
+
+def describe(revision):
+    """Short label of a revision, e.g. "Conclusion" or "whole predication"."""
+    if "order" in revision or len(revision["changes"]) > 2:
+        return "whole predication"
+    return ", ".join(title(section) for section in revision["changes"])
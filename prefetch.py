@@ -0,0 +1,136 @@
+"""Speculative Step 2: inspirations generated while the user is still reading the key messages.
+
+Users spend a while reading the key messages of Step 1 before choosing one, then wait again for
+Step 2. When `PREFETCH_INSPIRATIONS=1`, `Prefetcher.start` asks for the inspirations of the first
+`PREFETCH_CANDIDATES` key messages right after they are displayed, one combined structured
+request each limited to the first `PREFETCH_SOURCES` sources, so the answer is often ready, or
+on its way, when the user clicks.
+
+`claim` is called with the chosen key message: the prefetches of the other messages that did not
+start yet are cancelled, the ones already sent are left to finish and their tokens counted as
+wasted. Every prefetch goes through the OpenAI scheduler in a single fair queue ("prefetch"),
+so together they never get more than the share of one interactive session. `stats` reports the
+hit rate and the wasted tokens, to weigh the latency gain against its cost.
+"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import gpt
+import retrieval
+from prompts import INSPIRATION_SOURCES, combined_inspirations_prompt, inspirations_schema, split_inspirations
+
+PREFETCH_INSPIRATIONS = os.getenv("PREFETCH_INSPIRATIONS", "0") != "0"
+PREFETCH_CANDIDATES = int(os.getenv("PREFETCH_CANDIDATES", 2))  # key messages, from the top of the list
+PREFETCH_SOURCES = int(os.getenv("PREFETCH_SOURCES", len(INSPIRATION_SOURCES)))  # per key message
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", 4))
+PREFETCH_MAX_SESSIONS = 500  # unclaimed batches kept, the oldest ones are given up
+
+
+class _Job:
+    def __init__(self, key_message):
+        self.key_message = key_message
+        self.future = None
+        self.tokens = 0  # billed by the request, known once it finished
+
+
+class Prefetcher:
+    """See the module docstring. Safe to share between the threads of the Streamlit server."""
+
+    def __init__(self, client, cache=None, candidates=PREFETCH_CANDIDATES, sources=PREFETCH_SOURCES,
+                 workers=PREFETCH_WORKERS, max_sessions=PREFETCH_MAX_SESSIONS):
+        self.client = client
+        self.cache = cache
+        self.candidates = candidates
+        self.sources = list(INSPIRATION_SOURCES)[:sources]
+        self.max_sessions = max_sessions
+        self.started = 0  # prefetch requests submitted
+        self.cancelled = 0  # submitted but given up before being sent
+        self.hits = 0  # choices of a prefetched key message
+        self.misses = 0  # choices of a key message beyond the candidates
+        self.used_tokens = 0
+        self.wasted_tokens = 0
+        self._batches = OrderedDict()  # session -> {key message: _Job}, oldest first
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+
+    def start(self, session, theme, key_messages, language, regenerate=False):
+        """Prefetch the inspirations of the first key messages displayed to `session`, giving up
+        whatever was still prefetched for its previous key messages."""
+        jobs = {}
+        for key_message in key_messages[:self.candidates]:
+            job = jobs[key_message] = _Job(key_message)
+            job.future = self._executor.submit(self._generate, job, theme, language, regenerate)
+        with self._lock:
+            self.started += len(jobs)
+            previous = self._batches.pop(session, None)
+            self._batches[session] = jobs
+            evicted = [self._batches.popitem(last=False)[1] for _ in range(len(self._batches) - self.max_sessions)]
+        for batch in [previous or {}] + evicted:
+            self._settle(batch, None)
+
+    def claim(self, session, key_message):
+        """The future of the inspirations prefetched for `key_message`, None when there are none.
+        Its result is `{source: text}`, or None when the request failed."""
+        with self._lock:
+            batch = self._batches.pop(session, None)
+            if batch is None:
+                return None
+            if key_message in batch:
+                self.hits += 1
+            else:
+                self.misses += 1
+        self._settle(batch, key_message)
+        job = batch.get(key_message)
+        return None if job is None else job.future
+
+    def _generate(self, job, theme, language, regenerate):
+        timings = {}
+        try:
+            references = retrieval.get_retriever().ground(theme, job.key_message, language)
+            completion = gpt.complete(
+                self.client, combined_inspirations_prompt(theme, job.key_message, language, self.sources, references),
+                language, inspirations_schema(self.sources), cache=self.cache, regenerate=regenerate, timings=timings,
+                session="prefetch", step="inspiration:prefetch",
+            )
+            return split_inspirations(completion, self.sources)
+        except Exception:
+            return None  # the user can still generate the inspirations from Step 2
+        finally:
+            usage = timings.get("usage")
+            job.tokens = usage.total_tokens if usage is not None else 0
+
+    def _settle(self, batch, chosen):
+        """Cancel the unsent prefetches of `batch` other than `chosen` and count the tokens of all."""
+        for key_message, job in batch.items():
+            if key_message != chosen:
+                job.future.cancel()
+            job.future.add_done_callback(lambda future, job=job, used=key_message == chosen: self._account(job, used))
+
+    def _account(self, job, used):
+        with self._lock:
+            if job.future.cancelled():
+                self.cancelled += 1
+            elif used:
+                self.used_tokens += job.tokens
+            else:
+                self.wasted_tokens += job.tokens
+
+    def shutdown(self, wait=True):
+        """Stop accepting prefetches, after the running ones finished when `wait` is set."""
+        self._executor.shutdown(wait=wait)
+
+    def stats(self):
+        with self._lock:
+            claims = self.hits + self.misses
+            return {
+                "started": self.started,
+                "cancelled": self.cancelled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / claims if claims else 0.0,
+                "used_tokens": self.used_tokens,
+                "wasted_tokens": self.wasted_tokens,
+                "pending_sessions": len(self._batches),
+            }
@@ -0,0 +1,177 @@
+"""Token budgets of the prompts sent to OpenAI.
+
+The Step 3 prompt embeds every inspiration chosen by the user, so its size grows with each source
+added. `assemble_predication_prompt` counts its tokens, serializes the inspirations compactly and,
+when the input budget of the step is exceeded, shortens the least important inspirations first.
+It also returns the `max_tokens` matching the requested homily length and how many tokens were
+saved compared to the pretty-printed JSON prompt. `assemble_section_prompt` builds the prompt
+rewriting a single section of the homily, which only holds the sections around it.
+
+Tokens are counted with `tiktoken` (exact for the OpenAI models). Without it, or when its encoding
+file cannot be downloaded, they are estimated at `CHARS_PER_TOKEN` characters per token, on the
+high side for French and Spanish so that a prompt estimated to fit its budget does fit.
+"""
+import json
+import os
+import re
+
+from prompts import INSPIRATION_SOURCES, inspiration_field, predication_prompt, predication_sections, section_prompt
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Input tokens allowed per step whose prompt holds user or generated text of any length
+PROMPT_BUDGETS = {
+    "key_messages": int(os.getenv("PROMPT_BUDGET_KEY_MESSAGES", 1000)),  # custom input
+    "predication": int(os.getenv("PROMPT_BUDGET_PREDICATION", 1500)),
+}
+WORDS_PER_MINUTE = 130  # speaking rate of a homily
+TOKENS_PER_WORD = 1.6  # French and Spanish take more tokens per word than English
+MIN_INSPIRATION_TOKENS = 40  # an inspiration is dropped rather than cut below this
+CHARS_PER_TOKEN = 3  # estimate without tiktoken, the OpenAI encodings average about 4 in French
+
+_encodings = {}
+
+
+def _encoding(model):
+    """The tiktoken encoding of `model`, None without tiktoken or when the encoding file, downloaded
+    on first use, cannot be loaded."""
+    if tiktoken is None:
+        return None
+    if model not in _encodings:
+        try:
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encodings[model] = None
+    return _encodings[model]
+
+
+def count_tokens(text, model="gpt-4o-mini"):
+    encoding = _encoding(model)
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text))
+
+
+def compact(text):
+    """`text` without the layout that costs tokens but tells GPT nothing: repeated whitespace and
+    Markdown emphasis and heading marks."""
+    text = re.sub(r"[*_]{2,}|^#+\s*", "", text, flags=re.MULTILINE)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def truncate(text, max_tokens, model="gpt-4o-mini"):
+    """`text` cut to at most `max_tokens` tokens, at the end of a sentence when one ends in the
+    second half of the kept text."""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    encoding = _encoding(model)
+    if encoding is None:
+        cut = text[:max(0, max_tokens - 1) * CHARS_PER_TOKEN]
+    else:
+        cut = encoding.decode(encoding.encode(text)[:max(0, max_tokens - 1)])
+    end = max(cut.rfind(". "), cut.rfind("! "), cut.rfind("? "))
+    if end >= len(cut) // 2:
+        return cut[:end + 1]
+    return cut.rsplit(" ", 1)[0] + " …"
+
+
+def fit_prompt(prompt, step, model="gpt-4o-mini"):
+    """`prompt` truncated to the input budget of `step`."""
+    return truncate(prompt, PROMPT_BUDGETS[step], model)
+
+
+def max_completion_tokens(minutes):
+    """`max_tokens` of a homily of `minutes` minutes, with a margin so it is not cut short."""
+    return int(minutes * WORDS_PER_MINUTE * TOKENS_PER_WORD * 1.25)
+
+
+def fit_inspirations(inspirations, budget, priority=None, model="gpt-4o-mini"):
+    """Return `(inspirations, truncated, dropped)`: the compacted `{source: text}` fitting in
+    `budget` tokens, and the sources that were shortened or left out. Sources late in `priority`
+    (the order of `INSPIRATION_SOURCES` by default) are shortened first, then dropped when
+    every one is down to `MIN_INSPIRATION_TOKENS`; the first one is always kept."""
+    priority = list(priority or INSPIRATION_SOURCES)
+    texts = {
+        source: compact(text if isinstance(text, str) else json.dumps(text, ensure_ascii=False))
+        for source, text in inspirations.items()
+    }
+    order = sorted(texts, key=lambda source: priority.index(source) if source in priority else len(priority))
+    sizes = {source: count_tokens(texts[source], model) for source in order}
+    truncated, dropped = [], []
+
+    for source in reversed(order):
+        excess = sum(sizes.values()) - budget
+        if excess <= 0:
+            break
+        if sizes[source] > MIN_INSPIRATION_TOKENS:
+            texts[source] = truncate(texts[source], max(MIN_INSPIRATION_TOKENS, sizes[source] - excess), model)
+            sizes[source] = count_tokens(texts[source], model)
+            truncated.append(source)
+    for source in reversed(order[1:]):
+        if sum(sizes.values()) <= budget:
+            break
+        del texts[source], sizes[source]
+        dropped.append(source)
+        if source in truncated:
+            truncated.remove(source)
+
+    return {source: texts[source] for source in order if source in texts}, truncated, dropped
+
+
+def assemble_predication_prompt(profile, language, theme, inspirations, minutes=8, budget=None, priority=None,
+                                model="gpt-4o-mini", structured=False):
+    """Return `(prompt, report)` for Step 3. `report` holds the `max_tokens` of the answer, the
+    `tokens` of the prompt, the tokens `saved` compared to the pretty-printed JSON prompt and the
+    `truncated` and `dropped` sources. With `structured`, the prompt asks for the homily in
+    sections and `report["sections"]` lists them (see `prompts.predication_schema`)."""
+    budget = PROMPT_BUDGETS["predication"] if budget is None else budget
+    # The fixed part has a line, and a section when structured, per inspiration: measured with the
+    # sources still kept, then again with more room for them once some were dropped
+    candidates, dropped = dict(inspirations), []
+    while True:
+        fixed = count_tokens(predication_prompt(profile, language, theme, dict.fromkeys(candidates, ""), minutes,
+                                                structured), model)
+        kept, truncated, left_out = fit_inspirations(candidates, max(0, budget - fixed), priority, model)
+        if not left_out:
+            break
+        dropped += left_out
+        candidates = {source: inspirations[source] for source in kept}
+    prompt = predication_prompt(profile, language, theme, kept, minutes, structured)
+
+    verbose = predication_prompt(profile, language, theme, {}, minutes, structured) + json.dumps(inspirations, indent=4)
+    tokens = count_tokens(prompt, model)
+    report = {
+        "max_tokens": max_completion_tokens(minutes),
+        "tokens": tokens,
+        "saved": max(0, count_tokens(verbose, model) - tokens),
+        "truncated": truncated,
+        "dropped": dropped,
+    }
+    if structured:
+        report["sections"] = predication_sections(kept)
+    return prompt, report
+
+
+def assemble_section_prompt(profile, language, theme, section, sections, inspirations, minutes=8, model="gpt-4o-mini"):
+    """Return `(prompt, report)` rewriting `section` of the `{section: text}` predication. Only the
+    sections next to it, and the inspiration it develops, are sent; `report` holds the `max_tokens`
+    of a section as long as the current one and the `tokens` of the prompt."""
+    keys = list(sections)
+    index = keys.index(section)
+    before = compact(sections[keys[index - 1]]) if index > 0 else None
+    after = compact(sections[keys[index + 1]]) if index + 1 < len(keys) else None
+    inspiration = next((compact(text) for source, text in inspirations.items()
+                        if inspiration_field(source) == section and isinstance(text, str)), None)
+    words = max(60, len(sections[section].split()))
+    prompt = section_prompt(profile, language, theme, section, before, after, inspiration, words, minutes)
+    report = {
+        "max_tokens": int(words * TOKENS_PER_WORD * 1.25),
+        "tokens": count_tokens(prompt, model),
+    }
+    return prompt, report
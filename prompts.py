@@ -0,0 +1,193 @@
+"""Prompts and output schemas shared by the Streamlit app and the batch generator."""
+import json
+from functools import lru_cache
+
+from pydantic import BaseModel, create_model
+
+from liturgical_calendar import liturgical_day, readings
+
+LANGUAGES = ["French", "English", "Spanish"]
+THEMES = ["Mariage", "Enterrement", "Première Communion", "Confirmation", "Pâques", "Toussaint", "Noël"]
+PROFILES = ["Prêtre catholique", "Pasteur protestant", "Pasteur évangélique", "Père ou mère de famille"]
+
+SYSTEM_PROMPTS = {
+    "English": "You are an assistant that helps preachers find inspiration. Please ALWAYS reply in ENGLISH. Only produce the requested text and avoid openers like 'Certainly! Here’s what you asked {sermon}'. Instead, just output what the sermon is.",
+    "French": "Vous aidez les prédicateurs à trouver l'inspiration. Répondez TOUJOURS en FRANÇAIS. Donnez uniquement le sermon demandé et évitez les introductions comme 'Voici ce que vous avez demandé {sermon}'. Juste le sermon demandé.",
+    "Spanish": "Ayudas a los predicadores a encontrar inspiración. Responde SIEMPRE en ESPAÑOL. Solo da el texto solicitado y evita introducciones como 'Aquí tienes lo que pediste {sermón}'. Solo el sermón pedido."
+}
+
+### Step 1: Key messages ###
+READINGS_TOPIC_PROMPT = "Lectures de la messe du {day} ({celebration}, année {cycle}) : {readings}. Proposer 5 messages clés qui pourraient être le message central de l'homélie de ce jour."
+# Days missing from the lectionary index: GPT identifies the readings, from the exact liturgical day
+LITURGICAL_DAY_TOPIC_PROMPT = "Identifier l'évangile de la messe du {day} ({celebration}, année {cycle}), les lectures de l'ancien testament et du nouveau testament, du psaume. Proposer 5 messages clés qui pourraient être le message central de l'homélie de ce jour."
+READING_LABELS = {"first_reading": "1re lecture", "psalm": "psaume", "second_reading": "2e lecture", "gospel": "évangile"}
+THEME_TOPIC_PROMPT = "Proposer 5 messages clés qui pourraient être le message central d'une homélie sur le thème {theme}."
+
+# Schemas for GPT JSON structure output
+class KeyMessagesSchema(BaseModel):
+    """Use this class for JSON structured output as {"key_messages": [msg1, msg2...]}"""
+    key_messages: list[str]
+
+def topic_prompt(theme=None, day=None):
+    """Step 1 prompt: the readings of `day` (today when None) if no theme is given, else the theme.
+    The readings are taken from the lectionary index when the day is in it."""
+    if theme:
+        return THEME_TOPIC_PROMPT.format(theme=theme)
+    liturgical = liturgical_day(day)
+    fields = {"day": liturgical["date"].strftime("%d/%m/%Y"), "celebration": liturgical["name"], "cycle": liturgical["cycle"]}
+    references = readings(day)
+    if references is None:
+        return LITURGICAL_DAY_TOPIC_PROMPT.format(**fields)
+    text = " ; ".join(f"{READING_LABELS[field]} {reference}" for field, reference in references.items() if reference)
+    return READINGS_TOPIC_PROMPT.format(readings=text, **fields)
+
+### Step 2: Inspirations ###
+INSPIRATION_SOURCES = {
+    "Joke": "Tu es un pasteur évangélique médiatique, propose 3 mots d'esprit ou blagues sur le thème {theme} en {language}. Tu devrais prendre en compte le message clé suivant pour la prédication : {key_message}.",
+    "Semantic Explanation": "Une explication sémantique pour un mot complexe utilisé dans les textes du jour en {language}. Tu devrais prendre en compte le message clé suivant pour la prédication : {key_message}.",
+    "Dogma Reference": "Une ouverture sur une référence des textes officiels de la doctrine, catéchisme, pères de l'église en {language}. Tu devrais prendre en compte le message clé suivant pour la prédication : {key_message}.",
+    "Current Event": "Un évènement actuel pertinent pour les chrétiens auquel on pourrait faire référence en lien avec {topic} en {language}. Tu devrais prendre en compte le message clé suivant pour la prédication : {key_message}.",
+    "Metaphor": "Une métaphore créative pour expliquer {topic} en {language}. Tu devrais prendre en compte le message clé suivant pour la prédication : {key_message}.",
+    "Everyday Life Situation": "Une situation de la vie quotidienne où ce message clé sera particulièrement pertinent en {language}. Tu devrais prendre en compte le message clé suivant pour la prédication : {key_message}."
+}
+
+# Passages of the local corpus (see `retrieval.py`) the source should quote instead of recalling them
+REFERENCES_PROMPT = " Appuie-toi sur les passages suivants, en citant leur référence exacte, plutôt que sur ta mémoire :"
+
+def references_prompt(passages):
+    """Suffix quoting the retrieved `passages` in a prompt, empty when there is none."""
+    if not passages:
+        return ""
+    return REFERENCES_PROMPT + "".join(f"\n- [{passage['reference']}] {passage['text']}" for passage in passages)
+
+def inspiration_prompts(theme, key_message, language, sources=None, references=None):
+    """Step 2 prompts as `{source: prompt}` for the given `sources` (all of them when None),
+    grounded in the `{source: passages}` `references`."""
+    references = references or {}
+    return {
+        source: INSPIRATION_SOURCES[source].format(
+            theme=theme,
+            topic=key_message,
+            language=language,
+            key_message=key_message,
+        ) + references_prompt(references.get(source))
+        for source in (sources or INSPIRATION_SOURCES)
+    }
+
+# All the sources in one request: the context is written once, then what each field should hold
+COMBINED_INSPIRATIONS_PROMPT = "Pour une prédication sur le thème {theme} en {language}, dont le message clé est : {key_message}. Propose, en {language} :"
+INSPIRATION_INSTRUCTIONS = {
+    "Joke": "3 mots d'esprit ou blagues, dans le style d'un pasteur évangélique médiatique.",
+    "Semantic Explanation": "Une explication sémantique pour un mot complexe utilisé dans les textes du jour.",
+    "Dogma Reference": "Une ouverture sur une référence des textes officiels de la doctrine, catéchisme, pères de l'église.",
+    "Current Event": "Un évènement actuel pertinent pour les chrétiens auquel on pourrait faire référence en lien avec le message clé.",
+    "Metaphor": "Une métaphore créative pour expliquer le message clé.",
+    "Everyday Life Situation": "Une situation de la vie quotidienne où ce message clé sera particulièrement pertinent."
+}
+
+class InspirationsSchema(BaseModel):
+    """Use this class for JSON structured output with every inspiration source in one answer"""
+    joke: str
+    semantic_explanation: str
+    dogma_reference: str
+    current_event: str
+    metaphor: str
+    everyday_life_situation: str
+
+def inspiration_field(source):
+    """Name of the `InspirationsSchema` field of `source`, e.g. "current_event"."""
+    return source.lower().replace(" ", "_")
+
+@lru_cache(maxsize=None)
+def _inspirations_schema(sources):
+    if set(sources) == set(INSPIRATION_SOURCES):
+        return InspirationsSchema
+    return create_model("InspirationsSchema", **{inspiration_field(source): (str, ...) for source in sources})
+
+def inspirations_schema(sources=None):
+    """Pydantic schema with one field per source of `sources` (all of them when None)."""
+    return _inspirations_schema(tuple(sources or INSPIRATION_SOURCES))
+
+def combined_inspirations_prompt(theme, key_message, language, sources=None, references=None):
+    """Step 2 prompt asking for every source of `sources` (all when None) in a single request,
+    to be sent with `inspirations_schema(sources)`. The passages of `references` are quoted once
+    when several sources share them."""
+    references = references or {}
+    quoted = {}
+    for source in (sources or INSPIRATION_SOURCES):
+        if references.get(source):
+            quoted.setdefault(references_prompt(references[source]), []).append(inspiration_field(source))
+    return COMBINED_INSPIRATIONS_PROMPT.format(theme=theme, key_message=key_message, language=language) + "".join(
+        f"\n- {inspiration_field(source)}: {INSPIRATION_INSTRUCTIONS[source]}" for source in (sources or INSPIRATION_SOURCES)
+    ) + "".join(f"\nPour {', '.join(fields)} :{passages}" for passages, fields in quoted.items())
+
+def split_inspirations(completion, sources=None):
+    """`{source: text}` from the answer to `combined_inspirations_prompt`."""
+    return {source: completion[inspiration_field(source)] for source in (sources or INSPIRATION_SOURCES)}
+
+### Step 3: Predication ###
+# Sections of a structured predication, in this order with one section per inspiration between
+# the readings and the application
+PREDICATION_SECTIONS = {
+    "introduction": "L'introduction, qui capte l'attention de l'assemblée.",
+    "readings": "La présentation des lectures du jour et de leur message.",
+    "application": "L'application concrète du message clé dans la vie de l'assemblée.",
+    "conclusion": "La conclusion et l'envoi.",
+}
+INSPIRATION_SECTION = "Le passage qui développe l'inspiration « {source} »."
+SECTION_PROMPT = "Réécris uniquement la section « {section} » d'une homélie de {minutes} minutes pour {profile} en {language} qui communique sur {theme} : {instruction} Environ {words} mots, en {language}, qui s'enchaînent avec les sections voisines. Réponds par le texte de la section seul."
+
+def predication_sections(sources):
+    """Keys of the sections of a predication built on the inspirations of `sources`, in order."""
+    return ["introduction", "readings", *(inspiration_field(source) for source in sources), "application", "conclusion"]
+
+def section_instruction(section):
+    """What the section `section` of a predication holds."""
+    if section in PREDICATION_SECTIONS:
+        return PREDICATION_SECTIONS[section]
+    source = next((source for source in INSPIRATION_SOURCES if inspiration_field(source) == section), section)
+    return INSPIRATION_SECTION.format(source=source)
+
+@lru_cache(maxsize=None)
+def _predication_schema(sections):
+    return create_model("PredicationSchema", **{section: (str, ...) for section in sections})
+
+def predication_schema(sections):
+    """Pydantic schema with one text field per section of `sections`, in order."""
+    return _predication_schema(tuple(sections))
+
+def predication_prompt(profile, language, theme, inspirations, minutes=8, structured=False):
+    """Step 3 prompt asking for the homily built on the `{source: text}` inspirations, one per line.
+    `structured` asks for it in the sections of `predication_sections`, to be sent with
+    `predication_schema`."""
+    prompt = (
+        f"Rédige une homélie de {minutes} minutes pour {profile} en {language} qui communique sur {theme} et qui inclut comme inspiration:"
+        + "".join(f"\n- {source}: {text}" for source, text in inspirations.items())
+    )
+    if structured:
+        prompt += "\nRédige-la en sections, dans cet ordre :" + "".join(
+            f"\n- {section}: {section_instruction(section)}" for section in predication_sections(inspirations)
+        )
+    return prompt
+
+def section_prompt(profile, language, theme, section, before, after, inspiration=None, words=150, minutes=8):
+    """Prompt rewriting the section `section` of a structured predication from the texts of the
+    sections `before` and `after` it (None at the ends) and, for an inspiration section, the
+    `inspiration` it develops."""
+    prompt = SECTION_PROMPT.format(section=section, minutes=minutes, profile=profile, language=language, theme=theme,
+                                   instruction=section_instruction(section), words=words)
+    if inspiration:
+        prompt += f"\nInspiration : {inspiration}"
+    if before:
+        prompt += f"\nSection précédente : {before}"
+    if after:
+        prompt += f"\nSection suivante : {after}"
+    return prompt
+
+### Translation ###
+TRANSLATION_PROMPT = "Traduis de {source} en {target} les sections de cette homélie, en gardant le ton oral, la longueur et les références bibliques (citées dans leur traduction liturgique en {target}) :\n{sections}"
+
+def translation_prompt(source, target, sections):
+    """Prompt translating the `{section: text}` of a predication from the language `source` to
+    `target`, to be sent with `predication_schema(sections)`."""
+    return TRANSLATION_PROMPT.format(source=source, target=target, sections=json.dumps(sections, ensure_ascii=False))
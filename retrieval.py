@@ -0,0 +1,341 @@
+"""Local full-text search over doctrinal texts and scripture, to ground the inspirations.
+
+Asked for a reference to the catechism or an explanation of a word of the readings, GPT recalls
+passages from memory: long, slow and sometimes invented. `Retriever.ground` finds the passages of
+the local corpus closest to the key message with BM25, and the "Dogma Reference" and "Semantic
+Explanation" prompts quote them (see `prompts.inspiration_prompts`): the model only comments on
+short exact texts whose references can be checked. A passage is only quoted when it covers
+`RETRIEVAL_MIN_COVERAGE` of the query, its terms weighted by their rarity: a passage sharing one
+word with the key message ("joie" in "La joie de servir les autres") is left out.
+
+The corpus is made of the TSV files of `data/corpus/` (`reference`, `language`, `source`, `text`
+per line, `#` for comments). The sample shipped with the app holds a few public-domain
+passages, so grounding is off by default (`RETRIEVAL_TOP_K=0`); add the full texts (public-domain
+Bibles, licensed catechism...) in the same format, build the index and set `RETRIEVAL_TOP_K`:
+
+    python retrieval.py build
+    python retrieval.py search "Dieu est amour" --language French
+
+The index has one directory per language. Words are lowercased, stripped of accents and stop
+words, and reduced to a stem by a light stemmer of the language. The terms are identified by a
+64-bit hash so the vocabulary is a sorted array; every array is a `.npy` file opened memory-mapped,
+so loading the index costs no parsing whatever its size.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+import numpy as np
+
+RETRIEVAL_CORPUS_PATH = os.getenv("RETRIEVAL_CORPUS_PATH",
+                                  os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "corpus"))
+RETRIEVAL_INDEX_PATH = os.getenv("RETRIEVAL_INDEX_PATH", os.path.join(".cache", "retrieval"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", 0))  # passages quoted per prompt, 0 turns grounding off
+RETRIEVAL_MIN_COVERAGE = float(os.getenv("RETRIEVAL_MIN_COVERAGE", 0.5))  # of the query weight, see `Index.search`
+RETRIEVAL_SOURCES = ["Dogma Reference", "Semantic Explanation"]  # inspiration sources given the passages
+K1 = 1.2
+B = 0.75
+
+STOP_WORDS = {
+    "French": set("""
+        a afin ai au aux avec c ce ces cet cette d dans de des du elle en est et il ils je l la le les leur lui
+        m ma mais me mes moi mon n ne nous on ou par pas pour qu que qui s sa se ses si son sur t ta te tes
+        toi ton tu un une vos votre vous y
+    """.split()),
+    "English": set("""
+        a an and are as at be but by for from has have he her his i in is it its me my not of on or our she
+        so that the their them they this to was we were which who will with you your
+    """.split()),
+    "Spanish": set("""
+        a al como con de del el ella en es esta este la las le les lo los me mi no nos o para pero por que
+        se su sus te tu un una y ya yo
+    """.split()),
+}
+
+# Light stemmers: the longest matching suffix is removed (or replaced) when at least 3 letters remain
+SUFFIXES = {
+    "French": [("issements", ""), ("issement", ""), ("ements", ""), ("ement", ""), ("ations", ""), ("ation", ""),
+               ("ances", ""), ("ance", ""), ("ences", ""), ("ence", ""), ("ites", ""), ("ite", ""), ("euses", ""),
+               ("euse", ""), ("eux", ""), ("ives", ""), ("ive", ""), ("ifs", ""), ("if", ""), ("aux", "al"),
+               ("ees", ""), ("ee", ""), ("es", ""), ("er", ""), ("ez", ""), ("e", ""), ("s", ""), ("x", "")],
+    "English": [("fulness", ""), ("ousness", ""), ("ations", "ate"), ("ation", "ate"), ("nesses", ""),
+                ("ness", ""), ("ments", ""), ("ment", ""), ("ities", ""), ("ity", ""), ("ingly", ""), ("ing", ""),
+                ("edly", ""), ("eth", ""), ("ed", ""), ("ies", "y"), ("ly", ""), ("es", ""), ("s", ""), ("e", "")],
+    "Spanish": [("amientos", ""), ("amiento", ""), ("imientos", ""), ("imiento", ""), ("aciones", ""),
+                ("acion", ""), ("uciones", "u"), ("ucion", "u"), ("idades", ""), ("idad", ""), ("mente", ""),
+                ("istas", ""), ("ista", ""), ("osos", ""), ("oso", ""), ("osas", ""), ("osa", ""), ("es", ""),
+                ("os", ""), ("as", ""), ("a", ""), ("o", ""), ("e", ""), ("s", "")],
+}
+
+
+@lru_cache(maxsize=100000)
+def stem(word, language):
+    for suffix, replacement in SUFFIXES.get(language, ()):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)] + replacement
+    return word
+
+
+def tokenize(text, language):
+    """Stems of the words of `text` that are not stop words of `language`."""
+    text = text.lower()
+    if not text.isascii():
+        text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    stop_words = STOP_WORDS.get(language, ())
+    return [stem(word, language) for word in re.findall(r"\w+", text) if word not in stop_words and len(word) > 1]
+
+
+def term_id(term):
+    """64-bit id of a term, stable across processes."""
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def read_corpus(path=RETRIEVAL_CORPUS_PATH):
+    """`{language: [passage, ...]}` of the TSV files of `path`, a passage being a dict with its
+    `reference`, `source` and `text`."""
+    corpus = defaultdict(list)
+    for filename in sorted(glob.glob(os.path.join(path, "*.tsv"))):
+        with open(filename, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip() or line.startswith("#"):
+                    continue
+                reference, language, source, text = line.rstrip("\n").split("\t", 3)
+                corpus[language].append({"reference": reference, "source": source, "text": text})
+    return dict(corpus)
+
+
+def build_language(passages, language, path):
+    """Write the index of the `passages` of `language` to the directory `path`."""
+    ids = {}  # term -> term id, hashed once per distinct term
+    postings = ([], [], [])  # term ids, passages, frequencies of every (term, passage) pair
+    lengths = np.zeros(len(passages), dtype=np.float32)
+    for number, passage in enumerate(passages):
+        terms = Counter(tokenize(f"{passage['reference']} {passage['text']}", language))
+        lengths[number] = sum(terms.values())
+        for term, frequency in terms.items():
+            if term not in ids:
+                ids[term] = term_id(term)
+            postings[0].append(ids[term])
+            postings[1].append(number)
+            postings[2].append(frequency)
+
+    term_ids = np.array(postings[0], dtype=np.uint64)
+    order = np.argsort(term_ids, kind="stable")  # grouped by term, in passage order within a term
+    terms, starts = np.unique(term_ids[order], return_index=True)
+    offsets = np.append(starts, len(order)).astype(np.int64)
+    documents = np.array(postings[1], dtype=np.int32)[order]
+    frequencies = np.array(postings[2], dtype=np.float32)[order]
+
+    stored = [json.dumps(passage, ensure_ascii=False).encode("utf-8") for passage in passages]
+    passage_offsets = np.zeros(len(stored) + 1, dtype=np.int64)
+    passage_offsets[1:] = np.cumsum([len(data) for data in stored])
+
+    os.makedirs(path)
+    for name, array in (("terms", terms), ("offsets", offsets), ("documents", documents),
+                        ("frequencies", frequencies), ("lengths", lengths), ("passage_offsets", passage_offsets)):
+        np.save(os.path.join(path, f"{name}.npy"), array)
+    with open(os.path.join(path, "passages.bin"), "wb") as f:
+        f.write(b"".join(stored))
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"passages": len(passages), "average_length": float(lengths.mean()) if len(passages) else 0.0}, f)
+
+
+def build(corpus_path=RETRIEVAL_CORPUS_PATH, index_path=RETRIEVAL_INDEX_PATH):
+    """(Re)build the index of every language of the corpus, replacing the previous one at once.
+    Returns `{language: passages}`."""
+    corpus = read_corpus(corpus_path)
+    staging = f"{index_path}.building"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    for language, passages in corpus.items():
+        build_language(passages, language, os.path.join(staging, language))
+    previous = f"{index_path}.previous"
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(index_path):
+        os.replace(index_path, previous)
+    os.replace(staging, index_path)
+    shutil.rmtree(previous, ignore_errors=True)
+    _grounded.cache_clear()
+    return {language: len(passages) for language, passages in corpus.items()}
+
+
+class Index:
+    """The BM25 index of one language, memory-mapped from `path`."""
+
+    def __init__(self, path, language):
+        self.language = language
+        load = lambda name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")  # noqa: E731
+        self.terms = load("terms")
+        self.offsets = load("offsets")
+        self.documents = load("documents")
+        self.frequencies = load("frequencies")
+        self.lengths = load("lengths")
+        self.passage_offsets = load("passage_offsets")
+        self.passages = np.memmap(os.path.join(path, "passages.bin"), dtype=np.uint8, mode="r") \
+            if self.passage_offsets[-1] else np.zeros(0, dtype=np.uint8)
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.size = meta["passages"]
+        self.average_length = meta["average_length"] or 1.0
+
+    def passage(self, number):
+        return json.loads(bytes(self.passages[self.passage_offsets[number]:self.passage_offsets[number + 1]]))
+
+    def search(self, query, k=RETRIEVAL_TOP_K, min_coverage=0.0):
+        """The `k` best passages for `query`, each with its BM25 `score` and its `coverage`, best
+        first. The coverage is the part of the query terms found in the passage, each term counting
+        for its idf (a term missing from the corpus counts as the rarest): passages under
+        `min_coverage` are left out."""
+        scores = np.zeros(self.size, dtype=np.float32)
+        covered = np.zeros(self.size, dtype=np.float32)
+        weight = 0.0
+        for term, count in Counter(tokenize(query, self.language)).items():
+            ident = np.uint64(term_id(term))
+            position = int(np.searchsorted(self.terms, ident))
+            found = position < len(self.terms) and self.terms[position] == ident
+            start, end = (self.offsets[position], self.offsets[position + 1]) if found else (0, 0)
+            idf = np.log(1 + (self.size - (end - start) + 0.5) / ((end - start) + 0.5))
+            weight += count * idf
+            if not found:
+                continue
+            documents = self.documents[start:end]
+            frequencies = self.frequencies[start:end]
+            norms = K1 * (1 - B + B * self.lengths[documents] / self.average_length)
+            scores[documents] += count * idf * frequencies * (K1 + 1) / (frequencies + norms)
+            covered[documents] += count * idf
+        if not weight:
+            return []
+        coverage = covered / weight
+        scores[coverage < min_coverage] = 0
+        if k <= 0 or not scores.any():
+            return []
+        best = np.argpartition(-scores, min(k, self.size) - 1)[:k]
+        return [dict(self.passage(number), score=float(scores[number]), coverage=float(coverage[number]))
+                for number in sorted(best, key=lambda number: -scores[number]) if scores[number] > 0]
+
+
+class Retriever:
+    """The indexes of every language found in `path`, opened on first use. Safe to share between
+    the threads of the Streamlit server."""
+
+    def __init__(self, path=RETRIEVAL_INDEX_PATH, k=RETRIEVAL_TOP_K, min_coverage=RETRIEVAL_MIN_COVERAGE):
+        self.path = path
+        self.k = k
+        self.min_coverage = min_coverage
+        self.queries = 0
+        self.seconds = 0.0
+        self._indexes = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def version(self):
+        """Identity of the index currently in `path`, which changes when it is rebuilt, even by
+        another process."""
+        try:
+            info = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return info.st_ino, info.st_mtime_ns
+
+    def index(self, language):
+        """The index of `language`, None when it was not built. The indexes are opened again after
+        a rebuild."""
+        version = self.version()
+        with self._lock:
+            if version != self._version:
+                self._indexes.clear()
+                self._version = version
+            if language not in self._indexes:
+                path = os.path.join(self.path, language)
+                self._indexes[language] = Index(path, language) if os.path.exists(os.path.join(path, "meta.json")) else None
+            return self._indexes[language]
+
+    def search(self, query, language, k=None, min_coverage=None):
+        index = self.index(language)
+        if index is None:
+            return []
+        started = time.perf_counter()
+        passages = index.search(query, self.k if k is None else k,
+                                self.min_coverage if min_coverage is None else min_coverage)
+        with self._lock:
+            self.queries += 1
+            self.seconds += time.perf_counter() - started
+        return passages
+
+    def ground(self, theme, key_message, language):
+        """`{source: passages}` to quote in the prompts of `RETRIEVAL_SOURCES`, empty when no
+        passage matches or grounding is off. Cached until the index is rebuilt."""
+        if not self.k:
+            return {}
+        return _grounded(self, self.version(), theme, key_message, language)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "languages": [language for language, index in self._indexes.items() if index is not None],
+                "queries": self.queries,
+                "average_ms": 1000 * self.seconds / self.queries if self.queries else 0.0,
+            }
+
+
+@lru_cache(maxsize=1024)
+def _grounded(retriever, version, theme, key_message, language):
+    """`Retriever.ground` of the index `version`: the answers of a previous index are not reused."""
+    passages = retriever.search(f"{theme or ''} {key_message}", language)
+    return {source: passages for source in RETRIEVAL_SOURCES} if passages else {}
+
+
+_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def _retriever():
+    if RETRIEVAL_TOP_K and not os.path.exists(RETRIEVAL_INDEX_PATH) and os.path.isdir(RETRIEVAL_CORPUS_PATH):
+        build()
+    return Retriever()
+
+
+def get_retriever():
+    """The process-wide `Retriever` of `RETRIEVAL_INDEX_PATH`, the index being built from the
+    corpus the first time when it is missing and grounding is on."""
+    with _lock:
+        return _retriever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query the local index of doctrinal texts and scripture.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="index the TSV files of the corpus directory")
+    build_parser.add_argument("--corpus", default=RETRIEVAL_CORPUS_PATH)
+    build_parser.add_argument("--index", default=RETRIEVAL_INDEX_PATH)
+    search_parser = subparsers.add_parser("search", help="print the best passages for a query")
+    search_parser.add_argument("query")
+    search_parser.add_argument("--language", default="French")
+    search_parser.add_argument("-k", type=int, default=RETRIEVAL_TOP_K or 3)
+    search_parser.add_argument("--min-coverage", type=float, default=RETRIEVAL_MIN_COVERAGE)
+    search_parser.add_argument("--index", default=RETRIEVAL_INDEX_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        started = time.perf_counter()
+        counts = build(args.corpus, args.index)
+        print(f"Indexed {', '.join(f'{count} {language}' for language, count in counts.items()) or 'nothing'} "
+              f"passages in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+        return 0
+    for passage in Retriever(args.index).search(args.query, args.language, args.k, args.min_coverage):
+        print(f"{passage['score']:.2f}\t{passage['coverage']:.2f}\t{passage['reference']}\t{passage['text']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
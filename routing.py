@@ -0,0 +1,170 @@
+"""Model, answer length and deadline of the OpenAI calls of each step.
+
+Every call of `gpt.complete` follows the `Route` of its step: the key messages and the
+inspirations go to a fast and cheap model, the predication to a stronger one and its
+translations to the cheap one again. A request that receives nothing from OpenAI for `timeout`
+seconds is given up and sent once more to the `fallback` model, so a stalled call never holds
+the user indefinitely. A streamed answer receives data with every token, but a request without
+streaming receives nothing until the whole answer is written: its `timeout` must cover the
+generation of the longest answer.
+
+With `ROUTE_HEDGE=1`, a request without streaming that runs longer than the p95 latency observed
+on its route gets an identical duplicate and the first answer wins; the other one is left to
+finish and its tokens are counted in `stats` as wasted. Only the slowest 5% of the requests are
+duplicated, which is what keeps the extra cost small. `hedged` runs inside the scheduler slot of
+the request (see `gpt.complete`): the time spent queued is not counted against the p95, and only
+the HTTP request runs in the hedge threads, never the wait in the queue or its UI callbacks.
+
+Each route can be changed with `ROUTE_<NAME>_MODEL`, `ROUTE_<NAME>_FALLBACK`,
+`ROUTE_<NAME>_MAX_TOKENS` and `ROUTE_<NAME>_TIMEOUT`, NAME being the route name in upper case
+with ":" replaced by "_" (e.g. `ROUTE_PREDICATION_MODEL=gpt-4o-mini`).
+"""
+import os
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import openai
+
+ROUTE_HEDGE = os.getenv("ROUTE_HEDGE", "0") != "0"
+HEDGE_MIN_SAMPLES = 20  # requests observed on a route before its p95 is trusted
+HEDGE_QUANTILE = 0.95
+WINDOW = 200  # latencies per route used for the quantile
+
+
+class Route:
+    def __init__(self, name, model, fallback=None, max_tokens=None, timeout=60.0, hedge=ROUTE_HEDGE):
+        self.name = name
+        self.model = model
+        self.fallback = fallback  # model used when `model` times out, None for none
+        self.max_tokens = max_tokens  # default answer cap, None for the model's own
+        self.timeout = timeout  # seconds without data from OpenAI before giving up, the whole answer unless streamed
+        self.hedge = hedge
+
+
+def _configured(name, model, fallback, max_tokens, timeout):
+    """`Route` with the defaults overridden by the ROUTE_<NAME>_* environment variables."""
+    prefix = f"ROUTE_{name.upper().replace(':', '_')}_"
+    max_tokens = int(os.getenv(prefix + "MAX_TOKENS", max_tokens or 0)) or None
+    return Route(name, os.getenv(prefix + "MODEL", model), os.getenv(prefix + "FALLBACK", fallback) or None,
+                 max_tokens, float(os.getenv(prefix + "TIMEOUT", timeout)))
+
+
+ROUTES = {
+    route.name: route for route in [
+        _configured("default", "gpt-4o-mini", "gpt-4.1-mini", None, 60),
+        _configured("key_messages", "gpt-4o-mini", "gpt-4.1-mini", 500, 20),
+        _configured("inspiration", "gpt-4o-mini", "gpt-4.1-mini", 400, 20),  # one source, streamed in the app
+        _configured("inspiration:combined", "gpt-4o-mini", "gpt-4.1-mini", 1500, 45),
+        _configured("predication", "gpt-4o", "gpt-4o-mini", None, 90),  # max_tokens set from the homily length
+        _configured("translation", "gpt-4o-mini", "gpt-4.1-mini", None, 60),  # streamed, max_tokens set from the text
+    ]
+}
+ROUTES["inspiration:prefetch"] = ROUTES["inspiration:combined"]
+
+_lock = threading.Lock()
+_latencies = defaultdict(lambda: deque(maxlen=WINDOW))  # route name -> seconds of the recent requests
+_counters = defaultdict(int)
+_hedges = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+
+
+def route(step):
+    """The route of `step`: its own, else the one of the part before ":" (e.g. "inspiration" for
+    "inspiration:Joke"), else the default one."""
+    step = step or "default"
+    return ROUTES.get(step) or ROUTES.get(step.split(":")[0]) or ROUTES["default"]
+
+
+def observe(route, latency):
+    """Record the latency of a request that succeeded on `route`."""
+    with _lock:
+        _latencies[route.name].append(latency)
+
+
+def hedge_delay(route):
+    """Seconds after which a duplicate request is sent, None when the route does not hedge or has
+    not seen enough requests yet."""
+    if not route.hedge:
+        return None
+    with _lock:
+        latencies = sorted(_latencies[route.name])
+    if len(latencies) < HEDGE_MIN_SAMPLES:
+        return None
+    return latencies[int(HEDGE_QUANTILE * (len(latencies) - 1))]
+
+
+def _waste(future):
+    if future.cancelled() or future.exception() is not None:
+        return
+    usage = getattr(future.result(), "usage", None)
+    with _lock:
+        _counters["hedge_wasted_tokens"] += getattr(usage, "total_tokens", 0) or 0
+
+
+def _hedged(send, delay):
+    """`send()`, plus a second `send()` when the first one takes longer than `delay` seconds.
+    Returns `(result, hedged)` of the first one to succeed."""
+    first = _hedges.submit(send)
+    if wait([first], timeout=delay).done:
+        return first.result(), False
+    with _lock:
+        _counters["hedges"] += 1
+    pending = {first, _hedges.submit(send)}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                for loser in pending:
+                    loser.add_done_callback(_waste)
+                with _lock:
+                    _counters["hedge_wins"] += future is not first
+                return future.result(), True
+            error = future.exception()
+    raise error
+
+
+def hedged(create, route, timings):
+    """Return `create()`, duplicated when the route hedges and it runs longer than its p95;
+    `timings["hedged"]` tells whether it was. `create` runs in the hedge threads: it only sends
+    the request, without touching Streamlit."""
+    delay = hedge_delay(route)
+    if delay is None:
+        return create()
+    response, timings["hedged"] = _hedged(create, delay)
+    return response
+
+
+def call(send, route, model, timings):
+    """Return `send(model)`, or `send(route.fallback)` when the request to `model` timed out. The
+    model that answered is stored in `timings["model"]`, and `timings["fallback"]` tells whether
+    it was the fallback one."""
+    timings["model"] = model
+    try:
+        return send(model)
+    except openai.APITimeoutError:
+        if not route.fallback or route.fallback == model:
+            raise
+        with _lock:
+            _counters["fallbacks"] += 1
+        timings["model"], timings["fallback"] = route.fallback, True
+        return send(route.fallback)
+
+
+def stats():
+    delays = {name: hedge_delay(route) for name, route in ROUTES.items() if route.hedge}
+    with _lock:
+        return {
+            "hedges": _counters["hedges"],
+            "hedge_wins": _counters["hedge_wins"],
+            "hedge_wasted_tokens": _counters["hedge_wasted_tokens"],
+            "fallbacks": _counters["fallbacks"],
+            "hedge_delays": delays,
+        }
+
+
+def reset():
+    """Forget the observed latencies and counters, e.g. between benchmark runs."""
+    with _lock:
+        _latencies.clear()
+        _counters.clear()
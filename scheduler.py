@@ -0,0 +1,265 @@
+"""Process-wide scheduler for the OpenAI requests.
+
+Every request waits for its turn in a per-session fair queue: sessions are served round-robin,
+so one user generating everything at once cannot starve the others. A request only starts when
+the request and token buckets (the account's RPM/TPM limits) have capacity and fewer than
+`max_concurrency` requests are in flight. Rate-limit and transient errors are retried with
+jittered exponential backoff, honouring the `Retry-After` header sent with a 429. Timeouts are
+not retried: the caller falls back to another model instead.
+
+A streamed answer is still being generated when `create` returns at the response headers:
+`open` keeps its slot until the caller has read the stream and calls `release`.
+"""
+import itertools
+import os
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+import openai
+
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", 500))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", 200000))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", 16))
+DEFAULT_COMPLETION_TOKENS = 800  # expected answer size when the request sets no max_tokens
+
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+def estimate_tokens(messages, max_tokens=None, n=1):
+    """Rough token count of a request, about 4 characters per token plus the `n` expected answers."""
+    return sum(len(message["content"]) for message in messages) // 4 + n * (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+
+def retry_delay(error, attempt, base_delay=1.0, max_delay=60.0):
+    """Seconds to wait before retrying after `error`: the server's Retry-After when it sent one,
+    else a full-jitter exponential backoff."""
+    headers = error.response.headers if getattr(error, "response", None) is not None else {}
+    retry_after = None
+    if headers.get("retry-after-ms"):
+        retry_after = float(headers["retry-after-ms"]) / 1000
+    elif headers.get("retry-after"):
+        try:
+            retry_after = float(headers["retry-after"])
+        except ValueError:
+            retry_after = parsedate_to_datetime(headers["retry-after"]).timestamp() - time.time()
+    if retry_after is not None:
+        return min(max(retry_after, 0) + random.uniform(0, base_delay), max_delay)
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+class TokenBucket:
+    """`per_minute` units refilled continuously, up to a burst of `capacity`. Not thread-safe,
+    the scheduler only uses it under its lock."""
+
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` units are available."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+
+class _Ticket:
+    def __init__(self, session, tokens):
+        self.session = session
+        self.tokens = tokens
+
+
+class FairScheduler:
+    """See the module docstring. `call` is safe to use from any thread."""
+
+    def __init__(self, rpm=OPENAI_RPM, tpm=OPENAI_TPM, max_concurrency=OPENAI_MAX_CONCURRENCY,
+                 max_retries=6, base_delay=1.0, max_delay=60.0):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.avg_latency = 2.0  # seconds, moving average used for the wait estimates
+        self.calls = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self._cond = threading.Condition()
+        self._queues = {}  # session -> deque of waiting tickets
+        self._order = deque()  # sessions with waiting tickets, the next one to serve first
+        self._in_flight = 0
+        self._paused_until = 0.0  # set after a 429, nobody starts a request before
+
+    def call(self, fn, session="default", tokens=DEFAULT_COMPLETION_TOKENS, on_wait=None, timings=None):
+        """Return `fn()` once it is the turn of `session`, retrying it on rate-limit and transient
+        errors. `on_wait(position, eta)` is called while waiting with the number of requests ahead
+        and the estimated wait in seconds, and with `position` None before sleeping for a retry.
+        The number of retries is stored in `timings["retries"]` when given."""
+        return self._call(fn, session, tokens, on_wait, timings, keep=False)
+
+    def open(self, fn, session="default", tokens=DEFAULT_COMPLETION_TOKENS, on_wait=None, timings=None):
+        """Like `call`, but return `(fn(), release)`: the request keeps its slot until `release()`
+        is called, e.g. once a streamed answer was read. `release` may be called more than once."""
+        return self._call(fn, session, tokens, on_wait, timings, keep=True)
+
+    def _call(self, fn, session, tokens, on_wait, timings, keep):
+        for attempt in itertools.count():
+            if timings is not None:
+                timings["retries"] = attempt
+            self._acquire(session, tokens, on_wait)
+            started = time.monotonic()
+            try:
+                result = fn()
+            except RETRYABLE_ERRORS as e:
+                self._release(time.monotonic() - started)
+                if attempt >= self.max_retries or isinstance(e, openai.APITimeoutError):
+                    raise  # a timeout is handled by the fallback model of the route, see `routing`
+                delay = retry_delay(e, attempt, self.base_delay, self.max_delay)
+                if isinstance(e, openai.RateLimitError):
+                    self.rate_limited += 1
+                    with self._cond:
+                        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            except BaseException:
+                self._release(time.monotonic() - started)
+                raise
+            else:
+                if not keep:
+                    self._release(time.monotonic() - started)
+                    return result
+                return result, self._releaser(started)
+            self.retries += 1
+            if on_wait is not None:
+                on_wait(None, delay)
+            time.sleep(delay)
+
+    def _start_delay(self, ticket):
+        """None when it is not the turn of `ticket`, else the seconds before it may start."""
+        if self._order[0] != ticket.session or self._queues[ticket.session][0] is not ticket:
+            return None
+        if self._in_flight >= self.max_concurrency:
+            return None
+        return max(self._paused_until - time.monotonic(), self.requests.wait_time(1), self.tokens.wait_time(ticket.tokens))
+
+    def _position(self, ticket):
+        """Number of requests served before `ticket` in the round-robin order."""
+        index = self._queues[ticket.session].index(ticket)
+        ahead = 0
+        before = True
+        for session in self._order:
+            if session == ticket.session:
+                before = False
+                continue
+            ahead += min(len(self._queues[session]), index + (1 if before else 0))
+        return ahead + index
+
+    def _acquire(self, session, tokens, on_wait):
+        ticket = _Ticket(session, tokens)
+        last_report = time.monotonic()  # only report waits longer than a second
+        with self._cond:
+            queue = self._queues.setdefault(session, deque())
+            if not queue:
+                self._order.append(session)
+            queue.append(ticket)
+        try:
+            while True:
+                report = None
+                with self._cond:
+                    delay = self._start_delay(ticket)
+                    if delay is not None and delay <= 0:
+                        self._start(ticket)
+                        return
+                    if on_wait is not None and time.monotonic() - last_report >= 1.0:
+                        position = self._position(ticket)
+                        report = (position, (delay or 0) + position * self.avg_latency / self.max_concurrency)
+                    else:
+                        self._cond.wait(timeout=min(delay or 1.0, 1.0))
+                if report is not None:
+                    # Outside the lock: a UI callback may be slow, or raise to abandon the wait
+                    on_wait(*report)
+                    last_report = time.monotonic()
+        except BaseException:
+            # e.g. Streamlit stopping the script of a user who clicked elsewhere: the ticket would
+            # otherwise stay at the head of the queue and block every later request
+            self._abandon(ticket)
+            raise
+
+    def _start(self, ticket):
+        """Take the turn of `ticket`, at the head of the round-robin order. Called under `_cond`."""
+        queue = self._queues[ticket.session]
+        queue.popleft()
+        self._order.popleft()
+        if queue:
+            self._order.append(ticket.session)
+        else:
+            del self._queues[ticket.session]
+        self.requests.take(1)
+        self.tokens.take(ticket.tokens)
+        self._in_flight += 1
+        self.calls += 1
+        self._cond.notify_all()
+
+    def _abandon(self, ticket):
+        """Remove `ticket` from its queue when it is still waiting."""
+        with self._cond:
+            queue = self._queues.get(ticket.session)
+            if queue is not None and ticket in queue:
+                queue.remove(ticket)
+                if not queue:
+                    del self._queues[ticket.session]
+                    self._order.remove(ticket.session)
+            self._cond.notify_all()
+
+    def _releaser(self, started):
+        """`release` of a request kept by `open`, releasing its slot once."""
+        released = []
+
+        def release():
+            with self._cond:
+                if released:
+                    return
+                released.append(True)
+            self._release(time.monotonic() - started)
+        return release
+
+    def _release(self, latency):
+        with self._cond:
+            self._in_flight -= 1
+            self.avg_latency = 0.9 * self.avg_latency + 0.1 * latency
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "waiting": sum(len(queue) for queue in self._queues.values()),
+                "in_flight": self._in_flight,
+                "calls": self.calls,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "avg_latency": self.avg_latency,
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """The scheduler shared by every OpenAI call of the process."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = FairScheduler()
+        return _scheduler
@@ -0,0 +1,170 @@
+"""In-memory cache of completions keyed on the meaning of free text.
+
+The "Custom Input" text area and the "Others" theme rarely receive the exact same text twice, but
+often near variants ("Homélie sur l'espérance chrétienne", "homelie sur l'Esperance chretienne."),
+which the exact `CompletionCache` cannot match. `SemanticCache` embeds the normalized text locally
+(hashed words and character n-grams in NumPy, no network call) and answers with the completion of
+the most similar text seen before when the cosine similarity reaches `threshold`.
+
+A similar text is not the same request: a wedding and a funeral homily on the same themes share
+almost every word. Besides the high threshold, a hit is refused when a word of either text has no
+counterpart in the other one (`same_words`): only a typo or an inflection in a long text, which
+keeps it above the threshold, is forgiven.
+
+Entries are partitioned per language and scope (the step), each partition holding at most
+`max_entries` vectors and evicting the least recently used one.
+"""
+import os
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from collections import deque
+from difflib import SequenceMatcher
+
+import numpy as np
+
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.95))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 1000))  # per partition
+DIMENSIONS = 1024
+WORD_WEIGHT = 2.0  # a whole word in common counts more than its n-grams
+WORD_SIMILARITY = 0.85  # two words this close are the same word misspelled or inflected ("aimer" and "aider" are not)
+
+# Words that do not change what is asked, in the languages of the app
+STOP_WORDS = set("""
+    a au aux avec ce ces cette d dans de des du en et l la le les par pour qu que qui sur un une
+    about an and for in of on the to with
+    al con del el en la las los para por sobre un una y
+    homelie homelies homily homilia predication predicacion sermon theme tema
+""".split())
+
+
+def normalize(text):
+    """Lowercase words of `text` without accents, punctuation and stop words."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(word for word in re.findall(r"\w+", text) if word not in STOP_WORDS)
+
+
+def same_words(text, other):
+    """Whether every word of the normalized `text` has a counterpart in `other` and the other way
+    round, the counterpart being the same word or one at least `WORD_SIMILARITY` alike."""
+    words, other_words = set(normalize(text).split()), set(normalize(other).split())
+
+    def covered(missing, candidates):
+        return all(any(SequenceMatcher(None, word, candidate).ratio() >= WORD_SIMILARITY for candidate in candidates)
+                   for word in missing)
+
+    return covered(words - other_words, other_words) and covered(other_words - words, words)
+
+
+def embed(text, dimensions=DIMENSIONS):
+    """Unit vector of the hashed words and 3-4 character n-grams of the normalized `text`. The n-grams
+    make typos and inflections ("esperanse", "chretiens") land close to the right word."""
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word in normalize(text).split():
+        features = [(f"w:{word}", WORD_WEIGHT)]
+        padded = f" {word} "
+        for n in (3, 4):
+            features += [(padded[i:i + n], 1.0) for i in range(max(1, len(padded) - n + 1))]
+        for feature, weight in features:
+            digest = zlib.crc32(feature.encode("utf-8"))  # stable across processes, unlike hash()
+            vector[digest % dimensions] += weight if digest & 0x80000000 else -weight
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class _Partition:
+    def __init__(self, max_entries, dimensions):
+        self.vectors = np.zeros((max_entries, dimensions), dtype=np.float32)
+        self.texts = [None] * max_entries
+        self.values = [None] * max_entries
+        self.last_access = np.zeros(max_entries)
+        self.size = 0
+
+    def slot(self):
+        """Index of a free row, else of the least recently used one."""
+        if self.size < len(self.values):
+            self.size += 1
+            return self.size - 1
+        return int(np.argmin(self.last_access))
+
+
+class SemanticCache:
+    """See the module docstring. Safe to share between the threads of the Streamlit server."""
+
+    def __init__(self, threshold=SEMANTIC_CACHE_THRESHOLD, max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+                 dimensions=DIMENSIONS):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.dimensions = dimensions
+        self.hits = 0
+        self.misses = 0
+        self._lookups = deque(maxlen=1000)  # seconds of the recent lookups
+        self._partitions = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, text, language, scope=None):
+        """Return `(value, similarity, cached_text)` of the nearest entry, `value` None below the
+        threshold, when the words differ (see `same_words`) or when the partition is empty."""
+        started = time.perf_counter()
+        vector = embed(text, self.dimensions)
+        with self._lock:
+            partition = self._partitions.get((language, scope))
+            value, similarity, cached_text = None, 0.0, None
+            if partition is not None and partition.size and vector.any():
+                similarities = partition.vectors[:partition.size] @ vector
+                best = int(np.argmax(similarities))
+                similarity = float(similarities[best])
+                if similarity >= self.threshold and same_words(text, partition.texts[best]):
+                    value, cached_text = partition.values[best], partition.texts[best]
+                    partition.last_access[best] = time.monotonic()
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            self._lookups.append(time.perf_counter() - started)
+        return value, similarity, cached_text
+
+    def get(self, text, language, scope=None):
+        """Return the value stored for the text most similar to `text`, or None."""
+        return self.lookup(text, language, scope)[0]
+
+    def set(self, text, language, value, scope=None):
+        """Store `value` for `text`, evicting the least recently used entry of a full partition."""
+        vector = embed(text, self.dimensions)
+        if not vector.any():
+            return  # nothing but stop words, it would never be found again
+        with self._lock:
+            partition = self._partitions.get((language, scope))
+            if partition is None:
+                partition = self._partitions[(language, scope)] = _Partition(self.max_entries, self.dimensions)
+            slot = partition.slot()
+            partition.vectors[slot] = vector
+            partition.texts[slot] = text
+            partition.values[slot] = value
+            partition.last_access[slot] = time.monotonic()
+
+    def clear(self):
+        with self._lock:
+            self._partitions.clear()
+
+    def __len__(self):
+        with self._lock:
+            return sum(partition.size for partition in self._partitions.values())
+
+    def stats(self):
+        with self._lock:
+            lookups = sorted(self._lookups)
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": sum(partition.size for partition in self._partitions.values()),
+                "partitions": len(self._partitions),
+                "threshold": self.threshold,
+                "lookup_p50_ms": lookups[len(lookups) // 2] * 1000 if lookups else 0.0,
+                "lookup_p95_ms": lookups[int(0.95 * len(lookups))] * 1000 if lookups else 0.0,
+            }
@@ -0,0 +1,167 @@
+"""Drafts of the sessions, kept outside of the Streamlit process memory.
+
+Everything a user generated (key messages, chosen key message, inspirations, predication) is saved
+under the session token carried in the page URL (`?session=...`). A user coming back with the
+same URL after a disconnect, a reload or a server restart gets the draft back without new model
+calls.
+
+`SessionStore` keeps the drafts of the recently active sessions in memory, at most `max_hot` of
+them and none idle for more than `idle_timeout` seconds, and writes every change through to a
+backend: `SQLiteBackend` by default, any object with the same `load`/`save`/`delete`/`purge`
+methods otherwise (`MemoryBackend` for development).
+
+The bulky parts of a draft (`OFFLOADED_KEYS`) are only in the session state while a step of the
+page runs: the app reads them from the store at the start of the step and removes them after
+saving. The memory of the process is then bounded by `max_hot` drafts, however many sessions
+stay connected.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", os.path.join(".cache", "sessions.sqlite3"))
+SESSION_TTL = int(os.getenv("SESSION_TTL", 30 * 24 * 3600))  # seconds a draft is kept on disk after its last change
+SESSION_HOT_MAX = int(os.getenv("SESSION_HOT_MAX", 200))
+SESSION_IDLE_TIMEOUT = int(os.getenv("SESSION_IDLE_TIMEOUT", 600))
+
+# Session state keys making up a draft
+DRAFT_KEYS = ["METHOD", "THEME", "RESPONSES", "SELECTED_RESPONSE", "INSPIRATIONS", "PREDICATION", "PREDICATION_SECTIONS",
+              "PREDICATION_HISTORY", "PROMPT_BUDGET", "TRANSLATIONS", "VARIANTS"]
+# Draft keys left to the store between the runs of a session, with the factory of their empty value
+OFFLOADED_KEYS = {"INSPIRATIONS": dict, "VARIANTS": dict, "PREDICATION_SECTIONS": dict, "PREDICATION_HISTORY": list,
+                  "TRANSLATIONS": dict}
+
+
+class SQLiteBackend:
+    """Drafts as JSON in a SQLite file, safe to share between threads and processes."""
+
+    def __init__(self, path=SESSION_STORE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " token TEXT PRIMARY KEY,"
+            " draft TEXT NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+
+    def load(self, token):
+        with self._lock:
+            row = self._db.execute("SELECT draft FROM sessions WHERE token = ?", (token,)).fetchone()
+        return None if row is None else row[0]
+
+    def save(self, token, draft):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO sessions (token, draft, updated_at) VALUES (?, ?, ?)",
+                             (token, draft, time.time()))
+
+    def delete(self, token):
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE token = ?", (token,))
+
+    def purge(self, max_age):
+        """Delete the drafts unchanged for `max_age` seconds."""
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - max_age,))
+
+
+class MemoryBackend:
+    """Drafts in a dict, lost with the process."""
+
+    def __init__(self):
+        self._drafts = {}
+
+    def load(self, token):
+        entry = self._drafts.get(token)
+        return None if entry is None else entry[0]
+
+    def save(self, token, draft):
+        self._drafts[token] = (draft, time.time())
+
+    def delete(self, token):
+        self._drafts.pop(token, None)
+
+    def purge(self, max_age):
+        now = time.time()
+        for token in [token for token, (_, updated_at) in self._drafts.items() if now - updated_at > max_age]:
+            del self._drafts[token]
+
+
+class SessionStore:
+    """See the module docstring. The drafts are JSON-serialisable dicts. Safe to share between the
+    threads of the Streamlit server."""
+
+    def __init__(self, backend=None, max_hot=SESSION_HOT_MAX, idle_timeout=SESSION_IDLE_TIMEOUT, ttl=SESSION_TTL):
+        self.backend = SQLiteBackend() if backend is None else backend
+        self.max_hot = max_hot
+        self.idle_timeout = idle_timeout
+        self.ttl = ttl
+        self.loads = 0  # drafts read back from the backend
+        self.saves = 0
+        self.evictions = 0
+        self._hot = OrderedDict()  # token -> (serialized draft, last access), least recently used first
+        self._lock = threading.Lock()
+        self.backend.purge(ttl)
+
+    def _evict(self):
+        """Forget the drafts idle for too long and the least recently used ones above `max_hot`."""
+        now = time.monotonic()
+        while self._hot:
+            token, (_, last_access) = next(iter(self._hot.items()))
+            if len(self._hot) <= self.max_hot and now - last_access <= self.idle_timeout:
+                break
+            del self._hot[token]
+            self.evictions += 1
+
+    def load(self, token):
+        """Return the draft saved under `token`, or None."""
+        with self._lock:
+            entry = self._hot.get(token)
+            if entry is not None:
+                self._hot[token] = (entry[0], time.monotonic())
+                self._hot.move_to_end(token)
+                return json.loads(entry[0])
+        draft = self.backend.load(token)
+        if draft is None:
+            return None
+        with self._lock:
+            self.loads += 1
+            self._hot[token] = (draft, time.monotonic())
+            self._evict()
+        return json.loads(draft)
+
+    def save(self, token, draft):
+        """Store `draft` under `token`, writing to the backend only when it changed."""
+        serialized = json.dumps(draft, ensure_ascii=False)
+        with self._lock:
+            entry = self._hot.get(token)
+            changed = entry is None or entry[0] != serialized
+            self._hot[token] = (serialized, time.monotonic())
+            self._hot.move_to_end(token)
+            self._evict()
+        if changed:
+            self.backend.save(token, serialized)
+            self.saves += 1
+
+    def delete(self, token):
+        with self._lock:
+            self._hot.pop(token, None)
+        self.backend.delete(token)
+
+    def stats(self):
+        with self._lock:
+            self._evict()
+            return {
+                "hot": len(self._hot),
+                "hot_bytes": sum(len(draft) for draft, _ in self._hot.values()),
+                "loads": self.loads,
+                "saves": self.saves,
+                "evictions": self.evictions,
+            }
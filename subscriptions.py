@@ -0,0 +1,376 @@
+"""Daily predications e-mailed to the subscribers of Step 4.
+
+Subscribers are kept in a SQLite file with their preferences: language, profile and theme (None
+for the readings of the day). Subscribers with the same preferences get the same predication, so
+the daily job generates one predication per group of (language, profile, theme), not one per
+subscriber, and personalises it with a greeting naming the subscriber's city and country, a
+plain template substitution. The cost of a day grows with the number of groups only.
+
+Every predication of the day ("edition") and every delivery are recorded: running the job again
+the same day, e.g. after a crash or an SMTP outage, reuses the editions already generated and
+only e-mails the subscribers not marked as sent yet. Run it from cron once a day:
+
+    python subscriptions.py send --connections 4
+
+Themed groups develop a different key message of the theme each day, from the five proposed by
+Step 1, whose answer comes from the completion cache after the first day.
+
+Every e-mail ends with a link to the app (`APP_URL`) carrying the subscriber's unsubscribe token
+(`?unsubscribe=...`): opening it removes the subscriber, see `SubscriberStore.unsubscribe_token`.
+
+Subscribing from the app is a double opt-in: `SubscriberStore.request_subscription` only records
+the request and the app e-mails a confirmation link (`?confirm=...`) to the address; the address
+becomes a subscriber when its owner opens the link within `CONFIRMATION_TTL` seconds, see
+`SubscriberStore.confirm`. So nobody can subscribe an address they cannot read.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date
+from string import Template
+
+import batch
+import http_pool
+from completion_cache import CompletionCache
+from mailer import SENT, MailQueue
+from prompts import INSPIRATION_SOURCES
+
+SUBSCRIPTIONS_PATH = os.getenv("SUBSCRIPTIONS_PATH", os.path.join(".cache", "subscriptions.sqlite3"))
+APP_URL = os.getenv("APP_URL", "http://localhost:8501")  # public address of the app, for the links of the e-mails
+CONFIRMATION_TTL = float(os.getenv("CONFIRMATION_TTL", 2 * 86400))  # seconds a confirmation link stays valid
+CONFIRMATION_RESEND = float(os.getenv("CONFIRMATION_RESEND", 600))  # seconds before e-mailing an address again
+
+SUBJECTS = {
+    "French": "Votre prédication du $day",
+    "English": "Your predication for $day",
+    "Spanish": "Su predicación del $day",
+}
+# $place is "city, country", or whichever of the two the subscriber gave
+GREETINGS = {
+    "French": ("Chers amis de $place,", "Chers amis,"),
+    "English": ("Dear friends in $place,", "Dear friends,"),
+    "Spanish": ("Queridos amigos de $place:", "Queridos amigos:"),
+}
+# $link is the unsubscribe link of the subscriber
+FOOTERS = {
+    "French": "Pour ne plus recevoir ces messages : $link",
+    "English": "To stop receiving these messages: $link",
+    "Spanish": "Para dejar de recibir estos mensajes: $link",
+}
+# $link is the confirmation link of the subscription request
+CONFIRMATIONS = {
+    "French": ("Confirmez votre abonnement",
+               "Pour recevoir chaque jour une prédication, ouvrez ce lien : $link\n\n"
+               "Si vous n'avez rien demandé, ignorez ce message."),
+    "English": ("Confirm your subscription",
+                "To receive a predication every day, open this link: $link\n\n"
+                "If you did not ask for it, ignore this message."),
+    "Spanish": ("Confirme su suscripción",
+                "Para recibir una predicación cada día, abra este enlace: $link\n\n"
+                "Si no lo ha pedido, ignore este mensaje."),
+}
+
+
+class SubscriberStore:
+    """Subscribers, daily editions and deliveries in a SQLite file, safe to share between threads
+    and processes."""
+
+    def __init__(self, path=SUBSCRIPTIONS_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS subscribers ("
+            " email TEXT PRIMARY KEY,"
+            " language TEXT NOT NULL,"
+            " profile TEXT NOT NULL,"
+            " theme TEXT,"
+            " city TEXT NOT NULL DEFAULT '',"
+            " country TEXT NOT NULL DEFAULT '',"
+            " subscribed_at REAL NOT NULL,"
+            " token TEXT)"  # of the unsubscribe link
+        )
+        if "token" not in [column[1] for column in self._db.execute("PRAGMA table_info(subscribers)")]:
+            self._db.execute("ALTER TABLE subscribers ADD COLUMN token TEXT")  # file created by an older version
+        self._db.execute("UPDATE subscribers SET token = lower(hex(randomblob(16))) WHERE token IS NULL")
+        self._db.execute("CREATE UNIQUE INDEX IF NOT EXISTS subscribers_token ON subscribers (token)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS requests ("  # subscriptions waiting for their confirmation
+            " token TEXT PRIMARY KEY,"  # of the confirmation link
+            " email TEXT NOT NULL,"
+            " language TEXT NOT NULL,"
+            " profile TEXT NOT NULL,"
+            " theme TEXT,"
+            " city TEXT NOT NULL DEFAULT '',"
+            " country TEXT NOT NULL DEFAULT '',"
+            " requested_at REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS editions ("
+            " day TEXT NOT NULL,"
+            " language TEXT NOT NULL,"
+            " profile TEXT NOT NULL,"
+            " theme TEXT NOT NULL,"  # '' for the readings of the day
+            " predication TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " PRIMARY KEY (day, language, profile, theme))"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS deliveries ("
+            " day TEXT NOT NULL,"
+            " email TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " error TEXT,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (day, email))"
+        )
+
+    def subscribe(self, email, language, profile, theme=None, city="", country=""):
+        """Add a subscriber, or replace the preferences of an existing one, who keeps the
+        unsubscribe link of the e-mails already sent. The app goes through `request_subscription`
+        instead: the address is not checked here."""
+        with self._lock:
+            self._subscribe(email, language, profile, theme, city, country)
+
+    def _subscribe(self, email, language, profile, theme, city, country):
+        self._db.execute(
+            "INSERT INTO subscribers (email, language, profile, theme, city, country, subscribed_at, token)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (email) DO UPDATE SET language = excluded.language, profile = excluded.profile,"
+            " theme = excluded.theme, city = excluded.city, country = excluded.country,"
+            " subscribed_at = excluded.subscribed_at",
+            (email.strip().lower(), language, profile, theme or None, city.strip(), country.strip(), time.time(),
+             uuid.uuid4().hex),
+        )
+
+    def request_subscription(self, email, language, profile, theme=None, city="", country=""):
+        """Record a subscription waiting for the owner of `email` to confirm it, and return the token
+        of its confirmation link. Returns None, recording nothing, when the address was already sent
+        a link less than `CONFIRMATION_RESEND` seconds ago, so the app cannot be used to flood it."""
+        email = email.strip().lower()
+        now = time.time()
+        with self._lock:
+            self._db.execute("DELETE FROM requests WHERE requested_at < ?", (now - CONFIRMATION_TTL,))
+            if self._db.execute("SELECT 1 FROM requests WHERE email = ? AND requested_at >= ?",
+                                (email, now - CONFIRMATION_RESEND)).fetchone():
+                return None
+            token = uuid.uuid4().hex
+            self._db.execute(
+                "INSERT INTO requests (token, email, language, profile, theme, city, country, requested_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (token, email, language, profile, theme or None, city.strip(), country.strip(), now),
+            )
+        return token
+
+    def confirm(self, token):
+        """Subscribe the address of the confirmation link `token` with the preferences of its request,
+        and return the address; None when the link is unknown, already used or expired."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT email, language, profile, theme, city, country FROM requests"
+                " WHERE token = ? AND requested_at >= ?", (token, time.time() - CONFIRMATION_TTL),
+            ).fetchone()
+            # Deleting the request first makes the link single-use, even opened by two processes at once
+            if row is None or not self._db.execute("DELETE FROM requests WHERE token = ?", (token,)).rowcount:
+                return None
+            self._subscribe(*row)
+            self._db.execute("DELETE FROM requests WHERE email = ?", (row[0],))
+        return row[0]
+
+    def unsubscribe(self, email):
+        """Remove a subscriber, return False when there was none."""
+        with self._lock:
+            return self._db.execute("DELETE FROM subscribers WHERE email = ?", (email.strip().lower(),)).rowcount > 0
+
+    def unsubscribe_token(self, token):
+        """Remove the subscriber of the unsubscribe link `token`, return False when there was none."""
+        with self._lock:
+            return self._db.execute("DELETE FROM subscribers WHERE token = ?", (token,)).rowcount > 0
+
+    def subscribers(self):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT email, language, profile, theme, city, country, token FROM subscribers ORDER BY email"
+            ).fetchall()
+        return [dict(zip(("email", "language", "profile", "theme", "city", "country", "token"), row)) for row in rows]
+
+    def pending(self, day):
+        """Subscribers not yet e-mailed successfully on `day`."""
+        with self._lock:
+            sent = {row[0] for row in self._db.execute(
+                "SELECT email FROM deliveries WHERE day = ? AND status = ?", (day.isoformat(), SENT))}
+        return [subscriber for subscriber in self.subscribers() if subscriber["email"] not in sent]
+
+    def edition(self, day, group):
+        """Predication already generated for `group` on `day`, or None."""
+        language, profile, theme = group
+        with self._lock:
+            row = self._db.execute(
+                "SELECT predication FROM editions WHERE day = ? AND language = ? AND profile = ? AND theme = ?",
+                (day.isoformat(), language, profile, theme or ""),
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def save_edition(self, day, group, predication):
+        language, profile, theme = group
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO editions (day, language, profile, theme, predication, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (day.isoformat(), language, profile, theme or "", predication, time.time()),
+            )
+
+    def record_delivery(self, day, email, status, error=None):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO deliveries (day, email, status, error, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (day.isoformat(), email, status, error, time.time()),
+            )
+
+
+def group_subscribers(subscribers):
+    """`{(language, profile, theme): [subscriber, ...]}`, one predication per key."""
+    groups = defaultdict(list)
+    for subscriber in subscribers:
+        groups[(subscriber["language"], subscriber["profile"], subscriber["theme"])].append(subscriber)
+    return dict(groups)
+
+
+def group_item(day, group):
+    """The `batch.run_item` item generating the predication of `group` on `day`."""
+    language, profile, theme = group
+    return {
+        "id": batch.short_key(day.isoformat(), theme, language, profile),
+        "topic_id": batch.short_key(day.isoformat(), theme, language),
+        "date": day.isoformat(),
+        "theme": theme,
+        "language": language,
+        "profile": profile,
+        "sources": list(INSPIRATION_SOURCES),
+        # A theme has the same key messages every day, develop another one each day
+        "key_message_index": day.toordinal() % 5 if theme else 0,
+    }
+
+
+def personalise(predication, subscriber, day):
+    """`(subject, body)` of the e-mail of `subscriber`."""
+    language = subscriber["language"] if subscriber["language"] in GREETINGS else "English"
+    place = ", ".join(part for part in (subscriber["city"], subscriber["country"]) if part)
+    greeting, anonymous = GREETINGS[language]
+    subject = Template(SUBJECTS[language]).substitute(day=day.strftime("%d/%m/%Y"))
+    greeting = Template(greeting).substitute(place=place) if place else anonymous
+    footer = Template(FOOTERS[language]).substitute(link=f"{APP_URL.rstrip('/')}/?unsubscribe={subscriber['token']}")
+    return subject, f"{greeting}\n\n{predication}\n\n--\n{footer}\n"
+
+
+def confirmation_email(language, token):
+    """`(subject, body)` of the e-mail asking to confirm the subscription request `token`."""
+    subject, body = CONFIRMATIONS[language if language in CONFIRMATIONS else "English"]
+    return subject, Template(body).substitute(link=f"{APP_URL.rstrip('/')}/?confirm={token}") + "\n"
+
+
+def send_daily(store, client, mail_queue, day=None, cache=None, concurrency=4, model=None, dry_run=False):
+    """Generate the missing editions of `day` (today when None) and e-mail every pending
+    subscriber. Returns the counters of the run."""
+    day = day or date.today()
+    pending = store.pending(day)
+    groups = group_subscribers(pending)
+    report = {"subscribers": len(store.subscribers()), "pending": len(pending), "groups": len(groups),
+              "generated": 0, "reused": 0, "failed_groups": 0, "sent": 0, "failed": 0}
+
+    editions = {}
+    todo = []
+    for group in groups:
+        editions[group] = store.edition(day, group)
+        if editions[group] is None:
+            todo.append(group)
+        else:
+            report["reused"] += 1
+    if dry_run:
+        return report
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(batch.run_item, client, group_item(day, group), cache, model): group
+                   for group in todo}
+        for future in as_completed(futures):
+            group = futures[future]
+            try:
+                editions[group] = future.result()["predication"]
+            except Exception as e:
+                report["failed_groups"] += 1
+                print(f"{' / '.join(str(part) for part in group)} failed: {e}", file=sys.stderr)
+                continue
+            store.save_edition(day, group, editions[group])
+            report["generated"] += 1
+
+    lock = threading.Lock()
+
+    def delivered(email):
+        def on_done(message_id, status):
+            store.record_delivery(day, email, status["status"], status["error"])
+            with lock:
+                report["sent" if status["status"] == SENT else "failed"] += 1
+        return on_done
+
+    for group, subscribers in groups.items():
+        if editions[group] is None:
+            continue  # retried on the next run of the day
+        for subscriber in subscribers:
+            subject, body = personalise(editions[group], subscriber, day)
+            mail_queue.submit(subscriber["email"], subject, body, on_done=delivered(subscriber["email"]))
+    mail_queue.join()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the subscribers and send the daily predications.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    send_parser = subparsers.add_parser("send", help="generate and e-mail the predications of the day")
+    send_parser.add_argument("--date", type=date.fromisoformat, default=None, help="day to send, today by default")
+    send_parser.add_argument("--concurrency", type=int, default=4, help="groups generated at the same time")
+    send_parser.add_argument("--connections", type=int, default=2, help="SMTP connections used in parallel")
+    send_parser.add_argument("--model", help="model of every step, instead of the routes of routing.py")
+    send_parser.add_argument("--no-cache", action="store_true", help="do not use the completion cache")
+    send_parser.add_argument("--dry-run", action="store_true", help="only count the subscribers and groups")
+
+    subparsers.add_parser("list", help="list the subscribers")
+    unsubscribe_parser = subparsers.add_parser("unsubscribe", help="remove subscribers")
+    unsubscribe_parser.add_argument("emails", nargs="+")
+
+    args = parser.parse_args(argv)
+    store = SubscriberStore()
+
+    if args.command == "list":
+        for subscriber in store.subscribers():
+            print("\t".join(str(subscriber[field] or "") for field in
+                            ("email", "language", "profile", "theme", "city", "country")))
+        return 0
+    if args.command == "unsubscribe":
+        missing = [email for email in args.emails if not store.unsubscribe(email)]
+        for email in missing:
+            print(f"{email} is not subscribed", file=sys.stderr)
+        return 1 if missing else 0
+
+    day = args.date or date.today()
+    report = send_daily(
+        store, http_pool.get_client(), MailQueue(workers=args.connections), day,
+        None if args.no_cache else CompletionCache(), args.concurrency, args.model, args.dry_run,
+    )
+    print(f"{day}: {report['pending']}/{report['subscribers']} subscribers to e-mail in {report['groups']} groups, "
+          f"{report['generated']} predications generated, {report['reused']} reused, "
+          f"{report['failed_groups']} failed; {report['sent']} e-mails sent, {report['failed']} failed",
+          file=sys.stderr)
+    return 1 if report["failed_groups"] or report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+import os
+import sys
+from datetime import date, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from liturgical_calendar import easter, liturgical_day, readings  # noqa: E402
+
+
+@pytest.mark.parametrize("year, expected", [
+    (2000, date(2000, 4, 23)),
+    (2008, date(2008, 3, 23)),
+    (2019, date(2019, 4, 21)),
+    (2024, date(2024, 3, 31)),
+    (2025, date(2025, 4, 20)),
+    (2026, date(2026, 4, 5)),
+    (2038, date(2038, 4, 25)),
+])
+def test_easter(year, expected):
+    assert easter(year) == expected
+
+
+@pytest.mark.parametrize("day, sunday_cycle, weekday_cycle", [
+    (date(2025, 11, 29), "C", "I"),   # last day of the liturgical year 2025
+    (date(2025, 11, 30), "A", "II"),  # first Sunday of Advent, liturgical year 2026
+    (date(2026, 6, 10), "A", "II"),
+    (date(2026, 12, 3), "B", "I"),    # Advent weekday of the liturgical year 2027
+    (date(2027, 3, 3), "B", "I"),
+])
+def test_cycles(day, sunday_cycle, weekday_cycle):
+    liturgical = liturgical_day(day)
+    assert (liturgical["sunday_cycle"], liturgical["weekday_cycle"]) == (sunday_cycle, weekday_cycle)
+
+
+@pytest.mark.parametrize("day, key", [
+    (date(2026, 1, 4), "epiphany"),
+    (date(2026, 1, 11), "baptism"),
+    (date(2024, 1, 8), "baptism"),  # Monday, Epiphany being on January 7
+    (date(2026, 2, 18), "ash-wednesday"),
+    (date(2026, 3, 29), "palm-sunday"),
+    (date(2026, 4, 5), "easter"),
+    (date(2026, 5, 14), "ascension"),
+    (date(2026, 5, 24), "pentecost"),
+    (date(2026, 5, 31), "trinity"),
+    (date(2026, 6, 7), "corpus-christi"),
+    (date(2026, 11, 22), "christ-the-king"),
+    (date(2025, 12, 28), "holy-family"),
+    (date(2026, 11, 29), "advent-1"),
+])
+def test_movable_feasts(day, key):
+    assert liturgical_day(day)["key"] == key
+
+
+@pytest.mark.parametrize("day, key", [
+    (date(2026, 1, 18), "ordinary-2"),
+    (date(2026, 2, 15), "ordinary-6"),
+    (date(2026, 6, 14), "ordinary-11"),
+    (date(2026, 10, 18), "ordinary-29"),
+    (date(2026, 11, 15), "ordinary-33"),
+])
+def test_ordinary_sundays(day, key):
+    assert liturgical_day(day)["key"] == key
+
+
+@pytest.mark.parametrize("year", range(2025, 2031))
+def test_every_sunday_has_readings(year):
+    day = date(year, 1, 1) + timedelta(days=(6 - date(year, 1, 1).weekday()) % 7)
+    while day.year == year:
+        assert readings(day), liturgical_day(day)
+        day += timedelta(weeks=1)
@@ -0,0 +1,101 @@
+import os
+import smtplib
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import mailer  # noqa: E402
+from mailer import FAILED, SENT, MailQueue  # noqa: E402
+
+
+class FakeSMTP:
+    """Stands for `smtplib.SMTP`, `error` being raised by every `send_message` when set."""
+    error = None
+    sent = []
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def starttls(self):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def send_message(self, msg):
+        if FakeSMTP.error is not None:
+            raise FakeSMTP.error
+        FakeSMTP.sent.append(msg["To"])
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def make_queue(monkeypatch, error=None, **kwargs):
+    monkeypatch.setattr(mailer.smtplib, "SMTP", FakeSMTP)
+    monkeypatch.setattr(FakeSMTP, "error", error)
+    monkeypatch.setattr(FakeSMTP, "sent", [])
+    return MailQueue(user="app@example.com", password="secret", backoff=0.01, **kwargs)
+
+
+def test_sends_and_reports(monkeypatch):
+    mail_queue = make_queue(monkeypatch)
+    done = []
+    message_id = mail_queue.submit("me@example.com", "Subject", "Body", on_done=lambda *args: done.append(args))
+    assert mail_queue.join(timeout=5)
+    assert mail_queue.status(message_id)["status"] == SENT
+    assert FakeSMTP.sent == ["me@example.com"]
+    assert done[0][0] == message_id
+
+
+def test_failing_callback_does_not_block_join(monkeypatch):
+    mail_queue = make_queue(monkeypatch)
+
+    def on_done(message_id, status):
+        raise RuntimeError("bug in the callback")
+
+    mail_queue.submit("me@example.com", "Subject", "Body", on_done=on_done)
+    mail_queue.submit("you@example.com", "Subject", "Body")
+    assert mail_queue.join(timeout=5)
+    assert FakeSMTP.sent == ["me@example.com", "you@example.com"]
+
+
+def test_unexpected_error_fails_the_message_only(monkeypatch):
+    mail_queue = make_queue(monkeypatch, error=ValueError("malformed message"))
+    message_id = mail_queue.submit("me@example.com", "Subject", "Body")
+    assert mail_queue.join(timeout=5)
+    assert mail_queue.status(message_id)["status"] == FAILED
+    assert mail_queue.status(message_id)["attempts"] == 1
+    FakeSMTP.error = None
+    mail_queue.submit("you@example.com", "Subject", "Body")
+    assert mail_queue.join(timeout=5)
+    assert FakeSMTP.sent == ["you@example.com"]
+
+
+def test_refused_recipient_is_not_retried(monkeypatch):
+    error = smtplib.SMTPRecipientsRefused({"me@example.com": (450, b"mailbox unavailable")})
+    mail_queue = make_queue(monkeypatch, error=error)
+    message_id = mail_queue.submit("me@example.com", "Subject", "Body")
+    assert mail_queue.join(timeout=5)
+    assert mail_queue.status(message_id)["status"] == FAILED
+    assert mail_queue.status(message_id)["attempts"] == 1
+
+
+def test_transient_error_is_retried(monkeypatch):
+    mail_queue = make_queue(monkeypatch, error=smtplib.SMTPServerDisconnected("gone"), max_attempts=3)
+    message_id = mail_queue.submit("me@example.com", "Subject", "Body")
+    assert mail_queue.join(timeout=5)
+    assert mail_queue.status(message_id)["status"] == FAILED
+    assert mail_queue.status(message_id)["attempts"] == 3
+
+
+def test_finished_statuses_are_forgotten(monkeypatch):
+    mail_queue = make_queue(monkeypatch, status_ttl=0.0)
+    first = mail_queue.submit("me@example.com", "Subject", "Body")
+    assert mail_queue.join(timeout=5)
+    second = mail_queue.submit("you@example.com", "Subject", "Body")
+    assert mail_queue.join(timeout=5)
+    assert mail_queue.status(first) is None
+    assert mail_queue.status(second)["status"] == SENT
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from prompt_budget import assemble_predication_prompt, count_tokens  # noqa: E402
+from prompts import INSPIRATION_SOURCES  # noqa: E402
+
+
+@pytest.mark.parametrize("structured", [False, True])
+@pytest.mark.parametrize("budget", [400, 500, 700, 1500])
+def test_predication_prompt_fits_its_budget(budget, structured):
+    inspirations = {source: "Texte sur la miséricorde et la joie de servir. " * 40 for source in INSPIRATION_SOURCES}
+    prompt, report = assemble_predication_prompt("adultes", "French", "Noël", inspirations, budget=budget,
+                                                 structured=structured)
+    assert report["tokens"] == count_tokens(prompt) <= budget
+    assert "Joke" in prompt  # the first source is always kept
+    for source in report["dropped"]:
+        assert f"- {source}:" not in prompt
+
+
+def test_short_inspirations_are_kept_whole():
+    inspirations = {source: f"Idée courte pour {source}." for source in INSPIRATION_SOURCES}
+    prompt, report = assemble_predication_prompt("adultes", "French", "Noël", inspirations, structured=True)
+    assert report["truncated"] == report["dropped"] == []
+    assert len(report["sections"]) == len(INSPIRATION_SOURCES) + 4
@@ -0,0 +1,84 @@
+import os
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import gpt  # noqa: E402
+import http_pool  # noqa: E402
+import metrics  # noqa: E402
+import routing  # noqa: E402
+import scheduler  # noqa: E402
+
+
+class SlowClient:
+    """Stands for `openai.OpenAI`: every request answers after `latency` seconds."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.threads = []
+        self.timeouts = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, messages, model, timeout=None, **kwargs):
+        self.threads.append(threading.current_thread().name)
+        self.timeouts.append(timeout)
+        time.sleep(self.latency)
+        message = SimpleNamespace(content="answer")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+def hedged_route(monkeypatch):
+    """A route duplicating the requests slower than 50 ms, and a scheduler of a single slot."""
+    monkeypatch.setattr(metrics, "METRICS_LOG", os.devnull)
+    monkeypatch.setattr(scheduler, "_scheduler", scheduler.FairScheduler(rpm=100000, tpm=10 ** 9, max_concurrency=1))
+    routing.reset()
+    route = routing.Route("test", "model", fallback=None, timeout=5, hedge=True)
+    monkeypatch.setitem(routing.ROUTES, "test", route)
+    for _ in range(routing.HEDGE_MIN_SAMPLES):
+        routing.observe(route, 0.05)
+    return route
+
+
+def hold_slot(seconds):
+    _, release = scheduler.get_scheduler().open(lambda: None, "other")
+    threading.Timer(seconds, release).start()
+
+
+def test_hedge_waits_for_the_slot_on_the_caller_thread(monkeypatch):
+    hedged_route(monkeypatch)
+    hold_slot(1.3)  # longer than a second, so `on_wait` is called
+    waits = []
+    client = SlowClient(latency=0.3)
+    timings = {}
+    caller = threading.current_thread().name
+
+    completion = gpt.complete(client, "prompt", "French", step="test", timings=timings,
+                              on_wait=lambda position, eta: waits.append(threading.current_thread().name))
+
+    assert completion == "answer"
+    assert waits and set(waits) == {caller}  # a UI callback never runs in the hedge threads
+    assert timings["hedged"] is True
+    assert len(client.threads) == 2 and all(name.startswith("hedge") for name in client.threads)
+
+
+def test_time_in_the_queue_does_not_trigger_a_hedge(monkeypatch):
+    hedged_route(monkeypatch)
+    hold_slot(0.5)
+    client = SlowClient(latency=0.01)
+    timings = {}
+    assert gpt.complete(client, "prompt", "French", step="test", timings=timings) == "answer"
+    assert timings["hedged"] is False
+    assert len(client.threads) == 1
+    assert routing.stats()["hedges"] == 0
+
+
+def test_route_deadline_keeps_the_pool_timeouts(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_LOG", os.devnull)
+    client = SlowClient(latency=0)
+    gpt.complete(client, "prompt", "French", step="key_messages")
+    timeout = client.timeouts[0]
+    assert timeout.read == routing.ROUTES["key_messages"].timeout
+    assert timeout.connect == http_pool.OPENAI_CONNECT_TIMEOUT
+    assert timeout.pool == http_pool.OPENAI_POOL_TIMEOUT
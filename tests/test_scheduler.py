@@ -0,0 +1,116 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scheduler import FairScheduler  # noqa: E402
+
+
+def make_scheduler(max_concurrency):
+    return FairScheduler(rpm=100000, tpm=10 ** 9, max_concurrency=max_concurrency)
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def start(target, *args):
+    thread = threading.Thread(target=target, args=args, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_concurrency_cap():
+    scheduler = make_scheduler(max_concurrency=2)
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def request():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.pop()
+
+    threads = [start(scheduler.call, request, f"session {i % 3}") for i in range(8)]
+    for thread in threads:
+        thread.join(5)
+    assert len(peak) == 8
+    assert max(peak) == 2
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_open_keeps_the_slot_until_released():
+    scheduler = make_scheduler(max_concurrency=1)
+    result, release = scheduler.open(lambda: "stream")
+    assert result == "stream"
+    done = []
+    thread = start(lambda: done.append(scheduler.call(lambda: 42, "other")))
+    wait_until(lambda: scheduler.stats()["waiting"] == 1)
+    time.sleep(0.1)
+    assert not done
+    release()
+    release()  # a second call does nothing
+    thread.join(5)
+    assert done == [42]
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_error_releases_the_slot():
+    scheduler = make_scheduler(max_concurrency=1)
+
+    def failing():
+        raise ValueError("not retried")
+
+    with pytest.raises(ValueError):
+        scheduler.call(failing)
+    assert scheduler.stats()["in_flight"] == 0
+    assert scheduler.call(lambda: 42) == 42
+
+
+def test_abandoned_wait_leaves_the_queue():
+    scheduler = make_scheduler(max_concurrency=1)
+    _, release = scheduler.open(lambda: None, "a")
+    errors = []
+
+    def on_wait(position, eta):
+        raise RuntimeError("the user left the page")
+
+    def abandoned():
+        try:
+            scheduler.call(lambda: None, "b", on_wait=on_wait)
+        except RuntimeError as e:
+            errors.append(e)
+
+    thread = start(abandoned)
+    thread.join(5)  # on_wait is called after a second of waiting
+    assert len(errors) == 1
+    assert scheduler.stats()["waiting"] == 0
+    release()
+    done = []
+    thread = start(lambda: done.append(scheduler.call(lambda: 42, "c")))
+    thread.join(5)
+    assert done == [42]
+
+
+def test_sessions_are_served_round_robin():
+    scheduler = make_scheduler(max_concurrency=1)
+    _, release = scheduler.open(lambda: None, "holder")
+    served = []
+    threads = []
+    for number, session in enumerate(["a", "a", "a", "b"], start=1):
+        threads.append(start(scheduler.call, lambda session=session: served.append(session), session))
+        wait_until(lambda: scheduler.stats()["waiting"] == number)
+    release()
+    for thread in threads:
+        thread.join(5)
+    # "b" arrived after the three requests of "a" but does not wait for all of them
+    assert served == ["a", "b", "a", "a"]
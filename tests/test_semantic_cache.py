@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from semantic_cache import SemanticCache, same_words  # noqa: E402
+
+WEDDING = "Homélie pour le mariage de Pierre et Marie, sur la fidélité et le pardon"
+
+# Different requests worded almost the same: answering one with the other is wrong
+DIFFERENT = [
+    (WEDDING, "Homélie pour l'enterrement de Pierre et Marie, sur la fidélité et le pardon"),
+    (WEDDING, WEDDING + " sans insister"),
+    ("Homélie sur la fidélité et le pardon pour des enfants",
+     "Homélie sur la fidélité et le pardon pour des adultes en deuil"),
+    ("Homélie sur l'espérance", "Homélie sur l'espérance chrétienne"),
+    ("Aimer son prochain", "Aider son prochain"),
+]
+
+# The same request typed again
+SAME = [
+    ("Homélie sur l'espérance chrétienne", "homelie sur l'Esperance chretienne."),
+    ("La joie de servir les autres", "Servir les autres, la joie"),
+    ("Le pardon entre frères", "Pardon entre les freres"),
+    (WEDDING, "homélie pour le mariage de Pierre et Marie sur la fidélité et le pardon !"),
+]
+
+
+@pytest.mark.parametrize("cached, asked", DIFFERENT)
+@pytest.mark.parametrize("threshold", [None, 0.5])
+def test_different_requests_miss(cached, asked, threshold):
+    cache = SemanticCache() if threshold is None else SemanticCache(threshold=threshold)
+    cache.set(cached, "French", "cached answer")
+    value, similarity, _ = cache.lookup(asked, "French")
+    assert value is None, f"served at similarity {similarity:.2f}"
+    assert not same_words(cached, asked)
+
+
+@pytest.mark.parametrize("cached, asked", SAME)
+def test_same_requests_hit(cached, asked):
+    cache = SemanticCache()
+    cache.set(cached, "French", "cached answer")
+    assert cache.get(asked, "French") == "cached answer"
+
+
+def test_partitions_are_separate():
+    cache = SemanticCache()
+    cache.set(WEDDING, "French", "cached answer", scope="key_messages")
+    assert cache.get(WEDDING, "English", scope="key_messages") is None
+    assert cache.get(WEDDING, "French", scope="inspiration") is None
+    assert cache.stats()["hits"] == 0
@@ -0,0 +1,56 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import subscriptions  # noqa: E402
+from subscriptions import SubscriberStore, confirmation_email  # noqa: E402
+
+
+def make_store(tmp_path):
+    return SubscriberStore(str(tmp_path / "subscriptions.sqlite3"))
+
+
+def test_request_waits_for_the_confirmation(tmp_path):
+    store = make_store(tmp_path)
+    token = store.request_subscription("Me@Example.com ", "French", "Pastor", "Hope", "Lyon", "France")
+    assert store.subscribers() == []
+    assert store.confirm(token) == "me@example.com"
+    [subscriber] = store.subscribers()
+    assert (subscriber["language"], subscriber["theme"], subscriber["city"]) == ("French", "Hope", "Lyon")
+    assert store.confirm(token) is None  # the link works once
+
+
+def test_unknown_and_expired_links_subscribe_nobody(tmp_path, monkeypatch):
+    store = make_store(tmp_path)
+    assert store.confirm("not a token") is None
+    token = store.request_subscription("me@example.com", "French", "Pastor")
+    monkeypatch.setattr(subscriptions, "CONFIRMATION_TTL", -1)
+    assert store.confirm(token) is None
+    assert store.subscribers() == []
+
+
+def test_an_address_is_not_flooded(tmp_path, monkeypatch):
+    store = make_store(tmp_path)
+    assert store.request_subscription("me@example.com", "French", "Pastor")
+    assert store.request_subscription("me@example.com", "English", "Pastor") is None
+    monkeypatch.setattr(subscriptions, "CONFIRMATION_RESEND", 0)
+    assert store.request_subscription("me@example.com", "English", "Pastor")
+
+
+def test_confirmed_change_keeps_the_unsubscribe_link(tmp_path):
+    store = make_store(tmp_path)
+    store.subscribe("me@example.com", "French", "Pastor")
+    [before] = store.subscribers()
+    token = store.request_subscription("me@example.com", "Spanish", "Pastor")
+    assert store.subscribers()[0]["language"] == "French"  # unchanged until confirmed
+    store.confirm(token)
+    [after] = store.subscribers()
+    assert after["language"] == "Spanish"
+    assert after["token"] == before["token"]
+
+
+def test_confirmation_email_links_to_the_app(monkeypatch):
+    monkeypatch.setattr(subscriptions, "APP_URL", "https://example.org/")
+    subject, body = confirmation_email("French", "abc")
+    assert subject == "Confirmez votre abonnement"
+    assert "https://example.org/?confirm=abc" in body
@@ -0,0 +1,35 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from variants import duplicate, merge, page  # noqa: E402
+
+JOKE = ("Un curé arrive au paradis et saint Pierre lui demande combien de sermons il a faits trop longs. "
+        "« Tous », répond-il.")
+SAME_JOKE = ("Un curé arrive au paradis. Saint Pierre lui demande combien de ses sermons étaient trop longs. "
+             "Il répond : « Tous ! »")
+OTHER_JOKE = "Un enfant demande à son père pourquoi le prêtre regarde toujours sa montre pendant le sermon."
+METAPHORS = ["L'amour est comme un feu : il faut le nourrir chaque jour pour qu'il ne s'éteigne pas.",
+             "La foi est comme une lampe : elle éclaire le chemin mais il faut la remplir d'huile chaque jour."]
+
+
+def test_same_joke_in_other_words_is_a_duplicate():
+    assert duplicate(SAME_JOKE, [JOKE])
+    assert duplicate(JOKE.upper(), [JOKE])
+
+
+def test_different_variants_are_kept():
+    assert not duplicate(OTHER_JOKE, [JOKE])
+    assert not duplicate(METAPHORS[1], METAPHORS[:1])
+
+
+def test_merge_drops_duplicates_and_empty_variants():
+    pool, added = merge([JOKE], [SAME_JOKE, "", OTHER_JOKE, OTHER_JOKE])
+    assert pool == [JOKE, OTHER_JOKE]
+    assert added == [OTHER_JOKE]
+
+
+def test_merge_keeps_the_newest():
+    pool, _ = merge(METAPHORS, [JOKE], size=2)
+    assert pool == [METAPHORS[1], JOKE]
+    assert page(pool, JOKE, 1) == METAPHORS[1]
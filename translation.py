@@ -0,0 +1,71 @@
+"""The predication in other languages, translated instead of generated again.
+
+Generating the predication in a second language through Steps 1 to 3 repeats every call of the
+pipeline. Translating the finished predication is a single request per language, sent to the
+cheap translation route with an answer capped to the length of the text, and the languages are
+translated at the same time. The answer is streamed: the deadline of the route is then the
+time without data, not the time to write the whole translation of a long homily.
+
+A translation is kept per section, with the source text it was made from: after a section was
+rewritten (see `predication.py`) only that section is sent again. Identical requests are answered
+by the completion cache, so a document is translated at most once per target language.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import gpt
+import predication
+from prompt_budget import count_tokens
+from prompts import predication_schema, translation_prompt
+
+EXPANSION = 1.3  # answer tokens per source token: French, English and Spanish texts differ by less
+JSON_TOKENS = 10  # per section, for the keys and quotes of the structured answer
+
+
+def max_tokens(sections):
+    """Answer cap of the translation of the `{section: text}` sections."""
+    return int(sum(count_tokens(text) * EXPANSION + JSON_TOKENS for text in sections.values())) + 50
+
+
+def stale(document, translated):
+    """Sections of `document` whose translation in `translated` is missing or was made from
+    another text."""
+    return {section: text for section, text in document.items()
+            if text and (translated.get(section) or {}).get("source") != text}
+
+
+def translate(client, document, source, target, translated=None, **kwargs):
+    """Return the translation of the `{section: text}` `document` from the language `source` to
+    `target` as `{section: {"source": text, "text": translation}}`, updating the `translated`
+    of a previous version of the document. `kwargs` are passed to `gpt.complete`, the answer is
+    streamed to their `on_token` if any."""
+    translated = {section: entry for section, entry in (translated or {}).items() if section in document}
+    todo = stale(document, translated)
+    if todo:
+        kwargs.setdefault("on_token", lambda text: None)
+        completion = gpt.complete(client, translation_prompt(source, target, todo), target, predication_schema(todo),
+                                  step="translation", max_tokens=max_tokens(todo), **kwargs)
+        for section, text in predication.from_completion(completion, list(todo)).items():
+            translated[section] = {"source": todo[section], "text": text}
+    return {section: translated[section] for section in document if section in translated}
+
+
+def translate_all(client, document, source, targets, translations=None, max_workers=3, **kwargs):
+    """Translate `document` into every language of `targets` at the same time and yield
+    `(language, translated, error)` as each one finishes. `translations` holds the previous
+    `{language: translated}`."""
+    translations = translations or {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(translate, client, document, source, target, translations.get(target), **kwargs): target
+            for target in targets
+        }
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+
+
+def text(translated):
+    """The translated homily as one text, like `predication.text`."""
+    return "\n\n".join(entry["text"] for entry in translated.values() if entry["text"])
@@ -0,0 +1,56 @@
+"""Pools of variants of each inspiration, for browsing the options of a source.
+
+Asking a source again for another idea resends its whole prompt. With `n` variants per request
+(see `gpt.complete`) the prompt is sent and billed once for all of them, and only the answers
+cost tokens. Every variant received for a source, from any request, goes to the pool of that
+source in the session; the user pages through it and picks one without another call.
+
+Models often answer twice with the same joke or the same reference in other words: `merge`
+drops a variant sharing most of its words with one already in the pool (the Jaccard index of
+their sets of normalised words), which takes milliseconds where comparing the characters took
+over a second per source.
+"""
+import os
+import re
+
+VARIANTS_MAX = int(os.getenv("VARIANTS_MAX", 5))  # variants a single request may ask for
+VARIANTS_SIMILARITY = float(os.getenv("VARIANTS_SIMILARITY", 0.6))  # duplicates share at least this part of their words
+VARIANTS_POOL_SIZE = int(os.getenv("VARIANTS_POOL_SIZE", 20))  # per source, the oldest are dropped first
+
+
+def normalise(text):
+    """`text` lowercased, without punctuation and with single spaces, as compared by `duplicate`."""
+    return " ".join(re.findall(r"\w+", str(text).lower()))
+
+
+def words(text):
+    return set(normalise(text).split())
+
+
+def similarity(text, other):
+    """The words `text` and `other` have in common, over all the words of both (from 0 to 1)."""
+    text, other = words(text), words(other)
+    return len(text & other) / len(text | other) if text or other else 1.0
+
+
+def duplicate(text, pool, threshold=VARIANTS_SIMILARITY):
+    """Whether `text` says about the same as a variant of `pool`."""
+    return any(similarity(text, other) >= threshold for other in pool)
+
+
+def merge(pool, variants, threshold=VARIANTS_SIMILARITY, size=VARIANTS_POOL_SIZE):
+    """Return the pool with the `variants` that are not empty or duplicates appended, at most
+    `size` of them, and the list of the variants added."""
+    pool = list(pool)
+    added = []
+    for variant in variants:
+        if variant and not duplicate(variant, pool, threshold):
+            pool.append(variant)
+            added.append(variant)
+    return pool[-size:], added
+
+
+def page(pool, current, step):
+    """The variant `step` places away from `current` in `pool`, going round."""
+    index = pool.index(current) if current in pool else 0
+    return pool[(index + step) % len(pool)]